@@ -15,12 +15,16 @@ matplotlib.use('Agg')  # Use non-interactive backend
 import matplotlib.pyplot as plt
 from matplotlib.colors import to_rgba
 import umap
+from umap.umap_ import nearest_neighbors
+from sklearn.utils import check_random_state
 import joblib
 import database
 import shap
-from bacpred import BacteriocinPredictor
+from bacpred import extract_features_cached, positive_class_shap
+import model_registry
+import reference_embedding
 import logging
-from Bio import SeqIO, AlignIO, Phylo
+from Bio import AlignIO, Phylo
 from Bio.Align.Applications import ClustalOmegaCommandline
 from Bio.Phylo.TreeConstruction import DistanceCalculator, DistanceTreeConstructor
 from Bio.Seq import Seq
@@ -30,6 +34,14 @@ from io import StringIO
 import tempfile
 import subprocess
 import json
+import time
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 import random
 from datetime import datetime
 import pandas as pd
@@ -41,8 +53,6 @@ logger.setLevel(logging.INFO)
 
 # Constants for file paths
 MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
-SCALER_FILE = os.path.join(MODEL_DIR, 'bacteriocin_scaler.joblib')
-MODEL_FILE = os.path.join(MODEL_DIR, 'bacteriocin_model.joblib')
 
 # Handle the generation of FEATURE_NAMES in one place - comment out older definition
 # FEATURE_NAMES = [f"AA_{aa}" for aa in "ACDEFGHIKLMNPQRSTVWY"] + [f"Di_{a}{b}" for a in "ACDEFGHIKLMNPQRSTVWY" for b in "ACDEFGHIKLMNPQRSTVWY"]
@@ -94,8 +104,7 @@ for aa1 in AA_FEATURES:
 
 # Get full feature names from BacteriocinPredictor
 try:
-    predictor = BacteriocinPredictor()
-    FEATURE_NAMES = predictor.get_feature_names()
+    FEATURE_NAMES = model_registry.get_predictor().get_feature_names()
     logger.info(f"Loaded {len(FEATURE_NAMES)} feature names from BacteriocinPredictor")
 except Exception as e:
     logger.warning(f"Failed to get feature names from BacteriocinPredictor: {e}")
@@ -106,8 +115,43 @@ def encode_protein_sequence(sequence):
     """
     Extract features from a protein sequence using the BacPred feature extraction
     """
-    predictor = BacteriocinPredictor()
-    return predictor.extract_features(sequence)
+    return encode_protein_sequences([sequence])[0]
+
+def encode_protein_sequences(sequences):
+    """
+    Extract features for a list of protein sequences in one vectorized batch,
+    reusing cached vectors for sequences that were featurized before
+    """
+    return extract_features_cached(sequences)
+
+def build_feature_matrix(sequences, stored_features):
+    """
+    Build the feature matrix for a list of sequences from the vectors stored in
+    the collection, featurizing only the rows without a current stored vector
+    
+    Args:
+        sequences (list): Protein sequences
+        stored_features (list): Stored feature vector (or None) for each sequence
+        
+    Returns:
+        numpy.ndarray: (N, n_features) feature matrix in input order
+    """
+    missing = [i for i, vector in enumerate(stored_features) if vector is None]
+    if not missing:
+        return np.vstack(stored_features)
+    
+    logger.info(f"Featurizing {len(missing)} of {len(sequences)} sequences without stored feature vectors "
+                f"(run 'python database.py backfill-features' to precompute them)")
+    computed = encode_protein_sequences([sequences[i] for i in missing])
+    if len(missing) == len(sequences):
+        return computed
+    
+    feature_matrix = np.empty((len(sequences), computed.shape[1]), dtype=np.float64)
+    feature_matrix[missing] = computed
+    for i, vector in enumerate(stored_features):
+        if vector is not None:
+            feature_matrix[i] = vector
+    return feature_matrix
 
 def get_sequences_from_vaults_and_bags(vault_ids, bag_ids):
     """
@@ -119,13 +163,14 @@ def get_sequences_from_vaults_and_bags(vault_ids, bag_ids):
         
     Returns:
         dict: Dictionary containing sequences with their source (reference or candidate)
+              and the feature vector stored in the collection (None if missing or stale)
     """
     sequences = {}
     
     # Get sequences from vaults (reference bacteriocins)
     if vault_ids:
         for vault_id in vault_ids:
-            vault_result = database.get_vault_items(vault_id)
+            vault_result = database.get_vault_items(vault_id, include_features=True)
             if vault_result.get('success', False):
                 for item in vault_result.get('data', []):
                     seq_id = item.get('sequence_id', '')
@@ -133,13 +178,14 @@ def get_sequences_from_vaults_and_bags(vault_ids, bag_ids):
                         sequences[seq_id] = {
                             'sequence': item.get('sequence', ''),
                             'name': item.get('name', seq_id),
-                            'source': 'reference'
+                            'source': 'reference',
+                            'features': item.get('features')
                         }
     
     # Get sequences from bags (candidate bacteriocins)
     if bag_ids:
         for bag_id in bag_ids:
-            bag_result = database.get_bag_items(bag_id)
+            bag_result = database.get_bag_items(bag_id, include_features=True)
             if bag_result.get('success', False):
                 for item in bag_result.get('data', []):
                     seq_id = item.get('sequence_id', '')
@@ -147,35 +193,156 @@ def get_sequences_from_vaults_and_bags(vault_ids, bag_ids):
                         sequences[seq_id] = {
                             'sequence': item.get('sequence', ''),
                             'name': item.get('name', seq_id),
-                            'source': 'candidate'
+                            'source': 'candidate',
+                            'features': item.get('features')
                         }
     
     return sequences
 
-def generate_shap_analysis(feature_matrix, feature_names=None):
+# Rows explained in 'sampled' SHAP mode
+SHAP_MAX_ROWS = int(os.getenv('SHAP_MAX_ROWS', '2000'))
+
+# SHAP stops after this many seconds and reports the rows explained so far (0 disables)
+SHAP_TIME_BUDGET_SECONDS = float(os.getenv('SHAP_TIME_BUDGET_SECONDS', '120'))
+
+# Rows per explainer call; the time budget is checked between calls
+SHAP_CHUNK_ROWS = int(os.getenv('SHAP_CHUNK_ROWS', '256'))
+
+# Rows, rows per call and model evaluations per row of the KernelExplainer fallback
+SHAP_KERNEL_MAX_ROWS = 200
+SHAP_KERNEL_CHUNK_ROWS = 8
+SHAP_KERNEL_SAMPLES = 200
+
+# Processes computing SHAP chunks in parallel per analysis process (1 computes them in-process)
+SHAP_WORKERS = int(os.getenv('SHAP_WORKERS', '1'))
+
+_shap_lock = threading.Lock()
+_shap_executor = None
+_shap_executor_key = None
+
+def _get_shap_executor():
+    """SHAP worker pool of this process for the current model version, created on first use"""
+    global _shap_executor, _shap_executor_key
+    key = (os.getpid(), getattr(model_registry.get_predictor(), 'model_version', None))
+    with _shap_lock:
+        if _shap_executor is None or _shap_executor_key != key:
+            if _shap_executor is not None and _shap_executor_key[0] == os.getpid():
+                # Workers hold explainers of an older model
+                _shap_executor.shutdown(wait=False, cancel_futures=True)
+            _shap_executor = ProcessPoolExecutor(
+                max_workers=SHAP_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _shap_executor_key = key
+            logger.info(f"Started SHAP pool with {SHAP_WORKERS} workers")
+        return _shap_executor
+
+def _reset_shap_executor():
+    global _shap_executor
+    with _shap_lock:
+        _shap_executor = None
+
+def explain_rows(explainer, feature_matrix, rows, shap_values, deadline=None, chunk_rows=SHAP_CHUNK_ROWS,
+                 workers=1, **shap_kwargs):
+    """
+    Compute SHAP values of feature matrix rows chunk by chunk until a deadline
+    
+    With workers > 1 the chunks run in a pool of SHAP_WORKERS processes, each
+    with its own explainer built from the shared model artifact, and
+    explainer is not used.
+    
+    Args:
+        explainer: SHAP explainer
+        feature_matrix (numpy.ndarray): Model input matrix
+        rows (numpy.ndarray): Rows to explain
+        shap_values (numpy.ndarray): Preallocated output matrix, filled in at the explained rows
+        deadline (float): time.perf_counter() value after which no new chunk starts
+        chunk_rows (int): Rows per explainer call
+        workers (int): Parallel worker processes (only for the shared tree explainer)
+        **shap_kwargs: Passed to explainer.shap_values
+    
+    Returns:
+        numpy.ndarray: Sorted rows explained (at least one chunk)
+    """
+    chunks = [rows[start:start + chunk_rows] for start in range(0, len(rows), chunk_rows)]
+    done = []
+    if workers > 1 and len(chunks) > 1:
+        executor = _get_shap_executor()
+        pending = {}
+        next_chunk = 0
+        try:
+            while next_chunk < len(chunks) or pending:
+                # Keep every worker busy, but start no new chunk after the deadline
+                while next_chunk < len(chunks) and len(pending) < 2 * workers and (
+                        next_chunk == 0 or deadline is None or time.perf_counter() <= deadline):
+                    future = executor.submit(model_registry.explain_chunk, feature_matrix[chunks[next_chunk]],
+                                             **shap_kwargs)
+                    pending[future] = next_chunk
+                    next_chunk += 1
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    number = pending.pop(future)
+                    values, seconds, pid = future.result()
+                    shap_values[chunks[number]] = values
+                    done.append(chunks[number])
+                    logger.info(f"SHAP chunk {number + 1}/{len(chunks)}: {len(values)} rows in {seconds:.2f}s "
+                                f"(worker {pid})")
+        except BrokenProcessPool:
+            # A worker was killed (for example out of memory); the next call starts a new pool
+            _reset_shap_executor()
+            raise
+    else:
+        for number, chunk in enumerate(chunks):
+            if done and deadline is not None and time.perf_counter() > deadline:
+                break
+            start = time.perf_counter()
+            shap_values[chunk] = positive_class_shap(
+                explainer.shap_values(feature_matrix[chunk], **shap_kwargs)
+            )
+            done.append(chunk)
+            logger.info(f"SHAP chunk {number + 1}/{len(chunks)}: {len(chunk)} rows in "
+                        f"{time.perf_counter() - start:.2f}s")
+    
+    explained = sum(len(chunk) for chunk in done)
+    if explained < len(rows):
+        logger.warning(f"SHAP time budget exhausted after {explained} of {len(rows)} rows")
+    return np.sort(np.concatenate(done)) if done else rows[:0]
+
+def generate_shap_analysis(feature_matrix, feature_names=None, sequences=None, mode='exact', labels=None,
+                           time_budget=SHAP_TIME_BUDGET_SECONDS):
     """
     Generate SHAP feature importance analysis
     
+    With sequences given, per-sequence SHAP vectors are read from the model
+    registry's SHAP store and only sequences not seen before are explained.
+    
     Args:
         feature_matrix (numpy.ndarray): Matrix of features for analysis
         feature_names (list, optional): Names of features
+        sequences (list, optional): Sequence of each feature matrix row
+        mode (str): 'exact' (TreeSHAP), 'approximate' (Saabas path
+            attribution) or 'sampled' (TreeSHAP on at most SHAP_MAX_ROWS rows)
+        labels (list, optional): Label of each row, kept in proportion when sampling
+        time_budget (float): Seconds after which the rows explained so far are
+            reported (0 or None for no limit)
         
     Returns:
-        dict: Result with SHAP explanation and visualization
+        dict: Result with SHAP explanation and visualization, the mode that
+        ran, the number of rows explained and whether the budget cut it short
     """
     try:
         logger.info("Generating SHAP analysis with feature matrix shape: %s", feature_matrix.shape)
         
-        # Load the model
-        if not os.path.exists(MODEL_FILE):
-            logger.error(f"Model file not found: {MODEL_FILE}")
+        # Get the shared model from the registry
+        model = model_registry.get_model()
+        if model is None:
+            logger.error(f"Model file not found in {model_registry.registry.model_dir}")
             return {
                 'success': False,
                 'message': 'Model file not found for SHAP analysis'
             }
-        
-        # Load the model
-        model = joblib.load(MODEL_FILE)
         logger.info("Model loaded successfully for SHAP analysis")
         
         # Get model feature importances if it's a Random Forest model
@@ -190,21 +357,61 @@ def generate_shap_analysis(feature_matrix, feature_names=None):
             except Exception as e:
                 logger.warning(f"Could not extract model feature importance: {e}")
         
-        # Create a SHAP explainer - handle potential issues with tree structure
+        deadline = time.perf_counter() + time_budget if time_budget else None
+        total_rows = len(feature_matrix)
+        labels = labels if labels is not None else [''] * total_rows
+        
+        # Use the shared tree explainer of this model version - handle potential issues with tree structure
+        shap_store = None
+        shap_kwargs = {}
+        chunk_rows = SHAP_CHUNK_ROWS
+        workers = SHAP_WORKERS
         try:
-            explainer = shap.TreeExplainer(model)
-            logger.info("SHAP TreeExplainer created successfully")
+            explainer = model_registry.get_explainer()
+            if mode == 'sampled':
+                rows = stratified_sample(labels, SHAP_MAX_ROWS)
+            else:
+                rows = np.arange(total_rows)
+            if mode == 'approximate':
+                shap_kwargs['approximate'] = True
+            if sequences is not None:
+                shap_store = model_registry.get_shap_store(approximate=(mode == 'approximate'))
         except Exception as tree_error:
             logger.warning(f"TreeExplainer failed: {tree_error}. Falling back to KernelExplainer.")
-            # Fallback to KernelExplainer which works with any model
+            # Fallback to KernelExplainer which works with any model, on few rows and model evaluations
             background = shap.kmeans(feature_matrix, 10).data  # Create background data
             explainer = shap.KernelExplainer(model.predict_proba, background)
             logger.info("SHAP KernelExplainer created as fallback")
+            mode = 'kernel'
+            rows = stratified_sample(labels, SHAP_KERNEL_MAX_ROWS)
+            shap_kwargs = {'nsamples': SHAP_KERNEL_SAMPLES, 'silent': True}
+            chunk_rows = SHAP_KERNEL_CHUNK_ROWS
+            workers = 1
         
         # Calculate SHAP values - handle both explainer types
         try:
-            shap_values = explainer.shap_values(feature_matrix)
-            logger.info("SHAP values calculated successfully")
+            planned_rows = len(rows)
+            shap_values = np.empty(feature_matrix.shape, dtype=np.float32)
+            if shap_store is not None and shap_store.n_features == feature_matrix.shape[1]:
+                # Explain only the sequences without stored SHAP vectors
+                row_sequences = [sequences[i] for i in rows]
+                stored, found = shap_store.lookup(row_sequences)
+                shap_values[rows[found]] = stored[found]
+                computed = explain_rows(explainer, feature_matrix, rows[~found], shap_values, deadline,
+                                        chunk_rows, workers, **shap_kwargs)
+                shap_store.put([sequences[i] for i in computed], shap_values[computed])
+                rows = np.sort(np.concatenate([rows[found], computed]))
+                logger.info(f"SHAP values calculated for {len(computed)} sequences, "
+                            f"{int(found.sum())} read from the SHAP store")
+            else:
+                rows = explain_rows(explainer, feature_matrix, rows, shap_values, deadline,
+                                    chunk_rows, workers, **shap_kwargs)
+                logger.info(f"SHAP values calculated for {len(rows)} sequences")
+            
+            # Later steps only see the explained rows
+            partial = len(rows) < planned_rows
+            shap_values = shap_values[rows]
+            feature_matrix = feature_matrix[rows]
         except Exception as e:
             logger.error(f"Error calculating SHAP values: {e}")
             return {
@@ -212,11 +419,6 @@ def generate_shap_analysis(feature_matrix, feature_names=None):
                 'message': f"Failed to calculate SHAP values: {str(e)}"
             }
         
-        # If we have multiple classes, take the class 1 (bacteriocin) SHAP values
-        if isinstance(shap_values, list):
-            logger.info(f"Multiple SHAP value sets found ({len(shap_values)}), using class 1")
-            shap_values = shap_values[1]  # Class 1 (bacteriocin)
-        
         # Get feature names if not provided
         if feature_names is None:
             feature_names = FEATURE_NAMES
@@ -228,7 +430,7 @@ def generate_shap_analysis(feature_matrix, feature_names=None):
         
         # Create a summary plot using Plotly
         # Get the mean absolute SHAP values for each feature
-        mean_abs_shap = np.abs(shap_values).mean(0)
+        mean_abs_shap = np.abs(shap_values).mean(0, dtype=np.float64)
         logger.info("Calculated mean absolute SHAP values")
         
         # Sort features by importance
@@ -252,9 +454,14 @@ def generate_shap_analysis(feature_matrix, feature_names=None):
             )
         ))
         
+        # Note in the title when not every sequence was explained exactly
+        title = 'Top 20 Features by SHAP Importance'
+        if mode != 'exact' or len(rows) < total_rows:
+            title += f" ({mode}, {len(rows)} of {total_rows} sequences)"
+        
         # Update layout
         fig.update_layout(
-            title='Top 20 Features by SHAP Importance',
+            title=title,
             xaxis_title='Mean |SHAP Value|',
             yaxis_title='Feature',
             height=600,
@@ -329,7 +536,10 @@ def generate_shap_analysis(feature_matrix, feature_names=None):
             'shap_html': shap_html,
             'waterfall_html': waterfall_html,
             'feature_importance': feature_importance,
-            'model_feature_importance': model_feature_importance
+            'model_feature_importance': model_feature_importance,
+            'shap_mode': mode,
+            'shap_sample_size': len(rows),
+            'shap_partial': bool(partial)
         }
     except Exception as e:
         logger.error(f"Error in SHAP analysis: {e}")
@@ -343,7 +553,608 @@ def generate_shap_analysis(feature_matrix, feature_names=None):
             'feature_importance': []
         }
 
-def generate_umap_visualization(vault_ids, bag_ids):
+# Pipeline stage outputs kept in memory per process
+ANALYSIS_STAGE_CACHE_SIZE = int(os.getenv('ANALYSIS_STAGE_CACHE_SIZE', '16'))
+
+# Memory the in-process stage outputs may hold; larger outputs are only kept on disk
+ANALYSIS_STAGE_CACHE_MAX_MB = float(os.getenv('ANALYSIS_STAGE_CACHE_MAX_MB', '256'))
+
+# Optional directory where stage outputs are shared between analysis processes
+ANALYSIS_STAGE_CACHE_DIR = os.getenv('ANALYSIS_STAGE_CACHE_DIR') or None
+
+# Stage outputs kept in ANALYSIS_STAGE_CACHE_DIR (oldest are removed first)
+ANALYSIS_STAGE_CACHE_DISK_ENTRIES = int(os.getenv('ANALYSIS_STAGE_CACHE_DISK_ENTRIES', '256'))
+
+# UMAP settings shared by the 2D and 3D embeddings
+UMAP_N_NEIGHBORS = 15
+UMAP_METRIC = 'euclidean'
+UMAP_RANDOM_STATE = 42
+
+# Above this many sequences UMAP is fit on landmarks and the rest are transformed
+UMAP_LANDMARK_THRESHOLD = int(os.getenv('UMAP_LANDMARK_THRESHOLD', '20000'))
+
+# Landmarks in large-collection mode: references first, then a sample of candidates
+UMAP_LANDMARKS = int(os.getenv('UMAP_LANDMARKS', '10000'))
+
+# Most points drawn in the UMAP plot; larger sets are drawn as a stratified sample
+UMAP_PLOT_MAX_POINTS = int(os.getenv('UMAP_PLOT_MAX_POINTS', '20000'))
+
+def _memory_usage():
+    """Current and peak resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(status['VmRSS'].split()[0]) / 1024, int(status['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return 0.0, 0.0
+
+def _reset_peak_memory():
+    """Reset the peak RSS so the next reading covers a single stage (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def warm_up():
+    """
+    Compile UMAP's numba kernels with a tiny fit and transform on synthetic data
+    
+    Most of UMAP's kernels are not cached on disk, so every new process pays
+    the compilation on its first fit. Running this at process start moves that
+    cost out of the first analysis.
+    
+    Returns:
+        float: Seconds taken
+    """
+    start = time.perf_counter()
+    data = np.random.RandomState(UMAP_RANDOM_STATE).rand(64, 16)
+    # Fit on an NN-descent graph, as the pipeline's neighbors stage does
+    knn = nearest_neighbors(data, 10, UMAP_METRIC, {}, False, check_random_state(UMAP_RANDOM_STATE),
+                            low_memory=True, n_jobs=1)
+    reducer = umap.UMAP(n_neighbors=10, metric=UMAP_METRIC, random_state=UMAP_RANDOM_STATE, precomputed_knn=knn)
+    reducer.fit(data)
+    reducer.transform(data[:8])
+    return time.perf_counter() - start
+
+def stratified_sample(labels, size, seed=UMAP_RANDOM_STATE):
+    """
+    Sample row indices keeping each label's share of the rows
+    
+    Args:
+        labels (list): Label of each row
+        size (int): Number of rows to keep
+        seed (int): Random seed
+    
+    Returns:
+        numpy.ndarray: Sorted row indices (all rows when there are at most size)
+    """
+    if len(labels) <= size:
+        return np.arange(len(labels))
+    
+    random_state = np.random.RandomState(seed)
+    labels = np.asarray(labels)
+    rows = []
+    for label in np.unique(labels):
+        label_rows = np.flatnonzero(labels == label)
+        share = max(1, int(round(size * len(label_rows) / len(labels))))
+        rows.append(random_state.choice(label_rows, min(share, len(label_rows)), replace=False))
+    return np.sort(np.concatenate(rows))
+
+def _nbytes(value, seen=None, depth=0):
+    """
+    Approximate memory held by a stage output
+    
+    Counts arrays, strings and the containers and plain objects (such as the
+    NN-descent search index) that hold them. Arrays shared between parts of
+    the value are counted once.
+    
+    Args:
+        value: Stage output
+    
+    Returns:
+        int: Size in bytes
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen or depth > 6:
+        return 0
+    seen.add(id(value))
+    
+    if isinstance(value, np.ndarray):
+        base = value.base if isinstance(value.base, np.ndarray) else None
+        if base is not None and id(base) in seen:
+            return 0
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_nbytes(item, seen, depth + 1) for pair in value.items() for item in pair)
+    if isinstance(value, (list, tuple, set)):
+        return sum(_nbytes(item, seen, depth + 1) for item in value)
+    if hasattr(value, '__dict__') and not callable(value):
+        return _nbytes(vars(value), seen, depth + 1)
+    return 0
+
+class StageCache:
+    """
+    LRU cache of pipeline stage outputs with an optional joblib disk tier
+    
+    The memory tier holds at most max_entries outputs and max_mb megabytes.
+    """
+    
+    def __init__(self, max_entries=ANALYSIS_STAGE_CACHE_SIZE, cache_dir=ANALYSIS_STAGE_CACHE_DIR,
+                 max_disk_entries=ANALYSIS_STAGE_CACHE_DISK_ENTRIES, max_mb=ANALYSIS_STAGE_CACHE_MAX_MB):
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.joblib")
+    
+    def get(self, key):
+        """Return (found, value) for a stage key"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return True, self._entries[key]
+        
+        if self.cache_dir:
+            try:
+                value = joblib.load(self._path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Could not read stage cache entry {key}: {e}")
+            else:
+                self._remember(key, value)
+                with self._lock:
+                    self.stats['disk_hits'] += 1
+                return True, value
+        
+        with self._lock:
+            self.stats['misses'] += 1
+        return False, None
+    
+    def _remember(self, key, value):
+        size = _nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            # An output larger than the whole budget would evict everything else
+            if size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(evicted)
+    
+    def put(self, key, value):
+        """Store a stage output"""
+        if self.max_entries > 0 and self.max_bytes > 0:
+            self._remember(key, value)
+        if not self.cache_dir:
+            return
+        
+        try:
+            temp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            joblib.dump(value, temp_path)
+            os.replace(temp_path, self._path(key))
+            
+            # Keep the most recently written entries
+            entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                       if name.endswith('.joblib')]
+            if len(entries) > self.max_disk_entries:
+                entries.sort(key=os.path.getmtime)
+                for path in entries[:len(entries) - self.max_disk_entries]:
+                    os.unlink(path)
+        except Exception as e:
+            logger.warning(f"Could not write stage cache entry {key}: {e}")
+
+stage_cache = StageCache()
+
+class AnalysisPipeline:
+    """
+    Analysis of one set of sequences, split into memoized stages
+        
+        fetch -> featurize -> neighbors -> embed (2D, 3D)
+                           -> reference_neighbors -> project (2D, 3D)
+                           -> explain (SHAP)
+        fetch -> align -> distance -> tree
+    
+    Stage outputs are cached under a digest of the fetched sequences (plus the
+    model version for stages that depend on the model), so the UMAP, MSA and
+    phylogeny tools run only the stages they need and reuse the alignments
+    and matrices computed for the same sequences by the other tools.
+    """
+    
+    def __init__(self, vault_ids=None, bag_ids=None, sequence_data=None, cache=None):
+        """
+        Args:
+            vault_ids (list): Vault IDs to include (reference bacteriocins)
+            bag_ids (list): Bag IDs to include (candidate bacteriocins)
+            sequence_data (list): Sequence dictionaries to use instead of the vaults and bags
+            cache (StageCache): Stage cache (defaults to the shared stage_cache)
+        """
+        self.vault_ids = vault_ids or []
+        self.bag_ids = bag_ids or []
+        self.sequence_data = sequence_data
+        self.cache = cache if cache is not None else stage_cache
+        self.num_found = 0
+        self.timings = {}
+        self.memory = {}
+        self._sequences = None
+        self._stored_features = None
+        self._digest = None
+        self._landmarks = None
+    
+    def fetch(self):
+        """
+        Stage 1: the sequences to analyze
+        
+        Returns:
+            list: Sequence dictionaries (id, name, sequence, source)
+        """
+        if self._sequences is not None:
+            return self._sequences
+        
+        with self._measure('fetch'):
+            self._fetch()
+        return self._sequences
+    
+    def _fetch(self):
+        if self.sequence_data:
+            self._sequences = [
+                {key: seq.get(key) for key in ('id', 'name', 'sequence', 'source')}
+                for seq in self.sequence_data
+            ]
+            self._stored_features = [None] * len(self._sequences)
+            self.num_found = len(self._sequences)
+        else:
+            # Get sequences from selected vaults and bags
+            sequences = get_sequences_from_vaults_and_bags(self.vault_ids, self.bag_ids)
+            self.num_found = len(sequences)
+            self._sequences = []
+            self._stored_features = []
+            for seq_id, seq_data in sequences.items():
+                sequence = seq_data['sequence']
+                if not sequence or len(sequence) < 5:
+                    logger.warning(f"Skipping too short sequence: {seq_id}")
+                    continue
+                
+                self._sequences.append({
+                    'id': seq_id,
+                    'name': seq_data['name'],
+                    'sequence': sequence,
+                    'source': seq_data['source']
+                })
+                self._stored_features.append(seq_data.get('features'))
+    
+    @property
+    def digest(self):
+        """SHA-256 of the fetched sequences, identifying the request set"""
+        if self._digest is None:
+            document = json.dumps(
+                [[seq['id'], seq['name'], seq['sequence'], seq['source']] for seq in self.fetch()],
+                separators=(',', ':'), default=str
+            )
+            self._digest = hashlib.sha256(document.encode('utf-8')).hexdigest()
+        return self._digest
+    
+    @staticmethod
+    def _model_version():
+        predictor = model_registry.get_predictor()
+        return getattr(predictor, 'model_version', None)
+    
+    @contextmanager
+    def _measure(self, name):
+        """Record the time, RSS and peak RSS of a stage"""
+        _reset_peak_memory()
+        start = time.perf_counter()
+        yield
+        self.timings[name] = time.perf_counter() - start
+        rss, peak = _memory_usage()
+        self.memory[name] = {'rss_mb': round(rss, 1), 'peak_rss_mb': round(peak, 1)}
+    
+    def stage_report(self):
+        """
+        Time and memory of each stage run by this pipeline
+        
+        Returns:
+            dict: Stage name to seconds, RSS and peak RSS in MB (reused
+            stage outputs report 0 seconds and no memory)
+        """
+        return {
+            name: dict({'seconds': round(seconds, 3)}, **self.memory.get(name, {}))
+            for name, seconds in self.timings.items()
+        }
+    
+    def _stage(self, name, compute, *key_parts, keep=None):
+        """
+        Return a stage output from the cache, computing and storing it on a miss
+        
+        keep, if given, is called with a computed output and decides whether it is stored
+        """
+        document = json.dumps([name, self.digest, list(key_parts)], default=str)
+        key = hashlib.sha256(document.encode('utf-8')).hexdigest()
+        found, value = self.cache.get(key)
+        if found:
+            logger.info(f"Reusing {name} stage output for {len(self.fetch())} sequences")
+            self.timings.setdefault(name, 0.0)
+            return value
+        
+        with self._measure(name):
+            value = compute()
+        logger.info(f"Computed {name} stage for {len(self.fetch())} sequences in {self.timings[name]:.2f}s "
+                    f"(peak RSS {self.memory[name]['peak_rss_mb']:.0f} MB)")
+        if keep is None or keep(value):
+            self.cache.put(key, value)
+        return value
+    
+    def featurize(self):
+        """
+        Stage 2: the model input matrix
+        
+        Returns:
+            tuple: (feature matrix, feature names); the matrix is scaled when the
+            shared scaler and feature schema are available
+        """
+        return self._stage('featurize', self._featurize, self._model_version())
+    
+    def _featurize(self):
+        sequences = self.fetch()
+        
+        # Read the precomputed feature vectors, extracting only the missing ones
+        feature_vectors = build_feature_matrix([s['sequence'] for s in sequences], self._stored_features)
+        
+        # Select the model input columns and use the shared feature scaler if available
+        scaler = model_registry.get_scaler()
+        schema = model_registry.get_feature_schema()
+        if scaler is not None and schema is not None:
+            try:
+                feature_matrix = scaler.transform(feature_vectors[:, schema.feature_idx])
+                logger.info(f"Scaled feature matrix with shape: {feature_matrix.shape}")
+                return feature_matrix, list(schema.feature_names)
+            except Exception as e:
+                logger.error(f"Error loading or applying scaler: {e}")
+        
+        # If scaler is not available, use raw features
+        logger.info(f"Using unscaled feature matrix with shape: {feature_vectors.shape}")
+        return feature_vectors, list(FEATURE_NAMES)
+    
+    def landmarks(self):
+        """
+        Rows UMAP is fit on
+        
+        Collections of more than UMAP_LANDMARK_THRESHOLD sequences are fit on
+        UMAP_LANDMARKS landmarks: the references (sampled if there are more)
+        plus a sample of the candidates. The other rows are placed with
+        transform.
+        
+        Returns:
+            numpy.ndarray: Sorted row indices, or None to fit on all rows
+        """
+        sequences = self.fetch()
+        if len(sequences) <= max(UMAP_LANDMARK_THRESHOLD, UMAP_LANDMARKS):
+            return None
+        
+        if self._landmarks is None:
+            random_state = np.random.RandomState(UMAP_RANDOM_STATE)
+            sources = np.array([s['source'] for s in sequences])
+            references = np.flatnonzero(sources == 'reference')
+            candidates = np.flatnonzero(sources != 'reference')
+            if len(references) > UMAP_LANDMARKS:
+                references = random_state.choice(references, UMAP_LANDMARKS, replace=False)
+            candidates = random_state.choice(candidates, UMAP_LANDMARKS - len(references), replace=False)
+            self._landmarks = np.sort(np.concatenate([references, candidates]))
+            logger.info(f"Fitting UMAP on {len(self._landmarks)} landmarks ({len(references)} references) "
+                        f"of {len(sequences)} sequences")
+        return self._landmarks
+    
+    def _fit_matrix(self):
+        """Feature matrix rows UMAP is fit on"""
+        feature_matrix, _ = self.featurize()
+        landmarks = self.landmarks()
+        return feature_matrix if landmarks is None else feature_matrix[landmarks]
+    
+    def n_neighbors(self):
+        """UMAP neighborhood size for the fetched sequences"""
+        landmarks = self.landmarks()
+        num_fit = len(self.fetch()) if landmarks is None else len(landmarks)
+        return min(UMAP_N_NEIGHBORS, num_fit - 1)  # Adjust n_neighbors based on dataset size
+    
+    def neighbors(self):
+        """
+        Stage 3a: approximate k-nearest-neighbor graph of the rows UMAP is fit on
+        
+        Computed once per sequence set and shared by every embedding, whatever
+        its number of components or min_dist.
+        
+        Returns:
+            tuple: (knn_indices, knn_dists, knn_search_index); the indices and
+            distances are (N, n_neighbors) and the search index is used to
+            transform new rows
+        """
+        num_landmarks = None if self.landmarks() is None else UMAP_LANDMARKS
+        return self._stage('neighbors', self._neighbors, self.n_neighbors(), UMAP_METRIC, num_landmarks,
+                           self._model_version())
+    
+    def _neighbors(self):
+        # Approximate neighbors with low-memory NN-descent, as UMAP does for large data
+        return nearest_neighbors(
+            self._fit_matrix(), self.n_neighbors(), UMAP_METRIC, {}, False,
+            check_random_state(UMAP_RANDOM_STATE), low_memory=True, n_jobs=1
+        )
+    
+    def embed(self, n_components, min_dist=0.1):
+        """
+        Stage 3b: UMAP embedding of the feature matrix
+        
+        In large-collection mode UMAP is fit on the landmarks and the other
+        rows are transformed in parallel chunks.
+        
+        Args:
+            n_components (int): 2 or 3
+            min_dist (float): UMAP min_dist
+        
+        Returns:
+            numpy.ndarray: (N, n_components) coordinates
+        """
+        num_landmarks = None if self.landmarks() is None else UMAP_LANDMARKS
+        return self._stage(f'embed{n_components}d', lambda: self._embed(n_components, min_dist),
+                           n_components, min_dist, num_landmarks, self._model_version())
+    
+    def _embed(self, n_components, min_dist):
+        reducer = umap.UMAP(
+            n_components=n_components,
+            n_neighbors=self.n_neighbors(),
+            min_dist=min_dist,
+            metric=UMAP_METRIC,
+            random_state=UMAP_RANDOM_STATE,
+            precomputed_knn=self.neighbors()
+        )
+        embedding = reducer.fit_transform(self._fit_matrix())
+        
+        landmarks = self.landmarks()
+        if landmarks is None:
+            return embedding
+        
+        feature_matrix, _ = self.featurize()
+        other_rows = np.setdiff1d(np.arange(len(feature_matrix)), landmarks)
+        coords = np.empty((len(feature_matrix), n_components), dtype=embedding.dtype)
+        coords[landmarks] = embedding
+        coords[other_rows] = reference_embedding.transform_in_chunks(reducer, feature_matrix[other_rows])
+        return coords
+    
+    def reference_neighbors(self, umap_params, max_fit_rows=None):
+        """
+        Stage 3c: approximate k-nearest-neighbor graph of the reference rows
+        
+        Computed only when the saved reference embedding has to be fit, and
+        shared by its 2D and 3D fits.
+        
+        Args:
+            umap_params (dict): n_neighbors, metric and random_state (min_dist is ignored)
+            max_fit_rows (int): Largest reference sample UMAP is fit on
+        
+        Returns:
+            tuple: (knn_indices, knn_dists, knn_search_index)
+        """
+        def compute():
+            sources = np.array([s['source'] for s in self.fetch()])
+            feature_matrix, _ = self.featurize()
+            return reference_embedding.neighbors(feature_matrix[sources == 'reference'], umap_params, max_fit_rows)
+        
+        return self._stage('reference_neighbors', compute, umap_params['n_neighbors'], umap_params['metric'],
+                           umap_params['random_state'], max_fit_rows, self._model_version())
+    
+    def project(self, n_components, min_dist=0.1):
+        """
+        Stage 3d: coordinates on the saved reference embedding of the vaults
+        
+        Falls back to embed() when reference embedding is disabled, there are
+        too few references or the saved fit cannot be used.
+        
+        Args:
+            n_components (int): 2 or 3
+            min_dist (float): UMAP min_dist
+        
+        Returns:
+            numpy.ndarray: (N, n_components) coordinates
+        """
+        if reference_embedding.REFERENCE_EMBEDDING_ENABLED and self.vault_ids:
+            sequences = self.fetch()
+            feature_matrix, _ = self.featurize()
+            sources = [s['source'] for s in sequences]
+            umap_params = {
+                'n_neighbors': UMAP_N_NEIGHBORS,
+                'min_dist': min_dist,
+                'metric': UMAP_METRIC,
+                'random_state': UMAP_RANDOM_STATE
+            }
+            # Large reference sets are fit on landmarks too
+            max_fit_rows = UMAP_LANDMARKS if sources.count('reference') > UMAP_LANDMARK_THRESHOLD else None
+            name = f'project{n_components}d'
+            try:
+                with self._measure(name):
+                    coords = reference_embedding.embed(
+                        [s['sequence'] for s in sequences], sources, feature_matrix,
+                        self.vault_ids, n_components, self._model_version(), umap_params, max_fit_rows,
+                        reference_neighbors=lambda: self.reference_neighbors(umap_params, max_fit_rows)
+                    )
+            except Exception as e:
+                logger.error(f"Error using reference embedding, refitting on all sequences: {e}")
+                coords = None
+            if coords is not None:
+                return coords
+            self.timings.pop(name, None)
+            self.memory.pop(name, None)
+        return self.embed(n_components, min_dist)
+    
+    def explain(self, mode='exact'):
+        """
+        Stage 4: SHAP feature importance of the model on the feature matrix
+        
+        Results cut short by the SHAP time budget are not memoized, so a rerun
+        continues from the SHAP values stored so far.
+        
+        Args:
+            mode (str): SHAP mode (see generate_shap_analysis)
+        
+        Returns:
+            dict: Result of generate_shap_analysis
+        """
+        sample_size = SHAP_MAX_ROWS if mode == 'sampled' else None
+        return self._stage('explain', lambda: self._explain(mode), mode, sample_size, self._model_version(),
+                           keep=lambda result: not result.get('shap_partial'))
+    
+    def _explain(self, mode):
+        feature_matrix, feature_names = self.featurize()
+        sequences = self.fetch()
+        return generate_shap_analysis(
+            feature_matrix, feature_names, [s['sequence'] for s in sequences],
+            mode=mode, labels=[s['source'] for s in sequences]
+        )
+    
+    def align(self):
+        """
+        Stage 5: multiple sequence alignment
+        
+        Returns:
+            tuple: (Bio.Align.MultipleSeqAlignment, note or None)
+        """
+        return self._stage('align', lambda: align_sequences(self.fetch()))
+    
+    def distance(self):
+        """
+        Stage 6: identity distance matrix of the alignment
+        
+        Returns:
+            Bio.Phylo.TreeConstruction.DistanceMatrix
+        """
+        return self._stage('distance', lambda: DistanceCalculator('identity').get_distance(self.align()[0]))
+    
+    def tree(self):
+        """
+        Stage 7: UPGMA tree built from the distance matrix
+        
+        Returns:
+            Bio.Phylo.BaseTree.Tree
+        """
+        return self._stage('tree', lambda: DistanceTreeConstructor().upgma(self.distance()))
+
+def generate_umap_visualization(vault_ids, bag_ids, progress=None, pipeline=None, shap_mode='exact'):
     """
     Generate a UMAP 2D and 3D visualization for selected bacteriocin sequences using Plotly
     with SHAP feature importance analysis
@@ -351,102 +1162,62 @@ def generate_umap_visualization(vault_ids, bag_ids):
     Args:
         vault_ids (list): List of vault IDs to include (reference bacteriocins)
         bag_ids (list): List of bag IDs to include (candidate bacteriocins)
+        progress (callable): Optional callback called with (fraction, message)
+        pipeline (AnalysisPipeline): Pipeline to take the stage outputs from
+            (defaults to a pipeline over vault_ids and bag_ids)
+        shap_mode (str): 'exact', 'approximate' or 'sampled' (see generate_shap_analysis)
         
     Returns:
         dict: Result with success status and visualization data
     """
+    progress = progress or (lambda fraction, message: None)
     try:
         # Get sequences from selected vaults and bags
-        sequences = get_sequences_from_vaults_and_bags(vault_ids, bag_ids)
+        progress(0.05, 'Loading sequences')
+        pipeline = pipeline or AnalysisPipeline(vault_ids, bag_ids)
+        sequences_data = pipeline.fetch()
         
-        if not sequences:
+        if not pipeline.num_found:
             return {
                 'success': False,
                 'message': 'No sequences found in the selected vaults and bags'
             }
         
-        logger.info(f"Generating UMAP visualization for {len(sequences)} sequences")
+        logger.info(f"Generating UMAP visualization for {pipeline.num_found} sequences")
         
-        # Extract features for each sequence
-        feature_vectors = []
-        labels = []
-        seq_ids = []
-        names = []
-        sequences_data = []
+        labels = [seq['source'] for seq in sequences_data]
+        seq_ids = [seq['id'] for seq in sequences_data]
+        names = [seq['name'] for seq in sequences_data]
         
-        for seq_id, seq_data in sequences.items():
-            sequence = seq_data['sequence']
-            source = seq_data['source']
-            name = seq_data['name']
-            
-            if not sequence or len(sequence) < 5:
-                logger.warning(f"Skipping too short sequence: {seq_id}")
-                continue
-            
+        # Read the precomputed feature vectors, extracting only the missing ones
+        progress(0.15, 'Computing features')
+        feature_matrix = []
+        if sequences_data:
             try:
-                # Extract features using BacPred feature extraction
-                features = encode_protein_sequence(sequence)
-                feature_vectors.append(features)
-                labels.append(source)
-                seq_ids.append(seq_id)
-                names.append(name)
-                sequences_data.append({
-                    'id': seq_id,
-                    'name': name,
-                    'sequence': sequence,
-                    'source': source
-                })
+                feature_matrix, feature_names = pipeline.featurize()
             except Exception as e:
-                logger.error(f"Error extracting features for {seq_id}: {e}")
+                logger.error(f"Error extracting features: {e}")
         
-        if not feature_vectors:
+        if len(feature_matrix) == 0:
             return {
                 'success': False,
                 'message': 'Failed to extract features from sequences'
             }
         
-        # Load the feature scaler if available
-        scaler = None
-        if os.path.exists(SCALER_FILE):
-            try:
-                scaler = joblib.load(SCALER_FILE)
-                feature_matrix = scaler.transform(feature_vectors)
-                logger.info(f"Scaled feature matrix with shape: {feature_matrix.shape}")
-            except Exception as e:
-                logger.error(f"Error loading or applying scaler: {e}")
-                feature_matrix = np.array(feature_vectors)
-        else:
-            # If scaler is not available, use raw features
-            feature_matrix = np.array(feature_vectors)
-            logger.info(f"Using unscaled feature matrix with shape: {feature_matrix.shape}")
-        
         # Apply UMAP dimensionality reduction for 2D
-        n_neighbors = min(15, len(feature_matrix) - 1)  # Adjust n_neighbors based on dataset size
-        umap_reducer_2d = umap.UMAP(
-            n_components=2, 
-            n_neighbors=n_neighbors, 
-            min_dist=0.1, 
-            metric='euclidean', 
-            random_state=42
-        )
-        
-        umap_result_2d = umap_reducer_2d.fit_transform(feature_matrix)
+        progress(0.25, 'Computing 2D UMAP projection')
+        umap_result_2d = pipeline.project(2)
         logger.info("Generated 2D UMAP projection")
         
         # Apply UMAP dimensionality reduction for 3D
-        umap_reducer_3d = umap.UMAP(
-            n_components=3, 
-            n_neighbors=n_neighbors, 
-            min_dist=0.1, 
-            metric='euclidean', 
-            random_state=42
-        )
-        
-        umap_result_3d = umap_reducer_3d.fit_transform(feature_matrix)
+        progress(0.45, 'Computing 3D UMAP projection')
+        umap_result_3d = pipeline.project(3)
         logger.info("Generated 3D UMAP projection")
         
         # Generate SHAP analysis
-        shap_result = generate_shap_analysis(feature_matrix, FEATURE_NAMES)
+        progress(0.65, 'Computing SHAP feature importance')
+        shap_result = pipeline.explain(shap_mode)
+        progress(0.85, 'Rendering plots')
         
         # Create Plotly subplot figure with 2D and 3D plots
         fig = make_subplots(
@@ -465,10 +1236,15 @@ def generate_umap_visualization(vault_ids, bag_ids):
         # Assign unique IDs to each point for cross-highlighting
         point_ids = [f"point_{i}" for i in range(len(seq_ids))]
         
+        # Large sets are drawn as a stratified sample to keep the plot responsive
+        plot_rows = stratified_sample(labels, UMAP_PLOT_MAX_POINTS)
+        if len(plot_rows) < len(labels):
+            logger.info(f"Plotting {len(plot_rows)} of {len(labels)} points")
+        
         # Create scatter plots for each category in 2D
         for category in set(labels):
             # Create mask for this category
-            indices = [i for i, l in enumerate(labels) if l == category]
+            indices = [i for i in plot_rows if labels[i] == category]
             
             hover_texts = []
             for i in indices:
@@ -849,13 +1625,17 @@ def generate_umap_visualization(vault_ids, bag_ids):
         # Generate plot HTML using plotly
         plot_html = plotly.io.to_html(fig, full_html=False, include_plotlyjs=False)
         logger.info("UMAP visualization complete")
+        for name, report in pipeline.stage_report().items():
+            logger.info(f"UMAP stage {name}: {report}")
         
         # Prepare the return data
         result = {
             'success': True,
             'plot_html': plot_html,
             'plot_data': fig.data,  # Include raw plot data for direct rendering
-            'points': len(sequences),
+            'points': pipeline.num_found,
+            'plotted_points': len(plot_rows),
+            'stages': pipeline.stage_report(),
             'reference_count': labels.count('reference'),
             'candidate_count': labels.count('candidate'),
             'timestamp': datetime.now().isoformat(),
@@ -868,6 +1648,9 @@ def generate_umap_visualization(vault_ids, bag_ids):
             result['shap_data'] = shap_result.get('feature_importance')
             result['waterfall_html'] = shap_result.get('waterfall_html')
             result['waterfall_data'] = shap_result.get('waterfall_data')
+            result['shap_mode'] = shap_result.get('shap_mode')
+            result['shap_sample_size'] = shap_result.get('shap_sample_size')
+            result['shap_partial'] = shap_result.get('shap_partial')
             
         # Convert any numpy arrays to Python native types for JSON serialization
         try:
@@ -885,25 +1668,18 @@ def generate_umap_visualization(vault_ids, bag_ids):
             'message': f"Error generating UMAP visualization: {str(e)}"
         } 
 
-def generate_multiple_sequence_alignment(sequence_data):
+def align_sequences(sequence_data):
     """
-    Generate multiple sequence alignment visualization using Clustal Omega
+    Align sequences with Clustal Omega, falling back to pairwise alignment
+    against the first sequence when Clustal Omega is not available
     
     Args:
         sequence_data (list): List of sequence data dictionaries with id, name, sequence, etc.
         
     Returns:
-        dict: Result with success status and alignment visualization
+        tuple: (Bio.Align.MultipleSeqAlignment, note or None)
     """
     try:
-        if not sequence_data or len(sequence_data) < 2:
-            return {
-                'success': False,
-                'message': 'Multiple sequence alignment requires at least 2 sequences'
-            }
-        
-        logger.info(f"Generating multiple sequence alignment for {len(sequence_data)} sequences")
-        
         # Create temporary files for input and output
         with tempfile.NamedTemporaryFile(mode='w+', suffix='.fasta', delete=False) as input_file, \
              tempfile.NamedTemporaryFile(mode='w+', suffix='.clustal', delete=False) as output_file:
@@ -933,92 +1709,59 @@ def generate_multiple_sequence_alignment(sequence_data):
                 # Read the alignment file
                 alignment = AlignIO.read(output_path, "clustal")
                 logger.info(f"Read alignment with {len(alignment)} sequences of length {alignment.get_alignment_length()}")
-                
-                # Create alignment visualization using Plotly
-                fig = generate_msa_visualization(alignment, sequence_data)
-                
-                # Convert to HTML
-                msa_html = fig.to_html(include_plotlyjs='cdn', full_html=False)
-                
-                # Return result
-                return {
-                    'success': True,
-                    'msa_html': msa_html,
-                    'alignment_length': alignment.get_alignment_length(),
-                    'num_sequences': len(alignment)
-                }
+                return alignment, None
                 
             except Exception as e:
                 logger.error(f"Error running Clustal Omega: {e}")
                 logger.info("Falling back to Bio.Align for MSA")
-                
-                # Fallback to manual alignment using Biopython
-                records = []
-                for seq in sequence_data:
-                    records.append(SeqRecord(
-                        Seq(seq['sequence']),
-                        id=f"{seq['id']}_{seq['name']}",
-                        name=seq['name'],
-                        description=""
-                    ))
-                
-                # Create a simple alignment (this is not as good as Clustal Omega)
-                from Bio import pairwise2
-                from Bio.Align import MultipleSeqAlignment
-                
-                # Start with the first sequence
-                aligned_records = [records[0]]
-                
-                # For each remaining sequence, align it to the first one
-                for record in records[1:]:
-                    # Align this sequence to the first one
-                    alignments = pairwise2.align.globalms(
-                        str(records[0].seq), 
-                        str(record.seq),
-                        2, -1, -0.5, -0.1
-                    )
-                    
-                    # Get the best alignment
-                    if alignments:
-                        best = alignments[0]
-                        # Create new sequence with gaps
-                        aligned_seq = SeqRecord(
-                            Seq(best.seqB),
-                            id=record.id,
-                            name=record.name,
-                            description=""
-                        )
-                        aligned_records.append(aligned_seq)
-                    else:
-                        # If alignment fails, just add the original sequence
-                        aligned_records.append(record)
-                
-                # Create a MultipleSeqAlignment object
-                alignment = MultipleSeqAlignment(aligned_records)
-                
-                # Create alignment visualization using Plotly
-                fig = generate_msa_visualization(alignment, sequence_data)
-                
-                # Convert to HTML
-                msa_html = fig.to_html(include_plotlyjs='cdn', full_html=False)
-                
-                # Return result
-                return {
-                    'success': True,
-                    'msa_html': msa_html,
-                    'alignment_length': len(aligned_records[0].seq),
-                    'num_sequences': len(aligned_records),
-                    'note': "Using Biopython alignment (Clustal Omega not available)"
-                }
-    
-    except Exception as e:
-        logger.error(f"Error generating multiple sequence alignment: {e}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        return {
-            'success': False,
-            'message': f"Error generating multiple sequence alignment: {str(e)}"
-        }
+        
+        # Fallback to manual alignment using Biopython
+        records = []
+        for seq in sequence_data:
+            records.append(SeqRecord(
+                Seq(seq['sequence']),
+                id=f"{seq['id']}_{seq['name']}",
+                name=seq['name'],
+                description=""
+            ))
+        
+        # Sequences of the same length are used as they are
+        if len({len(record.seq) for record in records}) == 1:
+            return MultipleSeqAlignment(records), "Unaligned sequences of equal length (Clustal Omega not available)"
+        
+        # Create a simple alignment (this is not as good as Clustal Omega)
+        from Bio import pairwise2
+        
+        # Start with the first sequence
+        aligned_records = [records[0]]
+        
+        # For each remaining sequence, align it to the first one
+        for record in records[1:]:
+            # Align this sequence to the first one
+            alignments = pairwise2.align.globalms(
+                str(records[0].seq), 
+                str(record.seq),
+                2, -1, -0.5, -0.1
+            )
+            
+            # Get the best alignment
+            if alignments:
+                best = alignments[0]
+                # Create new sequence with gaps
+                aligned_seq = SeqRecord(
+                    Seq(best.seqB),
+                    id=record.id,
+                    name=record.name,
+                    description=""
+                )
+                aligned_records.append(aligned_seq)
+            else:
+                # If alignment fails, just add the original sequence
+                aligned_records.append(record)
+        
+        # Create a MultipleSeqAlignment object
+        alignment = MultipleSeqAlignment(aligned_records)
+        return alignment, "Using Biopython alignment (Clustal Omega not available)"
     finally:
         # Clean up temporary files
         try:
@@ -1029,10 +1772,144 @@ def generate_multiple_sequence_alignment(sequence_data):
         except Exception as e:
             logger.error(f"Error cleaning up temporary files: {e}")
 
+def generate_multiple_sequence_alignment(sequence_data, pipeline=None):
+    """
+    Generate multiple sequence alignment visualization using Clustal Omega
+    
+    Args:
+        sequence_data (list): List of sequence data dictionaries with id, name, sequence, etc.
+        pipeline (AnalysisPipeline): Pipeline to take the sequences and alignment from
+            (defaults to a pipeline over sequence_data)
+    
+    Returns:
+        dict: Result with success status and alignment visualization
+    """
+    try:
+        pipeline = pipeline or AnalysisPipeline(sequence_data=sequence_data)
+        sequence_data = pipeline.fetch()
+        if not sequence_data or len(sequence_data) < 2:
+            return {
+                'success': False,
+                'message': 'Multiple sequence alignment requires at least 2 sequences'
+            }
+        
+        logger.info(f"Generating multiple sequence alignment for {len(sequence_data)} sequences")
+        
+        # Align the sequences, reusing an alignment made for the same sequences
+        alignment, note = pipeline.align()
+        
+        # Create alignment visualization using Plotly
+        fig = generate_msa_visualization(alignment, sequence_data)
+        
+        # Convert to HTML
+        msa_html = fig.to_html(include_plotlyjs='cdn', full_html=False, post_script=_MSA_LETTERS_SCRIPT)
+        
+        # Return result
+        result = {
+            'success': True,
+            'msa_html': msa_html,
+            'alignment_length': alignment.get_alignment_length(),
+            'num_sequences': len(alignment)
+        }
+        if note:
+            result['note'] = note
+        return result
+    
+    except Exception as e:
+        logger.error(f"Error generating multiple sequence alignment: {e}")
+        import traceback
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        return {
+            'success': False,
+            'message': f"Error generating multiple sequence alignment: {str(e)}"
+        }
+
+# Residue codes of the MSA heatmap: the 20 amino acids, then gap, stop and any other character
+MSA_RESIDUES = "ACDEFGHIKLMNPQRSTVWY-*X"
+_MSA_GAP_CODE = 20
+_MSA_OTHER_CODE = 22
+
+_MSA_CODE_TABLE = np.full(256, _MSA_OTHER_CODE, dtype=np.uint8)
+for _i, _residue in enumerate(MSA_RESIDUES[:_MSA_OTHER_CODE]):
+    _MSA_CODE_TABLE[ord(_residue)] = _i
+    _MSA_CODE_TABLE[ord(_residue.lower())] = _i
+_MSA_CODE_TABLE[ord('.')] = _MSA_GAP_CODE
+
+# Residue letters are drawn once the zoomed view shows at most this many cells
+MSA_TEXT_MAX_CELLS = int(os.getenv('MSA_TEXT_MAX_CELLS', '4000'))
+
+# Tallest MSA plot in pixels; larger alignments are explored by zooming
+MSA_MAX_HEIGHT = 1200
+
+# Builds the residue letters and hover text in the browser from the code
+# matrix, and shows the letters only when few enough cells are visible
+_MSA_LETTERS_SCRIPT = """
+var gd = document.getElementById('{plot_id}');
+var trace = gd.data[0];
+var residues = trace.meta.residues;
+var maxCells = trace.meta.text_max_cells;
+var z = trace.z;
+if (z.bdata) {
+    var bytes = Uint8Array.from(atob(z.bdata), function(c) { return c.charCodeAt(0); });
+    var shape = String(z.shape).split(',').map(Number);
+    z = [];
+    for (var i = 0; i < shape[0]; i++) {
+        z.push(bytes.subarray(i * shape[1], (i + 1) * shape[1]));
+    }
+}
+var nRows = z.length;
+var nCols = nRows ? z[0].length : 0;
+var text = z.map(function(row) {
+    return Array.prototype.map.call(row, function(code) { return residues[code]; });
+});
+Plotly.restyle(gd, {text: [text]}, [0]);
+
+function visibleCells() {
+    var x = gd.layout.xaxis.range || [0.5, nCols + 0.5];
+    var y = gd.layout.yaxis.range || [-0.5, nRows - 0.5];
+    var cols = Math.min(Math.max(x[0], x[1]), nCols + 0.5) - Math.max(Math.min(x[0], x[1]), 0.5);
+    var rows = Math.min(Math.max(y[0], y[1]), nRows - 0.5) - Math.max(Math.min(y[0], y[1]), -0.5);
+    return Math.max(cols, 0) * Math.max(rows, 0);
+}
+
+var showingLetters = null;
+function updateLetters() {
+    var show = visibleCells() <= maxCells;
+    if (show !== showingLetters) {
+        showingLetters = show;
+        Plotly.restyle(gd, {texttemplate: show ? '%{text}' : ''}, [0]);
+    }
+}
+gd.on('plotly_relayout', updateLetters);
+updateLetters();
+"""
+
+def encode_alignment(alignment):
+    """
+    Encode an alignment as a uint8 matrix of MSA_RESIDUES codes
+    
+    Args:
+        alignment: Bio.Align.MultipleSeqAlignment object
+    
+    Returns:
+        numpy.ndarray: (num_sequences, alignment_length) residue codes; rows
+        shorter than the alignment are padded with gaps
+    """
+    codes = np.full((len(alignment), alignment.get_alignment_length()), _MSA_GAP_CODE, dtype=np.uint8)
+    for i, record in enumerate(alignment):
+        encoded = str(record.seq).encode('ascii', 'replace')
+        codes[i, :len(encoded)] = _MSA_CODE_TABLE[np.frombuffer(encoded, dtype=np.uint8)]
+    return codes
+
 def generate_msa_visualization(alignment, sequence_data):
     """
     Generate MSA visualization using Plotly
     
+    The alignment is drawn as one heatmap of residue codes, so the figure
+    grows with one byte per aligned residue. Residue letters and hover text
+    are built in the browser (see _MSA_LETTERS_SCRIPT, passed as the
+    post_script of to_html).
+    
     Args:
         alignment: Bio.Align.MultipleSeqAlignment object
         sequence_data: List of sequence data dictionaries
@@ -1068,94 +1945,69 @@ def generate_msa_visualization(alignment, sequence_data):
         'Y': '#15a4a4',  # cyan
         'V': '#80a0f0',  # blue
         '-': '#ffffff',  # white (gap)
-        '.': '#ffffff',  # white (gap)
         '*': '#ffffff'   # white (stop)
     }
     
     # Default color for any other character
     default_color = '#cccccc'  # light gray
     
-    # Create figure
-    fig = go.Figure()
+    codes = encode_alignment(alignment)
+    num_sequences, alignment_length = codes.shape
     
-    # Process each sequence in the alignment
+    # Row labels double as the y categories, so they are numbered to stay unique
+    labels = []
+    sources = []
     for i, record in enumerate(alignment):
-        seq_id = record.id
-        sequence = str(record.seq)
-        
-        # Get sequence type (reference or candidate)
-        seq_type = seq_types.get(seq_id, 'unknown')
-        
-        # Prepare data for visualization
-        x_positions = []
-        y_positions = []
-        colors = []
-        hover_texts = []
-        text_labels = []
-        
-        for j, aa in enumerate(sequence):
-            x_positions.append(j)
-            y_positions.append(i)
-            colors.append(aa_colors.get(aa, default_color))
-            hover_texts.append(f"Sequence: {seq_id}<br>Position: {j+1}<br>Amino Acid: {aa}")
-            text_labels.append(aa)
-        
-        # Add markers for each amino acid
-        fig.add_trace(go.Scatter(
-            x=x_positions,
-            y=y_positions,
-            mode='markers',
-            marker=dict(
-                color=colors,
-                size=15,
-                symbol='square',
-                line=dict(color='rgba(0,0,0,0.3)', width=0.5)
-            ),
-            text=text_labels,
-            hoverinfo='text',
-            hovertext=hover_texts,
-            showlegend=False
-        ))
-        
-        # Add text labels for amino acids
-        fig.add_trace(go.Scatter(
-            x=x_positions,
-            y=y_positions,
-            mode='text',
-            text=text_labels,
-            textfont=dict(
-                family='monospace',
-                size=12,
-                color='black'
-            ),
-            hoverinfo='text',
-            hovertext=hover_texts,
-            showlegend=False
-        ))
-        
-        # Add sequence labels on the left side
-        truncated_id = seq_id[:25] + "..." if len(seq_id) > 25 else seq_id
-        border_color = '#FFD700' if seq_type == 'reference' else '#167A6E'
-        
-        fig.add_annotation(
-            x=-1,
-            y=i,
-            text=truncated_id,
-            showarrow=False,
-            font=dict(
-                family='monospace',
-                size=11,
-                color='black'
-            ),
-            bgcolor='rgba(255,255,255,0.7)',
-            bordercolor=border_color,
-            borderwidth=2,
-            borderpad=2,
-            xanchor='right',
-            yanchor='middle'
-        )
+        truncated_id = record.id[:25] + "..." if len(record.id) > 25 else record.id
+        labels.append(f"{i + 1}. {truncated_id}")
+        sources.append(seq_types.get(record.id, 'unknown'))
+    
+    # Stepwise colorscale giving each residue code its own color
+    n_codes = len(MSA_RESIDUES)
+    colorscale = []
+    for code, residue in enumerate(MSA_RESIDUES):
+        color = aa_colors.get(residue, default_color)
+        colorscale.append([code / n_codes, color])
+        colorscale.append([(code + 1) / n_codes, color])
+    
+    fig = go.Figure()
+    fig.add_trace(go.Heatmap(
+        z=codes,
+        x=np.arange(1, alignment_length + 1),
+        y=labels,
+        zmin=-0.5,
+        zmax=n_codes - 0.5,
+        colorscale=colorscale,
+        colorbar=dict(
+            title='Residue',
+            tickvals=list(range(20)),
+            ticktext=list(MSA_RESIDUES[:20]),
+            len=1.0,
+            thickness=15
+        ),
+        textfont=dict(family='monospace', color='black'),
+        hovertemplate='%{y}<br>Position: %{x}<br>Residue: %{text}<extra></extra>',
+        meta=dict(residues=MSA_RESIDUES, text_max_cells=MSA_TEXT_MAX_CELLS)
+    ))
+    
+    # Reference and candidate sequences are marked by a strip left of position 1
+    source_codes = np.array([[0 if source == 'reference' else 1 if source == 'candidate' else 2]
+                             for source in sources], dtype=np.uint8)
+    fig.add_trace(go.Heatmap(
+        z=source_codes,
+        x=[0],
+        y=labels,
+        text=[[source] for source in sources],
+        zmin=-0.5,
+        zmax=2.5,
+        colorscale=[[0, '#FFD700'], [1 / 3, '#FFD700'], [1 / 3, '#167A6E'], [2 / 3, '#167A6E'],
+                    [2 / 3, default_color], [1, default_color]],
+        showscale=False,
+        hovertemplate='%{y}<br>%{text}<extra></extra>'
+    ))
     
     # Add title and axis labels
+    axis_range = [-0.5, alignment_length + 0.5]
     fig.update_layout(
         title='Multiple Sequence Alignment',
         showlegend=False,
@@ -1164,19 +2016,20 @@ def generate_msa_visualization(alignment, sequence_data):
             showgrid=False,
             zeroline=False,
             showticklabels=True,
-            range=[-2, alignment.get_alignment_length() + 1]
+            range=axis_range
         ),
         yaxis=dict(
+            type='category',
+            autorange='reversed',
             showgrid=False,
             zeroline=False,
-            showticklabels=False,
-            range=[-1, len(alignment) + 1]
+            tickfont=dict(family='monospace', size=11)
         ),
         plot_bgcolor='rgba(0,0,0,0)',
-        dragmode='pan',
-        height=max(400, 30 * len(alignment) + 100),
-        width=min(1200, 10 * alignment.get_alignment_length() + 150),
-        margin=dict(l=120, r=20, t=70, b=50)
+        dragmode='zoom',
+        height=min(MSA_MAX_HEIGHT, max(400, 20 * num_sequences + 150)),
+        width=min(1200, 10 * alignment_length + 350),
+        margin=dict(l=220, r=20, t=90, b=50)
     )
     
     # Add sequence count and length annotations
@@ -1185,63 +2038,12 @@ def generate_msa_visualization(alignment, sequence_data):
         y=1.05,
         xref='paper',
         yref='paper',
-        text=f"Aligned {len(alignment)} sequences ({alignment.get_alignment_length()} positions)",
+        text=f"Aligned {num_sequences} sequences ({alignment_length} positions)",
         showarrow=False,
         font=dict(size=14),
         align='center'
     )
     
-    # Add color legends for amino acids
-    legend_items = []
-    for aa, color in sorted(aa_colors.items()):
-        if aa not in ['-', '.', '*']:  # Skip gap and stop symbols
-            legend_items.append({
-                'name': aa,
-                'color': color
-            })
-    
-    legend_x = alignment.get_alignment_length() + 2
-    for i, item in enumerate(legend_items):
-        fig.add_trace(go.Scatter(
-            x=[legend_x],
-            y=[i],
-            mode='markers+text',
-            text=[item['name']],
-            textposition='middle right',
-            marker=dict(
-                color=item['color'],
-                size=15,
-                symbol='square',
-                line=dict(color='rgba(0,0,0,0.3)', width=0.5)
-            ),
-            showlegend=False
-        ))
-    
-    # Add a legend title
-    fig.add_annotation(
-        x=legend_x,
-        y=-1,
-        text="AA Legend",
-        showarrow=False,
-        font=dict(size=12, color='black'),
-        bgcolor='rgba(255,255,255,0.7)',
-        bordercolor='black',
-        borderwidth=1,
-        borderpad=2,
-        xanchor='left',
-        yanchor='top'
-    )
-    
-    # Set up range slider and buttons for navigation
-    axis_range = [0, alignment.get_alignment_length()]
-    fig.update_layout(
-        xaxis=dict(
-            range=axis_range,
-            rangeslider=dict(visible=True),
-            type='linear'
-        )
-    )
-    
     # Add buttons for visibility control and interactivity
     fig.update_layout(
         updatemenus=[
@@ -1255,7 +2057,7 @@ def generate_msa_visualization(alignment, sequence_data):
                     dict(
                         label="Reset View",
                         method="relayout",
-                        args=[{"xaxis.range": axis_range}]
+                        args=[{"xaxis.range": axis_range, "yaxis.autorange": 'reversed'}]
                     ),
                     dict(
                         label="Zoom In",
@@ -1279,7 +2081,7 @@ def generate_msa_visualization(alignment, sequence_data):
         y=1.10,
         xref='paper',
         yref='paper',
-        text="Drag to pan, scroll to zoom, double-click to reset view",
+        text="Drag to zoom, double-click to reset view; residue letters appear when zoomed in",
         showarrow=False,
         font=dict(size=12, color='gray'),
         align='right'
@@ -1287,17 +2089,21 @@ def generate_msa_visualization(alignment, sequence_data):
     
     return fig
 
-def generate_phylogenetic_tree(sequence_data):
+def generate_phylogenetic_tree(sequence_data, pipeline=None):
     """
     Generate phylogenetic tree visualization using Biopython and Plotly
     
     Args:
         sequence_data (list): List of sequence data dictionaries with id, name, sequence, etc.
+        pipeline (AnalysisPipeline): Pipeline to take the sequences, alignment and tree from
+            (defaults to a pipeline over sequence_data)
         
     Returns:
         dict: Result with success status and phylogenetic tree visualization
     """
     try:
+        pipeline = pipeline or AnalysisPipeline(sequence_data=sequence_data)
+        sequence_data = pipeline.fetch()
         if not sequence_data or len(sequence_data) < 3:
             return {
                 'success': False,
@@ -1306,58 +2112,9 @@ def generate_phylogenetic_tree(sequence_data):
         
         logger.info(f"Generating phylogenetic tree for {len(sequence_data)} sequences")
         
-        # Create records from sequence data
-        records = []
-        for seq in sequence_data:
-            records.append(SeqRecord(
-                Seq(seq['sequence']),
-                id=f"{seq['id']}_{seq['name']}",
-                name=seq['name'],
-                description=""
-            ))
-        
-        # First, generate a multiple sequence alignment
-        with tempfile.NamedTemporaryFile(mode='w+', suffix='.fasta', delete=False) as input_file, \
-             tempfile.NamedTemporaryFile(mode='w+', suffix='.clustal', delete=False) as output_file:
-            
-            input_path = input_file.name
-            output_path = output_file.name
-            
-            # Write sequences to input FASTA file
-            SeqIO.write(records, input_file, "fasta")
-            input_file.flush()
-            
-            try:
-                # Try to run Clustal Omega command
-                clustal_cmd = ClustalOmegaCommandline(
-                    infile=input_path,
-                    outfile=output_path,
-                    verbose=True,
-                    auto=True,
-                    force=True
-                )
-                logger.info(f"Running Clustal Omega: {str(clustal_cmd)}")
-                stdout, stderr = clustal_cmd()
-                logger.info("Clustal Omega alignment complete")
-                
-                # Read the alignment file
-                alignment = AlignIO.read(output_path, "clustal")
-                logger.info(f"Read alignment with {len(alignment)} sequences of length {alignment.get_alignment_length()}")
-                
-            except Exception as e:
-                logger.error(f"Error running Clustal Omega: {e}")
-                logger.info("Falling back to simple alignment")
-                
-                # Create a simple alignment
-                alignment = MultipleSeqAlignment(records)
-        
-        # Calculate distance matrix
-        calculator = DistanceCalculator('identity')
-        dm = calculator.get_distance(alignment)
-        
-        # Construct tree
-        constructor = DistanceTreeConstructor()
-        tree = constructor.upgma(dm)
+        # Build the UPGMA tree from the identity distances of the (shared) alignment
+        alignment, note = pipeline.align()
+        tree = pipeline.tree()
         
         # Generate Plotly visualization of the tree
         fig = generate_tree_visualization(tree, sequence_data)
@@ -1386,15 +2143,6 @@ def generate_phylogenetic_tree(sequence_data):
             'success': False,
             'message': f"Error generating phylogenetic tree: {str(e)}"
         }
-    finally:
-        # Clean up temporary files
-        try:
-            if 'input_path' in locals() and os.path.exists(input_path):
-                os.unlink(input_path)
-            if 'output_path' in locals() and os.path.exists(output_path):
-                os.unlink(output_path)
-        except Exception as e:
-            logger.error(f"Error cleaning up temporary files: {e}")
 
 def generate_tree_visualization(tree, sequence_data):
     """
@@ -0,0 +1,140 @@
+"""
+Analysis result cache for BioFASTA
+
+Finished /api/analyze responses are stored in the analysis_cache table,
+keyed by the tool, its parameters, the sorted vault and bag IDs and the
+membership version of each of those containers. database.py bumps a
+container's version in the same transaction as every change to its
+contents, so a cached result is only returned while the selection is
+exactly as it was when the result was computed.
+
+The cache lives in Postgres so that results computed by any analysis pool
+process are visible to every web worker. Its total size is bounded by
+ANALYSIS_CACHE_MAX_MB; the least recently used results are evicted first.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+import database
+import model_registry
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Total size of cached analysis results; 0 disables the cache
+ANALYSIS_CACHE_MAX_MB = float(os.getenv('ANALYSIS_CACHE_MAX_MB', '256'))
+
+# Bump when the content of analysis results changes
+ANALYSIS_CACHE_VERSION = 1
+
+_lock = threading.Lock()
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'errors': 0
+}
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def _model_version():
+    """Version of the model behind SHAP explanations, if one is loaded"""
+    try:
+        predictor = model_registry.get_predictor()
+        return getattr(predictor, 'model_version', None)
+    except Exception:
+        return None
+
+
+def make_cache_key(tool_type, params):
+    """
+    Cache key of an analysis request
+
+    Args:
+        tool_type (str): Analysis tool
+        params (dict): Request parameters (vaults, bags and tool options)
+
+    Returns:
+        str: Hex digest, or None if the cache is disabled or the membership
+        versions could not be read
+    """
+    if ANALYSIS_CACHE_MAX_MB <= 0:
+        return None
+
+    vault_ids = sorted({int(i) for i in params.get('vaults', [])})
+    bag_ids = sorted({int(i) for i in params.get('bags', [])})
+    versions = database.get_membership_versions(vault_ids, bag_ids)
+    if not versions['success']:
+        _count('errors')
+        return None
+
+    options = {key: value for key, value in params.items() if key not in ('vaults', 'bags')}
+    key = {
+        'cache_version': ANALYSIS_CACHE_VERSION,
+        'tool': tool_type,
+        'options': options,
+        'vaults': [[i, versions['data']['vaults'][i]] for i in vault_ids],
+        'bags': [[i, versions['data']['bags'][i]] for i in bag_ids],
+        'model_version': _model_version()
+    }
+    document = json.dumps(key, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(document.encode('utf-8')).hexdigest()
+
+
+def get(cache_key):
+    """
+    Cached response payload for a key
+
+    Args:
+        cache_key (str): Key from make_cache_key (None is always a miss)
+
+    Returns:
+        dict: /api/analyze response payload with data.cached set, or None
+    """
+    if cache_key is None:
+        return None
+    payload = database.get_cached_analysis(cache_key)
+    if payload is None:
+        _count('misses')
+        return None
+
+    _count('hits')
+    if isinstance(payload.get('data'), dict):
+        payload['data']['cached'] = True
+    return payload
+
+
+def put(cache_key, tool_type, payload):
+    """
+    Store a successful response payload
+
+    Args:
+        cache_key (str): Key from make_cache_key
+        tool_type (str): Analysis tool
+        payload (dict): /api/analyze response payload
+    """
+    if cache_key is None or not payload.get('success'):
+        return
+    evicted = database.store_cached_analysis(cache_key, tool_type, payload, int(ANALYSIS_CACHE_MAX_MB * 1024 * 1024))
+    if evicted:
+        logger.info(f"Evicted {evicted} analysis results to stay under {ANALYSIS_CACHE_MAX_MB} MB")
+
+
+def get_stats():
+    """Get the lookup counters of this process and the size of the shared cache"""
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['max_mb'] = ANALYSIS_CACHE_MAX_MB
+    summary = database.get_analysis_cache_summary()
+    if summary is not None:
+        stats['entries'] = summary['entries']
+        stats['size_mb'] = summary['size_bytes'] / (1024 * 1024)
+        stats['total_hits'] = summary['hits']
+    return stats
@@ -0,0 +1,434 @@
+"""
+Background analysis jobs for BioFASTA
+
+UMAP, alignment and phylogeny runs can take minutes, far longer than a web
+request should be held open. POST /api/analyze records a queued job in the
+analysis_jobs table. One dispatcher process per host claims queued jobs and
+runs them on its pool of ANALYSIS_WORKERS analysis processes, however many
+web workers there are. The pool writes progress and final results back to
+Postgres, so any web worker can answer the status and result polls, and
+finished results survive restarts.
+
+The dispatcher refreshes the heartbeat of the jobs it runs and of every job
+still waiting in the queue. If it dies, or none is running, polls report
+those jobs as failed once they have been silent for
+ANALYSIS_JOB_STALE_SECONDS.
+
+gunicorn starts the dispatcher from its master process (see
+gunicorn_config.py) and app.py starts it for the development server. It can
+also be run on its own with `python analysis_jobs.py`.
+"""
+import os
+import sys
+import uuid
+import fcntl
+import atexit
+import signal
+import logging
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import database
+import analysis_cache
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Analysis processes per host, shared by all web workers
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '2'))
+
+# Seconds the dispatcher waits before looking for queued jobs again
+ANALYSIS_JOB_POLL_SECONDS = float(os.getenv('ANALYSIS_JOB_POLL_SECONDS', '1'))
+
+# Seconds between heartbeats of queued and running jobs
+ANALYSIS_JOB_HEARTBEAT_SECONDS = int(os.getenv('ANALYSIS_JOB_HEARTBEAT_SECONDS', '30'))
+
+# A queued or running job without a heartbeat for this long has lost its worker
+ANALYSIS_JOB_STALE_SECONDS = int(os.getenv('ANALYSIS_JOB_STALE_SECONDS', '300'))
+
+# Finished jobs and their results are deleted after this many hours
+ANALYSIS_JOB_RETENTION_HOURS = int(os.getenv('ANALYSIS_JOB_RETENTION_HOURS', '168'))
+
+# Compile UMAP's numba kernels when an analysis process starts
+ANALYSIS_WARM_UP = os.getenv('ANALYSIS_WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+
+# Numba's on-disk cache of compiled kernels, kept across restarts and deploys.
+# Analysis processes inherit it from the environment, so it is set before any are spawned
+NUMBA_CACHE_DIR = os.getenv('NUMBA_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.numba_cache')
+os.environ['NUMBA_CACHE_DIR'] = NUMBA_CACHE_DIR
+
+# Held by the running dispatcher, so a host never runs two
+_DISPATCHER_LOCK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.analysis_dispatcher.lock')
+
+# SHAP mode of UMAP analyses that do not ask for one
+DEFAULT_SHAP_MODE = os.getenv('SHAP_MODE', 'exact')
+
+ANALYSIS_TOOLS = ('umap', 'msa', 'phylogeny')
+
+SHAP_MODES = ('exact', 'approximate', 'sampled')
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+
+_lock = threading.Lock()
+_active_jobs = {}
+_dispatcher = None
+
+
+def _timestamp():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def run_analysis(tool_type, vault_ids, bag_ids, sequence_data=None, progress=None, shap_mode=DEFAULT_SHAP_MODE):
+    """
+    Run one analysis tool and build the /api/analyze response payload
+
+    Args:
+        tool_type (str): 'umap', 'msa' or 'phylogeny'
+        vault_ids (list): Vault IDs to include (reference bacteriocins)
+        bag_ids (list): Bag IDs to include (candidate bacteriocins)
+        sequence_data (list): Sequences for MSA and phylogeny, if already known
+        progress (callable): Called with (fraction, message) as the analysis advances
+        shap_mode (str): SHAP mode of UMAP analyses, one of SHAP_MODES
+
+    Returns:
+        dict: Result with success status, message and the tool's data
+    """
+    import analysis
+
+    progress = progress or (lambda fraction, message: None)
+
+    # Tools share memoized stage outputs (features, embeddings, alignments) for the same sequences
+    pipeline = analysis.AnalysisPipeline(vault_ids, bag_ids, sequence_data=sequence_data)
+
+    if tool_type == 'umap':
+        # Generate UMAP visualization
+        result = analysis.generate_umap_visualization(vault_ids, bag_ids, progress=progress, pipeline=pipeline,
+                                                      shap_mode=shap_mode)
+
+        return {
+            'success': result.get('success', False),
+            'message': result.get('message', 'UMAP analysis completed'),
+            'data': {
+                'tool': 'umap',
+                'plot_html': result.get('plot_html', ''),  # Use the HTML representation
+                'shap_html': result.get('shap_html', ''),  # SHAP feature importance visualization
+                'waterfall_html': result.get('waterfall_html', ''),  # SHAP waterfall chart
+                'points': result.get('points', 0),
+                'plotted_points': result.get('plotted_points', 0),
+                'stages': result.get('stages', {}),  # Time and memory of each pipeline stage
+                'reference_count': result.get('reference_count', 0),
+                'candidate_count': result.get('candidate_count', 0),
+                'feature_importance': result.get('feature_importance', [])[:20],  # Top 20 features
+                'shap_mode': result.get('shap_mode'),
+                'shap_sample_size': result.get('shap_sample_size', 0),  # Sequences SHAP was computed for
+                'shap_partial': result.get('shap_partial', False),  # SHAP time budget ran out
+                'timestamp': _timestamp(),
+                'sequence_data': result.get('sequence_data', [])  # For MSA and Phylogeny
+            }
+        }
+
+    if tool_type in ('msa', 'phylogeny'):
+        # Without sequence data the pipeline reads the selected vaults and bags
+        progress(0.05, 'Loading sequences')
+        sequence_data = pipeline.fetch()
+
+        if tool_type == 'msa':
+            # Generate Multiple Sequence Alignment
+            progress(0.2, 'Aligning sequences')
+            result = analysis.generate_multiple_sequence_alignment(sequence_data, pipeline=pipeline)
+
+            return {
+                'success': result.get('success', False),
+                'message': result.get('message', 'MSA analysis completed'),
+                'data': {
+                    'tool': 'msa',
+                    'msa_html': result.get('msa_html', ''),
+                    'alignment_length': result.get('alignment_length', 0),
+                    'num_sequences': result.get('num_sequences', 0),
+                    'timestamp': _timestamp()
+                }
+            }
+
+        # Generate Phylogenetic Tree
+        progress(0.2, 'Aligning sequences and building phylogenetic tree')
+        result = analysis.generate_phylogenetic_tree(sequence_data, pipeline=pipeline)
+
+        return {
+            'success': result.get('success', False),
+            'message': result.get('message', 'Phylogeny analysis completed'),
+            'data': {
+                'tool': 'phylogeny',
+                'tree_html': result.get('tree_html', ''),
+                'newick': result.get('newick', ''),
+                'num_sequences': result.get('num_sequences', 0),
+                'timestamp': _timestamp()
+            }
+        }
+
+    # For now, return a placeholder response for other tools
+    return {
+        'success': True,
+        'message': 'Analysis completed successfully',
+        'data': {
+            'vaults': vault_ids,
+            'bags': bag_ids,
+            'tool': tool_type,
+            'timestamp': _timestamp(),
+            'result': 'Placeholder for analysis results'
+        }
+    }
+
+
+def _run_job(job_id, tool_type, params, cache_key=None):
+    """Run a claimed job in a pool process, record its progress and result and cache the result"""
+    def progress(fraction, message):
+        database.update_analysis_job(job_id, progress=round(min(max(fraction, 0.0), 1.0), 3), message=message)
+
+    try:
+        result = run_analysis(
+            tool_type,
+            params.get('vaults', []),
+            params.get('bags', []),
+            sequence_data=params.get('sequence_data'),
+            progress=progress,
+            shap_mode=params.get('shap_mode', DEFAULT_SHAP_MODE)
+        )
+    except Exception as e:
+        logger.exception(f"Analysis job {job_id} failed")
+        result = {
+            'success': False,
+            'message': f'Error during analysis: {str(e)}',
+            'data': None
+        }
+
+    status = SUCCEEDED if result.get('success') else FAILED
+    database.update_analysis_job(job_id, status=status, progress=1.0, message=result.get('message', ''), result=result)
+    # Results cut short by the SHAP time budget are not cached, so a rerun can complete them
+    if not (result.get('data') or {}).get('shap_partial'):
+        analysis_cache.put(cache_key, tool_type, result)
+    return status
+
+
+def _init_worker():
+    """Prepare a new pool process: import the analysis stack and compile UMAP"""
+    import analysis
+
+    if ANALYSIS_WARM_UP:
+        try:
+            logger.info(f"Analysis process {os.getpid()} warmed up UMAP in {analysis.warm_up():.2f}s")
+        except Exception as e:
+            logger.warning(f"UMAP warm-up failed: {e}")
+
+
+def _ready():
+    """No-op task that makes the pool start (and warm up) a process"""
+    return os.getpid()
+
+
+def _start_pool():
+    """Start the dispatcher's process pool, warming up its processes ahead of the first job"""
+    executor = ProcessPoolExecutor(
+        max_workers=ANALYSIS_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker
+    )
+    if ANALYSIS_WARM_UP:
+        for _ in range(ANALYSIS_WORKERS):
+            executor.submit(_ready)
+    logger.info(f"Started analysis pool with {ANALYSIS_WORKERS} workers")
+    return executor
+
+
+def _heartbeat(stopping):
+    """Refresh the heartbeat of running and queued jobs while the dispatcher is up"""
+    while not stopping.wait(ANALYSIS_JOB_HEARTBEAT_SECONDS):
+        with _lock:
+            job_ids = list(_active_jobs)
+        database.touch_analysis_jobs(job_ids, include_queued=True)
+
+
+def _job_done(job_id, future):
+    """Record jobs whose pool process died before it could report"""
+    with _lock:
+        _active_jobs.pop(job_id, None)
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Analysis job {job_id} was lost: {error}")
+        database.update_analysis_job(job_id, status=FAILED, message=f'Analysis worker failed: {str(error)}',
+                                     only_unfinished=True)
+
+
+def serve():
+    """
+    Run this host's analysis pool until SIGTERM or SIGINT
+
+    Claims queued jobs from the analysis_jobs table whenever a pool process
+    is free. On shutdown no new jobs are claimed and the jobs already running
+    are allowed to finish.
+    """
+    lock_file = open(_DISPATCHER_LOCK_PATH, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        logger.info("An analysis dispatcher is already running on this host")
+        lock_file.close()
+        return
+
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stopping.set())
+
+    executor = _start_pool()
+    threading.Thread(target=_heartbeat, args=(stopping,), name='analysis-job-heartbeat', daemon=True).start()
+    logger.info(f"Analysis dispatcher {os.getpid()} is waiting for jobs")
+
+    while not stopping.is_set():
+        with _lock:
+            busy = len(_active_jobs)
+        job = database.claim_analysis_job() if busy < ANALYSIS_WORKERS else None
+        if job is None:
+            stopping.wait(ANALYSIS_JOB_POLL_SECONDS)
+            continue
+
+        job_id = job['id']
+        args = (_run_job, job_id, job['tool'], job['params'], job['cache_key'])
+        try:
+            try:
+                future = executor.submit(*args)
+            except BrokenProcessPool:
+                # A pool process was killed (for example out of memory); start a new pool
+                logger.warning("Analysis pool is broken, restarting it")
+                executor = _start_pool()
+                future = executor.submit(*args)
+        except Exception as e:
+            logger.error(f"Error starting analysis job {job_id}: {e}")
+            database.update_analysis_job(job_id, status=FAILED, message=f'Could not start analysis: {str(e)}')
+            continue
+        with _lock:
+            _active_jobs[job_id] = future
+        future.add_done_callback(partial(_job_done, job_id))
+
+    logger.info("Analysis dispatcher stopping; waiting for running jobs")
+    executor.shutdown(wait=True, cancel_futures=True)
+    lock_file.close()
+
+
+def start_dispatcher():
+    """Start the host's analysis dispatcher in a separate process, unless it is already running"""
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.poll() is not None:
+        # Its own process group, so stop_dispatcher can also kill the pool processes
+        _dispatcher = subprocess.Popen([sys.executable, os.path.abspath(__file__)], start_new_session=True)
+        atexit.register(stop_dispatcher)
+        logger.info(f"Started analysis dispatcher {_dispatcher.pid}")
+    return _dispatcher
+
+
+def stop_dispatcher(timeout=30):
+    """
+    Stop the dispatcher started by start_dispatcher
+
+    Running jobs get timeout seconds to finish. After that the dispatcher and
+    its pool processes are killed, and those jobs are reported as failed once
+    their heartbeat goes stale.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        return
+    if _dispatcher.poll() is None:
+        _dispatcher.terminate()
+        try:
+            _dispatcher.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("Analysis dispatcher did not stop in time, killing it")
+    try:
+        os.killpg(_dispatcher.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    _dispatcher.wait()
+    _dispatcher = None
+
+
+def submit_analysis_job(tool_type, params, cache_key=None):
+    """
+    Record an analysis job for the host's dispatcher to run
+
+    A request identical to a job that is still queued or running is attached
+    to that job instead of starting another one.
+
+    Args:
+        tool_type (str): Analysis tool to run
+        params (dict): Request parameters (vaults, bags and optional sequence_data)
+        cache_key (str): Analysis cache key the result is stored under
+
+    Returns:
+        dict: Result with success status, message and the job ID
+    """
+    if cache_key is not None:
+        job_id = database.find_unfinished_analysis_job(cache_key)
+        if job_id is not None:
+            return get_job_status(job_id)
+
+    job_id = uuid.uuid4().hex
+    database.delete_expired_analysis_jobs(ANALYSIS_JOB_RETENTION_HOURS)
+    result = database.create_analysis_job(job_id, tool_type, params, cache_key)
+    if not result['success']:
+        return result
+
+    return {
+        'success': True,
+        'message': 'Analysis job queued',
+        'data': {
+            'job_id': job_id,
+            'tool': tool_type,
+            'status': QUEUED
+        }
+    }
+
+
+def get_job_status(job_id):
+    """
+    Get the status and progress of a job
+
+    Args:
+        job_id (str): Job ID returned by submit_analysis_job
+
+    Returns:
+        dict: Result with success status and the job's status, progress and message
+    """
+    database.fail_stale_analysis_jobs(ANALYSIS_JOB_STALE_SECONDS, job_id=job_id)
+    return database.get_analysis_job(job_id)
+
+
+def get_job_result(job_id):
+    """
+    Get the result payload of a finished job
+
+    Args:
+        job_id (str): Job ID returned by submit_analysis_job
+
+    Returns:
+        tuple: (payload, finished) where payload is the /api/analyze response for
+        a finished job, or the status response while it is still running
+    """
+    status = get_job_status(job_id)
+    if not status['success'] or status['data']['status'] not in FINISHED_STATUSES:
+        return status, False
+
+    result = database.get_analysis_job(job_id, include_result=True)
+    if not result['success']:
+        return result, False
+    payload = result['data'].get('result')
+    if payload is None:
+        payload = {'success': False, 'message': result['data'].get('message') or 'Analysis failed', 'data': None}
+    return payload, True
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    serve()
@@ -5,7 +5,11 @@ from io import StringIO
 import tempfile
 import os
 import json
-from bacpred import BacteriocinPredictor, ensure_model_trained
+import bacpred
+from bacpred import ensure_model_trained, STREAM_CHUNK_SIZE, EXPLAIN_TOP_K
+import model_registry
+import analysis_jobs
+import analysis_cache
 import database  # Import our database module
 from psycopg2.extras import RealDictCursor
 from database import get_connection
@@ -18,6 +22,9 @@ import time
 import traceback
 from decimal import Decimal
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file
+from flask import Response, stream_with_context
+from werkzeug.wsgi import get_input_stream
+import codecs
 import pandas as pd
 import numpy as np
 
@@ -43,6 +50,10 @@ Entrez.email = "mat@organicin.scientific"
 # Ensure the BacPred model is trained at startup
 BACPRED_MODEL_READY = ensure_model_trained()
 
+# Load the shared model now so gunicorn workers inherit it from the master
+if BACPRED_MODEL_READY and model_registry.PRELOAD_MODEL:
+    model_registry.preload()
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -343,6 +354,40 @@ def process_sequence():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def format_prediction_sequences(sequences):
+    """Convert the sequences of a prediction request into (header, sequence) tuples"""
+    seq_tuples = []
+    for i, seq in enumerate(sequences):
+        try:
+            # Handle different structure types that might be coming from frontend
+            if isinstance(seq, str):
+                header = f"Sequence_{i+1}"
+                sequence = seq
+            else:
+                header = seq.get('header', seq.get('description', f"Sequence_{i+1}"))
+                sequence = seq.get('sequence', '')
+                
+                # If sequence is missing but we have a content field (which some APIs might use)
+                if not sequence and 'content' in seq:
+                    sequence = seq.get('content', '')
+            
+            if sequence:
+                app.logger.debug(f"Adding sequence {i}: {header} (length: {len(sequence)})")
+                seq_tuples.append((header, sequence))
+            else:
+                app.logger.warning(f"Skipping sequence {i} ({header}): Empty sequence")
+        except Exception as seq_error:
+            app.logger.error(f"Error processing sequence {i}: {str(seq_error)}")
+    return seq_tuples
+
+def split_result_header(result):
+    """Split a prediction header on the first space into sequence_id and name"""
+    header = result.get('header', '')
+    parts = header.split(' ', 1)
+    result['sequence_id'] = parts[0]
+    result['name'] = parts[1] if len(parts) > 1 else parts[0]
+    return result
+
 @app.route('/predict', methods=['POST'])
 def predict_bacteriocin():
     if not BACPRED_MODEL_READY:
@@ -357,55 +402,37 @@ def predict_bacteriocin():
         app.logger.warning("No sequences provided for prediction")
         return jsonify({'error': 'No sequences provided for prediction'}), 400
     
+    # Optional per-sequence explanations: the top_k features behind each prediction
+    explain = str(data.get('explain', False)).lower() in ('1', 'true', 'yes')
+    top_k = data.get('top_k', EXPLAIN_TOP_K)
+    if explain and (not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 1):
+        return jsonify({'error': 'top_k must be a positive integer'}), 400
+    
     try:
         app.logger.info(f"Processing {len(sequences)} sequences for prediction")
         # Sample sequence for debugging
         if sequences:
             app.logger.info(f"Sample sequence: {sequences[0]}")
         
-        # Create a new predictor instance
-        predictor = BacteriocinPredictor()
+        # Use the process-wide predictor so the model is only loaded once
+        predictor = model_registry.get_predictor()
         
         # Format the sequences for prediction
-        seq_tuples = []
-        for i, seq in enumerate(sequences):
-            try:
-                # Handle different structure types that might be coming from frontend
-                if isinstance(seq, str):
-                    header = f"Sequence_{i+1}"
-                    sequence = seq
-                else:
-                    header = seq.get('header', seq.get('description', f"Sequence_{i+1}"))
-                    sequence = seq.get('sequence', '')
-                    
-                    # If sequence is missing but we have a content field (which some APIs might use)
-                    if not sequence and 'content' in seq:
-                        sequence = seq.get('content', '')
-                
-                if sequence:
-                    app.logger.debug(f"Adding sequence {i}: {header} (length: {len(sequence)})")
-                    seq_tuples.append((header, sequence))
-                else:
-                    app.logger.warning(f"Skipping sequence {i} ({header}): Empty sequence")
-            except Exception as seq_error:
-                app.logger.error(f"Error processing sequence {i}: {str(seq_error)}")
+        seq_tuples = format_prediction_sequences(sequences)
         
         app.logger.info(f"Formatted {len(seq_tuples)} sequences for prediction")
         
         # Run prediction
-        results = predictor.predict(seq_tuples)
-        app.logger.info(f"Prediction completed with {len(results)} results")
+        results, stats = predictor.predict(seq_tuples, return_stats=True, explain=explain, top_k=top_k)
+        app.logger.info(f"Prediction completed with {len(results)} results "
+                        f"({stats['unique_sequences']} unique, cache hit rate {stats['cache_hit_rate']:.2f})")
         
         # Process results to extract the name part from the header
         for result in results:
-            header = result.get('header', '')
-            # Split the header on the first space to separate ID and name
-            parts = header.split(' ', 1)
-            result['sequence_id'] = parts[0]
-            result['name'] = parts[1] if len(parts) > 1 else parts[0]
+            split_result_header(result)
         
-        # Return the results
-        return jsonify({'predictions': results})
+        # Return the results with deduplication and cache metadata
+        return jsonify({'predictions': results, 'metadata': stats})
     
     except Exception as e:
         import traceback
@@ -413,6 +440,78 @@ def predict_bacteriocin():
         app.logger.error(f"Prediction error: {str(e)}\n{error_details}")
         return jsonify({'error': str(e), 'details': error_details}), 500
 
+@app.route('/predict/stream', methods=['POST'])
+def predict_bacteriocin_stream():
+    """
+    Stream predictions as NDJSON, one row per sequence, as chunks are scored
+    
+    Accepts a raw FASTA request body, a multipart upload in 'fastaFile', or a
+    JSON body with a 'sequences' list like /predict. A raw FASTA body is read
+    incrementally and is not subject to MAX_CONTENT_LENGTH, so large protein
+    files can be scored in constant memory.
+    
+    Query parameters:
+        chunk_size: Number of sequences scored together
+        include_sequence: 'true' to echo each sequence back (default 'false')
+    """
+    if not BACPRED_MODEL_READY:
+        return jsonify({'error': 'BacPred model is not ready. Please check server logs.'}), 500
+    
+    chunk_size = request.args.get('chunk_size', STREAM_CHUNK_SIZE, type=int)
+    if not chunk_size or chunk_size < 1:
+        return jsonify({'error': 'chunk_size must be a positive integer'}), 400
+    include_sequence = request.args.get('include_sequence', 'false').lower() == 'true'
+    
+    upload_path = None
+    if request.is_json:
+        data = request.get_json() or {}
+        source = format_prediction_sequences(data.get('sequences', []))
+    elif request.mimetype == 'multipart/form-data':
+        if 'fastaFile' not in request.files:
+            return jsonify({'error': 'No file part'}), 400
+        # Uploaded files are closed with the request, so stream from a saved copy
+        with tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_FOLDER'], suffix='.fasta', delete=False) as temp:
+            upload_path = temp.name
+        request.files['fastaFile'].save(upload_path)
+        source = upload_path
+    else:
+        source = codecs.getreader('utf-8')(get_input_stream(request.environ), errors='replace')
+    
+    predictor = model_registry.get_predictor()
+    app.logger.info(f"Streaming prediction started with chunk size {chunk_size}")
+    
+    def generate():
+        count = 0
+        try:
+            for result in predictor.predict_stream(source, chunk_size=chunk_size,
+                                                   include_sequence=include_sequence):
+                count += 1
+                yield json.dumps(split_result_header(result)) + "\n"
+        except Exception as e:
+            app.logger.error(f"Streaming prediction error after {count} rows: {str(e)}\n{traceback.format_exc()}")
+            yield json.dumps({'error': str(e)}) + "\n"
+        finally:
+            if upload_path and os.path.exists(upload_path):
+                os.unlink(upload_path)
+        app.logger.info(f"Streaming prediction completed with {count} results")
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/model/stats', methods=['GET'])
+def api_model_stats():
+    """API endpoint to report model load, feature cache and micro-batching statistics"""
+    try:
+        stats = model_registry.get_stats()
+        stats['feature_cache'] = bacpred.FEATURE_CACHE.get_stats()
+        predictor = model_registry.get_predictor()
+        stats['model_feature_cache'] = bacpred.get_feature_cache(predictor.feature_plan).get_stats()
+        if predictor.prediction_cache is not None:
+            stats['prediction_cache'] = predictor.prediction_cache.get_stats()
+        return jsonify({'success': True, 'data': stats})
+    except Exception as e:
+        app.logger.error(f"Error in api_model_stats: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/download', methods=['POST'])
 def download_fasta():
     data = request.json
@@ -789,7 +888,12 @@ def api_delete_bag(bag_id):
 
 @app.route('/api/analyze', methods=['POST'])
 def api_analyze():
-    """API endpoint for bacteriocin analysis"""
+    """API endpoint for bacteriocin analysis
+    
+    Queues the analysis as a background job and returns its ID. Poll
+    /api/analyze/jobs/<job_id> for progress and fetch the response from
+    /api/analyze/jobs/<job_id>/result once it has finished.
+    """
     try:
         # Parse the request data
         data = request.get_json()
@@ -817,93 +921,40 @@ def api_analyze():
                 'data': None
             })
         
-        # Process different analysis tools
-        if tool_type == 'umap':
-            # Import the analysis module
-            import analysis
-            
-            # Generate UMAP visualization
-            result = analysis.generate_umap_visualization(vault_ids, bag_ids)
-            
-            return jsonify({
-                'success': result.get('success', False),
-                'message': result.get('message', 'UMAP analysis completed'),
-                'data': {
-                    'tool': 'umap',
-                    'plot_html': result.get('plot_html', ''),  # Use the HTML representation
-                    'shap_html': result.get('shap_html', ''),  # SHAP feature importance visualization
-                    'waterfall_html': result.get('waterfall_html', ''),  # SHAP waterfall chart
-                    'points': result.get('points', 0),
-                    'reference_count': result.get('reference_count', 0),
-                    'candidate_count': result.get('candidate_count', 0),
-                    'feature_importance': result.get('feature_importance', [])[:20],  # Top 20 features
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'sequence_data': result.get('sequence_data', [])  # For MSA and Phylogeny
-                }
-            })
-        elif tool_type == 'msa':
-            # Import the analysis module
-            import analysis
-            
-            # Get the sequence data
-            sequence_data = data.get('sequence_data', [])
-            if not sequence_data:
-                # If no sequence data provided, try to get it from the selected vaults and bags
-                umap_result = analysis.generate_umap_visualization(vault_ids, bag_ids)
-                sequence_data = umap_result.get('sequence_data', [])
-            
-            # Generate Multiple Sequence Alignment
-            result = analysis.generate_multiple_sequence_alignment(sequence_data)
-            
-            return jsonify({
-                'success': result.get('success', False),
-                'message': result.get('message', 'MSA analysis completed'),
-                'data': {
-                    'tool': 'msa',
-                    'msa_html': result.get('msa_html', ''),
-                    'alignment_length': result.get('alignment_length', 0),
-                    'num_sequences': result.get('num_sequences', 0),
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-            })
-        elif tool_type == 'phylogeny':
-            # Import the analysis module
-            import analysis
-            
-            # Get the sequence data
-            sequence_data = data.get('sequence_data', [])
-            if not sequence_data:
-                # If no sequence data provided, try to get it from the selected vaults and bags
-                umap_result = analysis.generate_umap_visualization(vault_ids, bag_ids)
-                sequence_data = umap_result.get('sequence_data', [])
-            
-            # Generate Phylogenetic Tree
-            result = analysis.generate_phylogenetic_tree(sequence_data)
-            
+        # Unknown tools would only queue (and cache) an empty result
+        if tool_type not in analysis_jobs.ANALYSIS_TOOLS:
             return jsonify({
-                'success': result.get('success', False),
-                'message': result.get('message', 'Phylogeny analysis completed'),
-                'data': {
-                    'tool': 'phylogeny',
-                    'tree_html': result.get('tree_html', ''),
-                    'newick': result.get('newick', ''),
-                    'num_sequences': result.get('num_sequences', 0),
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-            })
-        else:
-            # For now, return a placeholder response for other tools
-            return jsonify({
-                'success': True,
-                'message': 'Analysis completed successfully',
-                'data': {
-                    'vaults': vault_ids,
-                    'bags': bag_ids,
-                    'tool': tool_type,
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'result': 'Placeholder for analysis results'
-                }
-            })
+                'success': False,
+                'message': f"tool must be one of: {', '.join(analysis_jobs.ANALYSIS_TOOLS)}",
+                'data': None
+            }), 400
+        
+        params = {
+            'vaults': vault_ids,
+            'bags': bag_ids,
+            'sequence_data': data.get('sequence_data', [])
+        }
+        
+        # SHAP mode of the UMAP feature importance: exact, approximate or sampled
+        if tool_type == 'umap':
+            shap_mode = data.get('shap_mode') or analysis_jobs.DEFAULT_SHAP_MODE
+            if shap_mode not in analysis_jobs.SHAP_MODES:
+                return jsonify({
+                    'success': False,
+                    'message': f"shap_mode must be one of: {', '.join(analysis_jobs.SHAP_MODES)}",
+                    'data': None
+                }), 400
+            params['shap_mode'] = shap_mode
+        
+        # Unchanged selections are answered from the analysis cache
+        cache_key = analysis_cache.make_cache_key(tool_type, params)
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
+        
+        # Run the analysis in the background; the client polls the job for the result
+        result = analysis_jobs.submit_analysis_job(tool_type, params, cache_key=cache_key)
+        return jsonify(result), (202 if result['success'] else 500)
     except Exception as e:
         app.logger.error(f"Error in api_analyze: {str(e)}")
         return jsonify({
@@ -912,6 +963,44 @@ def api_analyze():
             'data': None
         })
 
+@app.route('/api/analyze/jobs/<job_id>', methods=['GET'])
+def api_analysis_job_status(job_id):
+    """API endpoint for the status and progress of an analysis job"""
+    try:
+        result = analysis_jobs.get_job_status(job_id)
+        return jsonify(result), (200 if result['success'] else 404)
+    except Exception as e:
+        app.logger.error(f"Error in api_analysis_job_status: {str(e)}")
+        return jsonify({'success': False, 'message': str(e), 'data': None}), 500
+
+@app.route('/api/analyze/jobs/<job_id>/result', methods=['GET'])
+def api_analysis_job_result(job_id):
+    """API endpoint for the result of a finished analysis job"""
+    try:
+        payload, finished = analysis_jobs.get_job_result(job_id)
+        if finished:
+            return jsonify(payload)
+        if payload.get('data') is None:
+            return jsonify(payload), 404
+        # Still queued or running
+        return jsonify({
+            'success': False,
+            'message': 'Analysis job has not finished',
+            'data': payload['data']
+        }), 409
+    except Exception as e:
+        app.logger.error(f"Error in api_analysis_job_result: {str(e)}")
+        return jsonify({'success': False, 'message': str(e), 'data': None}), 500
+
+@app.route('/api/analyze/cache/stats', methods=['GET'])
+def api_analysis_cache_stats():
+    """API endpoint for analysis cache hit/miss counters and size"""
+    try:
+        return jsonify({'success': True, 'data': analysis_cache.get_stats()})
+    except Exception as e:
+        app.logger.error(f"Error in api_analysis_cache_stats: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/add_to_container', methods=['POST'])
 def add_to_container():
     """Generic endpoint to add a bacteriocin to a container (vault or bag)"""
@@ -969,8 +1058,10 @@ if __name__ == '__main__':
         # Use the command-line port if provided, otherwise find an available one
         port = args.port if args.port else find_available_port()
         print(f"Starting server on port {port}")
+        # The reloader re-runs this script in a child process; start one dispatcher, from the parent
+        if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+            analysis_jobs.start_dispatcher()
         app.run(debug=True, port=port)
     except Exception as e:
         print(f"Error starting server: {e}")
-        import traceback
         traceback.print_exc()
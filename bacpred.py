@@ -4,14 +4,26 @@ Integrates bacteriocin prediction functionality from the BacPred model
 """
 
 import os
+import sys
 import numpy as np
 import pandas as pd
 import joblib
 from Bio import SeqIO
 import logging
 import tempfile
+import time
+import json
+import hashlib
+import itertools
+import functools
 import multiprocessing
+import threading
+from functools import cached_property
 from io import StringIO
+import feature_cache
+import micro_batcher
+import compiled_forest
+import onnx_backend
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -31,18 +43,744 @@ os.makedirs(MODEL_DIR, exist_ok=True)
 POSITIVE_FASTA = os.path.join(SCRIPT_DIR, 'data', 'positive_datasets.fasta')
 NEGATIVE_FASTA = os.path.join(SCRIPT_DIR, 'data', 'negative_datasets.fasta')
 
+# Feature extraction tables
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+NUM_FEATURES = 20 + 400 + 13
+
+# Bump whenever the feature extractor output changes so cached vectors and
+# model artifacts built for the old output are not reused
+FEATURE_SCHEMA_VERSION = 1
+
+# Feature names in extractor column order: amino acid composition, dipeptide
+# composition, then the pseudofeatures
+FEATURE_NAMES = tuple(
+    list(AMINO_ACIDS)
+    + [aa1 + aa2 for aa1 in AMINO_ACIDS for aa2 in AMINO_ACIDS]
+    + [
+        'Cysteine_Fraction',
+        'Cysteine_Pair_Density',
+        'Avg_Hydrophobicity',
+        'Charge_Density',
+        'Positive_AA_Fraction',
+        'Negative_AA_Fraction',
+        'Amphipathicity',
+        'Size_Factor',
+        'Motif_CXC',
+        'Motif_CXXC',
+        'Motif_GG',
+        'Motif_PGP',
+        'Motif_LSXX'
+    ]
+)
+
+# Hydrophobicity scale (Kyte & Doolittle)
+HYDROPHOBICITY = {
+    'A': 1.8, 'R': -4.5, 'N': -3.5, 'D': -3.5, 'C': 2.5, 
+    'Q': -3.5, 'E': -3.5, 'G': -0.4, 'H': -3, 'I': 4.5, 
+    'L': 3.8, 'K': -3.9, 'M': 1.9, 'F': 2.8, 'P': -1.6, 
+    'S': -0.8, 'T': -0.7, 'W': -0.9, 'Y': -1.3, 'V': 4.2
+}
+HYDROPHOBIC_AAS = "ACFILMVWY"
+POSITIVE_AAS = "KRH"
+NEGATIVE_AAS = "DE"
+
+# Residue codes: 0-19 are the standard amino acids, OTHER_CODE is any other
+# character and PAD_CODE fills the tail of shorter rows in a padded batch
+OTHER_CODE = 20
+PAD_CODE = 21
+_NUM_CODES = 22
+
+_CODE_TABLE = np.full(256, OTHER_CODE, dtype=np.uint8)
+for _i, _aa in enumerate(AMINO_ACIDS):
+    _CODE_TABLE[ord(_aa)] = _i
+
+_HYDROPHOBICITY_TABLE = np.zeros(_NUM_CODES, dtype=np.float64)
+_HYDROPHOBIC_TABLE = np.zeros(_NUM_CODES, dtype=bool)
+for _i, _aa in enumerate(AMINO_ACIDS):
+    _HYDROPHOBICITY_TABLE[_i] = HYDROPHOBICITY[_aa]
+    _HYDROPHOBIC_TABLE[_i] = _aa in HYDROPHOBIC_AAS
+
+_CODE = {aa: i for i, aa in enumerate(AMINO_ACIDS)}
+
+# Sequences are featurized in length-sorted chunks so padding stays small
+FEATURE_CHUNK_SIZE = 1024
+
+# Worker processes used for featurizing large batches (1 disables the pool)
+FEATURE_WORKERS = int(os.getenv('FEATURE_WORKERS', '1'))
+
+# Batches smaller than this are always featurized in the calling process
+PARALLEL_FEATURE_THRESHOLD = int(os.getenv('PARALLEL_FEATURE_THRESHOLD', '5000'))
+
+# Shards per worker, so slow shards (long sequences) do not stall the pool
+_SHARDS_PER_WORKER = 4
+
+# Featurizing pools are started from a fork server rather than forked from
+# the caller, which in a web worker may hold locks in other threads (the
+# micro-batcher, job heartbeats, gthread handlers). The server imports this
+# module once, so each pool starts without re-importing NumPy and pandas.
+_POOL_CONTEXT = multiprocessing.get_context('forkserver')
+_POOL_CONTEXT.set_forkserver_preload([__name__])
+
+# Inference backend: 'sklearn', 'compiled' (see compiled_forest.py) or
+# 'onnx' (see onnx_backend.py, falls back to sklearn when unavailable)
+MODEL_BACKENDS = ('sklearn', 'compiled', 'onnx')
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'sklearn')
+
+
+def _safe_divide(numerator, denominator):
+    """Divide row-wise, returning 0 where the denominator is not positive"""
+    numerator = np.asarray(numerator)
+    denominator = np.asarray(denominator)
+    if numerator.ndim == 2:
+        denominator = denominator[:, None]
+    out = np.zeros(numerator.shape, dtype=np.float64)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    return out
+
+
+def encode_sequences(sequences):
+    """
+    Encode sequences into a padded uint8 residue-code matrix
+    
+    Returns (codes, lengths) where codes has shape (N, max_length) and rows
+    shorter than max_length are filled with PAD_CODE.
+    """
+    encoded = [str(seq.upper()).encode('ascii', 'replace') for seq in sequences]
+    lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+    max_length = int(lengths.max()) if len(encoded) else 0
+    
+    codes = np.full((len(encoded), max_length), PAD_CODE, dtype=np.uint8)
+    for row, e in enumerate(encoded):
+        if e:
+            codes[row, :len(e)] = _CODE_TABLE[np.frombuffer(e, dtype=np.uint8)]
+    return codes, lengths
+
+
+def _pair_count(codes, first, second, offset, limit=None):
+    """Count positions i with codes[i] == first and codes[i + offset] == second"""
+    width = codes.shape[1] - offset
+    if width <= 0:
+        return np.zeros(codes.shape[0], dtype=np.int64)
+    hits = (codes[:, :width] == first) & (codes[:, offset:] == second)
+    if limit is not None:
+        hits &= np.arange(width)[None, :] < limit[:, None]
+    return hits.sum(axis=1)
+
+
+class _ChunkFeatures:
+    """
+    Intermediate arrays for one chunk of sequences, computed on first use
+    
+    Each pseudofeature is a method, so a FeaturePlan only pays for the
+    intermediates its selected features depend on.
+    """
+    
+    def __init__(self, sequences):
+        self.n = len(sequences)
+        self.codes, self.L = encode_sequences(sequences)
+        self.rows = np.arange(self.n, dtype=np.int64)[:, None]
+    
+    @cached_property
+    def aa_counts(self):
+        return np.bincount(
+            (self.rows * _NUM_CODES + self.codes).ravel(), minlength=self.n * _NUM_CODES
+        ).reshape(self.n, _NUM_CODES)[:, :20]
+    
+    @cached_property
+    def aac(self):
+        return _safe_divide(self.aa_counts, self.L)
+    
+    @cached_property
+    def dc(self):
+        # Dipeptide fractions indexed 20 * first + second
+        if self.codes.shape[1] > 1:
+            first = self.codes[:, :-1].astype(np.int64)
+            second = self.codes[:, 1:].astype(np.int64)
+            valid = (first < 20) & (second < 20)
+            pair_index = (self.rows * 400 + first * 20 + second)[valid]
+            dipeptide_counts = np.bincount(pair_index, minlength=self.n * 400).reshape(self.n, 400)
+        else:
+            dipeptide_counts = np.zeros((self.n, 400), dtype=np.int64)
+        return _safe_divide(dipeptide_counts, self.L - 1)
+    
+    def pair_fraction(self, pair):
+        """Fraction of one dipeptide, from the full table if it was computed"""
+        if 'dc' in self.__dict__:
+            return self.dc[:, pair]
+        first, second = divmod(pair, 20)
+        return _safe_divide(_pair_count(self.codes, first, second, 1), self.L - 1)
+    
+    @cached_property
+    def positive_count(self):
+        return sum(self.aa_counts[:, _CODE[aa]] for aa in POSITIVE_AAS)
+    
+    @cached_property
+    def negative_count(self):
+        return sum(self.aa_counts[:, _CODE[aa]] for aa in NEGATIVE_AAS)
+    
+    # Pseudofeatures, in the order of get_feature_names
+    
+    def cysteine_fraction(self):
+        return self.aac[:, _CODE['C']]
+    
+    def cysteine_pair_density(self):
+        return self.pair_fraction(_CODE['C'] * 20 + _CODE['C'])
+    
+    def avg_hydrophobicity(self):
+        # Hydrophobicity is accumulated left to right so the floating point
+        # result matches a sequential sum over the residues
+        if self.codes.shape[1] > 0:
+            hydrophobicity_sum = np.cumsum(_HYDROPHOBICITY_TABLE[self.codes], axis=1)[:, -1]
+        else:
+            hydrophobicity_sum = np.zeros(self.n, dtype=np.float64)
+        return _safe_divide(hydrophobicity_sum, self.L)
+    
+    def charge_density(self):
+        return _safe_divide(self.positive_count - self.negative_count, self.L)
+    
+    def positive_fraction(self):
+        return _safe_divide(self.positive_count, self.L)
+    
+    def negative_fraction(self):
+        return _safe_divide(self.negative_count, self.L)
+    
+    def amphipathicity(self):
+        # Transitions between hydrophobic and hydrophilic residues
+        if self.codes.shape[1] > 1:
+            hydrophobic = _HYDROPHOBIC_TABLE[self.codes]
+            transitions = (hydrophobic[:, :-1] != hydrophobic[:, 1:])
+            transitions &= np.arange(self.codes.shape[1] - 1)[None, :] < (self.L - 1)[:, None]
+            transition_count = transitions.sum(axis=1)
+        else:
+            transition_count = np.zeros(self.n, dtype=np.int64)
+        return _safe_divide(transition_count, self.L - 1)
+    
+    def size_factor(self):
+        return np.where((self.L >= 20) & (self.L <= 60), 1.0, 0.5)
+    
+    def motif_cxc(self):
+        return _safe_divide(_pair_count(self.codes, _CODE['C'], _CODE['C'], 2), self.L - 2)
+    
+    def motif_cxxc(self):
+        return _safe_divide(_pair_count(self.codes, _CODE['C'], _CODE['C'], 3), self.L - 3)
+    
+    def motif_gg(self):
+        return self.pair_fraction(_CODE['G'] * 20 + _CODE['G'])
+    
+    def motif_pgp(self):
+        codes = self.codes
+        p, g = _CODE['P'], _CODE['G']
+        if codes.shape[1] > 2:
+            pgp_count = ((codes[:, :-2] == p) & (codes[:, 1:-1] == g) & (codes[:, 2:] == p)).sum(axis=1)
+        else:
+            pgp_count = np.zeros(self.n, dtype=np.int64)
+        return _safe_divide(pgp_count, self.L - 2)
+    
+    def motif_lsxx(self):
+        # The LSXX scan only considers start positions below L - 3
+        lsxx_count = _pair_count(self.codes, _CODE['L'], _CODE['S'], 1, limit=self.L - 3)
+        return _safe_divide(lsxx_count, self.L - 3)
+
+
+_PSEUDOFEATURES = [
+    'cysteine_fraction', 'cysteine_pair_density', 'avg_hydrophobicity',
+    'charge_density', 'positive_fraction', 'negative_fraction', 'amphipathicity',
+    'size_factor', 'motif_cxc', 'motif_cxxc', 'motif_gg', 'motif_pgp', 'motif_lsxx'
+]
+
+# Pseudofeatures that read a single dipeptide fraction
+_PSEUDOFEATURE_PAIRS = {
+    'cysteine_pair_density': _CODE['C'] * 20 + _CODE['C'],
+    'motif_gg': _CODE['G'] * 20 + _CODE['G']
+}
+
+# Below this many distinct dipeptides, each is counted with its own scan
+# instead of building the full 400-column table
+DIPEPTIDE_TABLE_MIN_PAIRS = 16
+
+
+def _as_slice(idx):
+    """Return a slice for a contiguous ascending index array, else the array"""
+    if len(idx) and np.array_equal(idx, np.arange(idx[0], idx[0] + len(idx))):
+        return slice(int(idx[0]), int(idx[0]) + len(idx))
+    return idx
+
+
+class FeaturePlan:
+    """
+    Compiled extraction plan for a subset of the feature vector
+    
+    Given feature indices into the full NUM_FEATURES vector (for example the
+    contents of selected_features.joblib), the plan computes only the
+    feature groups those indices depend on and returns the columns in the
+    given order.
+    """
+    
+    def __init__(self, feature_idx=None):
+        if feature_idx is None:
+            feature_idx = np.arange(NUM_FEATURES)
+        feature_idx = np.asarray(feature_idx, dtype=np.int64).ravel()
+        if feature_idx.size == 0 or feature_idx.min() < 0 or feature_idx.max() >= NUM_FEATURES:
+            raise ValueError(f"Feature indices must be in [0, {NUM_FEATURES})")
+        
+        self.feature_idx = feature_idx
+        self.n_features = len(feature_idx)
+        self.is_full = self.n_features == NUM_FEATURES and np.array_equal(feature_idx, np.arange(NUM_FEATURES))
+        self.key = hashlib.sha256(feature_idx.astype('<i8').tobytes()).hexdigest()[:12]
+        
+        columns = np.arange(self.n_features)
+        aac_mask = feature_idx < 20
+        dpc_mask = (feature_idx >= 20) & (feature_idx < 420)
+        self.aac_columns, self.aac_idx = _as_slice(columns[aac_mask]), _as_slice(feature_idx[aac_mask])
+        self.dpc_columns, self.dpc_idx = columns[dpc_mask], feature_idx[dpc_mask] - 20
+        self.pseudofeatures = [
+            (int(column), _PSEUDOFEATURES[int(i) - 420])
+            for column, i in zip(columns[feature_idx >= 420], feature_idx[feature_idx >= 420])
+        ]
+        
+        self.has_aac = bool(aac_mask.any())
+        
+        pairs = set(self.dpc_idx.tolist())
+        pairs.update(_PSEUDOFEATURE_PAIRS[name] for _, name in self.pseudofeatures if name in _PSEUDOFEATURE_PAIRS)
+        self.use_dipeptide_table = len(pairs) >= DIPEPTIDE_TABLE_MIN_PAIRS
+    
+    @property
+    def groups(self):
+        """Names of the feature groups computed by this plan"""
+        groups = []
+        if self.has_aac:
+            groups.append('aac')
+        if len(self.dpc_idx):
+            groups.append('dipeptide_table' if self.use_dipeptide_table else 'dipeptide_pairs')
+        groups.extend(name for _, name in self.pseudofeatures)
+        return groups
+    
+    def extract_chunk(self, sequences):
+        """Featurize one chunk of sequences into an (n, n_features) matrix"""
+        chunk = _ChunkFeatures(sequences)
+        features = np.empty((chunk.n, self.n_features), dtype=np.float64)
+        
+        if self.has_aac:
+            features[:, self.aac_columns] = chunk.aac[:, self.aac_idx]
+        if self.use_dipeptide_table:
+            features[:, _as_slice(self.dpc_columns)] = chunk.dc[:, _as_slice(self.dpc_idx)]
+        else:
+            for column, pair in zip(self.dpc_columns, self.dpc_idx):
+                features[:, column] = chunk.pair_fraction(int(pair))
+        for column, name in self.pseudofeatures:
+            features[:, column] = getattr(chunk, name)()
+        return features
+
+
+# Plan computing every feature
+FULL_FEATURE_PLAN = FeaturePlan()
+
+
+def _extract_features_chunk(sequences, plan=FULL_FEATURE_PLAN):
+    """Featurize one chunk of sequences into an (n, plan.n_features) matrix"""
+    return plan.extract_chunk(sequences)
+
+
+def _extract_features_serial(sequences, chunk_size=FEATURE_CHUNK_SIZE, plan=FULL_FEATURE_PLAN):
+    """Featurize sequences in the calling process"""
+    n = len(sequences)
+    X = np.empty((n, plan.n_features), dtype=np.float64)
+    if n == 0:
+        return X
+    
+    # Group sequences of similar length to keep the padded matrices small
+    order = sorted(range(n), key=lambda i: len(sequences[i]))
+    for start in range(0, n, chunk_size):
+        idx = order[start:start + chunk_size]
+        X[idx] = _extract_features_chunk([sequences[i] for i in idx], plan)
+    return X
+
+
+def _extract_features_parallel(sequences, workers, chunk_size=FEATURE_CHUNK_SIZE, plan=FULL_FEATURE_PLAN):
+    """
+    Featurize sequences across a pool of worker processes
+    
+    Sequences are sharded in length-sorted order. Each worker returns its shard
+    as one contiguous block, which is pickled as a single buffer and written
+    into the preallocated output matrix.
+    """
+    n = len(sequences)
+    X = np.empty((n, plan.n_features), dtype=np.float64)
+    
+    order = np.argsort(np.fromiter((len(s) for s in sequences), dtype=np.int64, count=n), kind='stable')
+    shard_size = max(chunk_size, -(-n // (workers * _SHARDS_PER_WORKER)))
+    shards = [order[start:start + shard_size] for start in range(0, n, shard_size)]
+    
+    start_time = time.perf_counter()
+    with _POOL_CONTEXT.Pool(min(workers, len(shards))) as pool:
+        blocks = pool.imap(
+            functools.partial(_extract_features_serial, chunk_size=chunk_size, plan=plan),
+            ([sequences[i] for i in shard] for shard in shards)
+        )
+        for shard, block in zip(shards, blocks):
+            X[shard] = block
+    logger.info(f"Featurized {n} sequences with {workers} workers in "
+                f"{time.perf_counter() - start_time:.2f}s ({len(shards)} shards)")
+    return X
+
+
+def extract_features_batch(sequences, chunk_size=FEATURE_CHUNK_SIZE, workers=None, plan=FULL_FEATURE_PLAN):
+    """
+    Extract features for a batch of protein sequences with vectorized NumPy ops
+    
+    Args:
+        sequences: Iterable of protein sequence strings
+        chunk_size: Number of sequences featurized together
+        workers: Number of worker processes for batches of at least
+            PARALLEL_FEATURE_THRESHOLD sequences (defaults to FEATURE_WORKERS)
+        plan: FeaturePlan selecting the features to compute (defaults to all)
+        
+    Returns:
+        numpy.ndarray: (N, plan.n_features) float64 feature matrix
+    """
+    sequences = list(sequences)
+    workers = FEATURE_WORKERS if workers is None else workers
+    
+    # Daemonic processes (e.g. pool workers) cannot start a pool of their own
+    if (workers > 1 and len(sequences) >= PARALLEL_FEATURE_THRESHOLD
+            and not multiprocessing.current_process().daemon):
+        return _extract_features_parallel(sequences, workers, chunk_size, plan)
+    return _extract_features_serial(sequences, chunk_size, plan)
+
+# Process-wide feature cache shared by prediction and analysis
+FEATURE_CACHE = feature_cache.FeatureCache(NUM_FEATURES, FEATURE_SCHEMA_VERSION)
+
+# Caches for reduced feature plans, keyed by plan key
+_PLAN_CACHES = {}
+
+
+def get_feature_cache(plan=FULL_FEATURE_PLAN):
+    """Get the process-wide feature cache for a feature plan"""
+    if plan.is_full:
+        return FEATURE_CACHE
+    cache = _PLAN_CACHES.get(plan.key)
+    if cache is None:
+        cache = _PLAN_CACHES.setdefault(
+            plan.key, feature_cache.FeatureCache(plan.n_features, f"{FEATURE_SCHEMA_VERSION}-{plan.key}")
+        )
+    return cache
+
+
+def extract_features_cached(sequences, workers=None, plan=FULL_FEATURE_PLAN):
+    """
+    Extract features through the feature cache, featurizing only unseen sequences
+    """
+    return get_feature_cache(plan).get_features(
+        sequences, lambda missing: extract_features_batch(missing, workers=workers, plan=plan)
+    )
+
+
+# Number of sequences scored together by predict_stream
+STREAM_CHUNK_SIZE = 1000
+
+# Probabilities kept in memory per process across requests, keyed by sequence digest and model version
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '50000'))
+
+# Directory for persisting predictions across restarts and workers; unset keeps them in memory
+PREDICTION_CACHE_DIR = os.getenv('PREDICTION_CACHE_DIR') or None
+
+# Maximum size in MB of the on-disk prediction shards before the least recently used are deleted
+PREDICTION_CACHE_MAX_MB = float(os.getenv('PREDICTION_CACHE_MAX_MB', '64'))
+
+# Maximum number of per-sequence SHAP vectors kept in memory per process
+SHAP_CACHE_SIZE = int(os.getenv('SHAP_CACHE_SIZE', '10000'))
+
+# Directory for the shared on-disk tier of SHAP vectors; unset disables it
+SHAP_CACHE_DIR = os.getenv('SHAP_CACHE_DIR') or None
+
+# Contributing features returned per sequence by predict(explain=True)
+EXPLAIN_TOP_K = int(os.getenv('EXPLAIN_TOP_K', '10'))
+
+
+def iter_sequences(source):
+    """
+    Lazily iterate (id, sequence) tuples from a path, handle, FASTA string or iterable
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if os.path.isfile(source):
+            for record in SeqIO.parse(source, "fasta"):
+                yield (record.id, str(record.seq))
+        elif ">" in source:
+            for record in SeqIO.parse(StringIO(source), "fasta"):
+                yield (record.id, str(record.seq))
+        else:
+            # Single sequence without header
+            yield ("Sequence", source)
+    elif hasattr(source, 'read'):
+        for record in SeqIO.parse(source, "fasta"):
+            yield (record.id, str(record.seq))
+    else:
+        for i, item in enumerate(source):
+            if isinstance(item, str):
+                yield (f"Sequence_{i+1}", item)
+            else:
+                yield tuple(item)
+
+
+def positive_class_shap(shap_values):
+    """
+    SHAP values of the bacteriocin class
+    
+    Older SHAP versions return one (N, F) array per class, newer ones a single
+    (N, F, classes) array.
+    
+    Args:
+        shap_values: Output of explainer.shap_values
+    
+    Returns:
+        numpy.ndarray: (N, F) SHAP values of class 1
+    """
+    if isinstance(shap_values, list):
+        return np.asarray(shap_values[1])
+    shap_values = np.asarray(shap_values)
+    if shap_values.ndim == 3:
+        return shap_values[:, :, 1]
+    return shap_values
+
+
+def top_contributions(shap_values, k):
+    """
+    Column indices of the k largest absolute SHAP values of each row
+    
+    Uses a partial sort, so only the selected k columns of a row are ordered.
+    
+    Args:
+        shap_values (numpy.ndarray): (N, F) SHAP values
+        k (int): Features per row
+    
+    Returns:
+        numpy.ndarray: (N, min(k, F)) column indices, largest contribution first
+    """
+    magnitude = np.abs(shap_values)
+    k = min(k, magnitude.shape[1])
+    if k < magnitude.shape[1]:
+        top = np.argpartition(-magnitude, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(k), magnitude.shape).copy()
+    order = np.argsort(-np.take_along_axis(magnitude, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+class FeatureSchemaError(ValueError):
+    """Raised when model artifacts do not match the feature extractor"""
+
+
+class FeatureSchema:
+    """
+    Contract between the feature extractor and the model artifacts
+    
+    Records the names of the model's input columns, their dtype and the
+    feature extractor version, together with a hash over all three. It is
+    saved next to the model as feature_schema.json and checked once when the
+    model is loaded, so prediction can feed the extractor output straight
+    into the scaler.
+    """
+    
+    def __init__(self, feature_names, dtype='float64', version=FEATURE_SCHEMA_VERSION):
+        self.feature_names = list(feature_names)
+        self.dtype = np.dtype(dtype).name
+        self.version = int(version)
+        self.hash = self._compute_hash(self.feature_names, self.dtype, self.version)
+    
+    @staticmethod
+    def _compute_hash(feature_names, dtype, version):
+        payload = json.dumps({'feature_names': feature_names, 'dtype': dtype, 'version': version}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def from_indices(cls, feature_idx):
+        """Build the schema for a model trained on the given extractor columns"""
+        return cls([FEATURE_NAMES[int(i)] for i in np.asarray(feature_idx).ravel()])
+    
+    @classmethod
+    def load(cls, path):
+        """Load a schema file, checking that its hash matches its contents"""
+        with open(path) as f:
+            data = json.load(f)
+        schema = cls(data['feature_names'], data['dtype'], data['version'])
+        if data.get('hash') != schema.hash:
+            raise FeatureSchemaError(f"Feature schema {path} is corrupt: hash does not match its contents")
+        return schema
+    
+    def save(self, path):
+        """Write the schema as JSON"""
+        with open(path, 'w') as f:
+            json.dump({
+                'version': self.version,
+                'dtype': self.dtype,
+                'hash': self.hash,
+                'feature_names': self.feature_names
+            }, f, indent=2)
+    
+    @property
+    def n_features(self):
+        return len(self.feature_names)
+    
+    @cached_property
+    def feature_idx(self):
+        """Extractor column index of each model input column"""
+        index = {name: i for i, name in enumerate(FEATURE_NAMES)}
+        unknown = [name for name in self.feature_names if name not in index]
+        if unknown:
+            raise FeatureSchemaError(f"Feature schema lists features the extractor does not produce: {unknown[:5]}")
+        return np.array([index[name] for name in self.feature_names], dtype=np.int64)
+    
+    @cached_property
+    def plan(self):
+        """Feature plan producing exactly the model input columns"""
+        return FeaturePlan(self.feature_idx)
+    
+    def validate(self, scaler, model, selected_features_idx=None):
+        """
+        Check the schema against the extractor and the loaded artifacts
+        
+        Raises:
+            FeatureSchemaError: If any of them disagree
+        """
+        if self.version != FEATURE_SCHEMA_VERSION:
+            raise FeatureSchemaError(
+                f"Model was trained with feature schema version {self.version}, "
+                f"but the extractor produces version {FEATURE_SCHEMA_VERSION}; retrain the model"
+            )
+        if self.dtype != 'float64':
+            raise FeatureSchemaError(f"Feature schema dtype {self.dtype} does not match the extractor (float64)")
+        if len(set(self.feature_names)) != self.n_features:
+            raise FeatureSchemaError("Feature schema lists duplicate features")
+        self.feature_idx
+        for name, artifact in (('scaler', scaler), ('model', model)):
+            n_features_in = getattr(artifact, 'n_features_in_', None)
+            if n_features_in is not None and n_features_in != self.n_features:
+                raise FeatureSchemaError(
+                    f"The {name} expects {n_features_in} features, but the feature schema has {self.n_features}"
+                )
+        if selected_features_idx is not None and not np.array_equal(
+                np.asarray(selected_features_idx).ravel(), self.feature_idx):
+            raise FeatureSchemaError("selected_features.joblib does not match the feature schema")
+
+
+def _fit_model(X, y):
+    """Fit the feature scaler and random forest on a feature matrix"""
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.ensemble import RandomForestClassifier
+    scaler = StandardScaler()
+    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    model.fit(scaler.fit_transform(X), y)
+    return scaler, model
+
+
+def select_top_features(X, y, n_features):
+    """
+    Rank features by random forest importance and return the top n_features
+    indices in ascending order
+    """
+    _, model = _fit_model(X, y)
+    ranked = np.argsort(model.feature_importances_, kind='stable')[::-1]
+    return np.sort(ranked[:n_features])
+
+
+def _time_scoring(sequences, plan, scaler, model, repeats=3):
+    """Best wall time to featurize (uncached), scale and score sequences"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict_proba(scaler.transform(extract_features_batch(sequences, workers=1, plan=plan)))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def feature_selection_report(sequences, X, y, n_features, test_size=0.2):
+    """
+    Compare a reduced-feature model against the full model on a held-out split
+    
+    Args:
+        sequences: Training sequences, aligned with the rows of X
+        X: Full (N, NUM_FEATURES) feature matrix
+        y: Class labels
+        n_features: Number of features kept by the reduced model
+        test_size: Fraction of sequences held out for evaluation
+        
+    Returns:
+        dict: AUC and scoring latency of the full and reduced models
+    """
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import roc_auc_score
+    
+    train_idx, test_idx = train_test_split(
+        np.arange(len(y)), test_size=test_size, random_state=42, stratify=y
+    )
+    test_sequences = [sequences[i] for i in test_idx]
+    selected_idx = select_top_features(X[train_idx], y[train_idx], n_features)
+    
+    report = {'n_train': len(train_idx), 'n_test': len(test_idx)}
+    for name, plan in (('full', FULL_FEATURE_PLAN), ('reduced', FeaturePlan(selected_idx))):
+        columns = plan.feature_idx
+        scaler, model = _fit_model(X[train_idx][:, columns], y[train_idx])
+        scores = model.predict_proba(scaler.transform(X[test_idx][:, columns]))[:, 1]
+        latency = _time_scoring(test_sequences, plan, scaler, model)
+        report[name] = {
+            'n_features': plan.n_features,
+            'feature_groups': plan.groups if name == 'reduced' else ['all'],
+            'auc': float(roc_auc_score(y[test_idx], scores)),
+            'latency_seconds': latency,
+            'latency_ms_per_1000': latency * 1000 * 1000 / max(len(test_idx), 1)
+        }
+    report['reduced']['selected_features'] = selected_idx.tolist()
+    report['latency_saved_fraction'] = 1 - report['reduced']['latency_seconds'] / report['full']['latency_seconds']
+    report['auc_change'] = report['reduced']['auc'] - report['full']['auc']
+    return report
+
 class BacteriocinPredictor:
-    def __init__(self, model_dir=None):
+    def __init__(self, model_dir=None, mmap_mode=None, feature_workers=None, batch_window_ms=None, backend=None):
         """
         Initialize the BacteriocinPredictor with default settings
+        
+        Args:
+            model_dir: Directory containing the model artifacts
+            mmap_mode: Optional joblib mmap_mode ('r' or 'c') so NumPy arrays in
+                the artifacts are memory-mapped and shared between processes
+            feature_workers: Worker processes for featurizing large batches
+                (defaults to FEATURE_WORKERS)
+            batch_window_ms: Window for micro-batching concurrent predictions
+                (defaults to MICRO_BATCH_WINDOW_MS; 0 disables it)
+            backend: Forest inference backend, one of MODEL_BACKENDS
+                (defaults to MODEL_BACKEND)
         """
         # Set model directory
         self.model_dir = model_dir if model_dir else MODEL_DIR
+        self.mmap_mode = mmap_mode
+        self.feature_workers = FEATURE_WORKERS if feature_workers is None else feature_workers
+        self.backend = backend if backend else MODEL_BACKEND
+        if self.backend not in MODEL_BACKENDS:
+            raise ValueError(f"Unknown model backend '{self.backend}', expected one of {MODEL_BACKENDS}")
+        self.backend_model = None
+        self.onnx_pipeline = None
+        self.model_version = None
+        self.prediction_cache = None
+        self._explainer = None
+        self._explainer_lock = threading.Lock()
+        self._shap_stores = {}
+        
+        # Concurrent small predictions share one scale+predict call when enabled
+        if batch_window_ms is None:
+            batch_window_ms = micro_batcher.MICRO_BATCH_WINDOW_MS
+        self.batcher = micro_batcher.MicroBatcher(self._predict_features, batch_window_ms) if batch_window_ms > 0 else None
         
         # Model file paths
         self.model_file = os.path.join(self.model_dir, 'bacteriocin_model.joblib')
         self.scaler_file = os.path.join(self.model_dir, 'feature_scaler.joblib')
         self.features_file = os.path.join(self.model_dir, 'selected_features.joblib')
+        self.schema_file = os.path.join(self.model_dir, 'feature_schema.json')
+        self.onnx_file = os.path.join(self.model_dir, onnx_backend.ONNX_MODEL_FILENAME)
+        
+        # Model input columns and the plan that computes exactly those
+        self.selected_features_idx = None
+        self.feature_schema = None
+        self.feature_plan = FULL_FEATURE_PLAN
         
         # Load model if available, otherwise it will need to be trained
         self.is_trained = self._load_model()
@@ -50,23 +788,116 @@ class BacteriocinPredictor:
     def _load_model(self):
         """
         Load the trained model if it exists
+        
+        Raises:
+            FeatureSchemaError: If the artifacts do not match the feature extractor
         """
         try:
             if os.path.exists(self.model_file) and os.path.exists(self.scaler_file):
-                self.model = joblib.load(self.model_file)
-                self.scaler = joblib.load(self.scaler_file)
+                self.model = joblib.load(self.model_file, mmap_mode=self.mmap_mode)
+                self.scaler = joblib.load(self.scaler_file, mmap_mode=self.mmap_mode)
                 if os.path.exists(self.features_file):
                     self.selected_features_idx = joblib.load(self.features_file)
                 else:
                     self.selected_features_idx = None
+                self._set_feature_schema(self._load_feature_schema())
                 logger.info("Loaded existing model from %s", self.model_file)
                 return True
+        except FeatureSchemaError as e:
+            logger.error("Model artifacts in %s do not match the feature extractor: %s", self.model_dir, str(e))
+            raise
         except Exception as e:
             logger.error("Failed to load model: %s", str(e))
         
         logger.info("No existing model found. Model needs to be trained.")
         return False
+    
+    def _load_feature_schema(self):
+        """
+        Load the feature schema saved with the model
         
+        Artifacts saved before feature_schema.json existed are accepted only
+        when their layout is unambiguous: the selected features, all features,
+        or the amino acid and dipeptide composition columns.
+        """
+        if os.path.exists(self.schema_file):
+            return FeatureSchema.load(self.schema_file)
+        
+        n_features_in = getattr(self.scaler, 'n_features_in_', None)
+        if self.selected_features_idx is not None:
+            schema = FeatureSchema.from_indices(self.selected_features_idx)
+        elif n_features_in == NUM_FEATURES:
+            schema = FeatureSchema(FEATURE_NAMES)
+        elif n_features_in == 420:
+            schema = FeatureSchema(FEATURE_NAMES[:420])
+        else:
+            raise FeatureSchemaError(f"No feature schema found in {self.model_dir} and the scaler expects "
+                                     f"{n_features_in} features; retrain the model")
+        logger.warning(f"No feature schema found in {self.model_dir}; inferred {schema.n_features} features "
+                       f"from the artifacts. Save one with FeatureSchema.save to make this explicit.")
+        return schema
+    
+    def _set_feature_schema(self, schema):
+        """
+        Validate a feature schema against the loaded artifacts and compile its plan
+        """
+        schema.validate(self.scaler, self.model, self.selected_features_idx)
+        self.feature_schema = schema
+        self.feature_plan = schema.plan
+        logger.info(f"Feature schema {schema.hash[:12]}: {schema.n_features} features "
+                    f"({len(self.feature_plan.groups)} feature groups)")
+        self._init_backend()
+    
+    def _init_backend(self):
+        """
+        Prepare the configured inference backend for the loaded model
+        """
+        self.backend_model = self.model
+        self.onnx_pipeline = None
+        if self.backend == 'compiled':
+            try:
+                self.backend_model = compiled_forest.CompiledForest(self.model)
+            except Exception as e:
+                logger.warning(f"Could not compile the model, using scikit-learn: {e}")
+        elif self.backend == 'onnx':
+            try:
+                self.onnx_pipeline = onnx_backend.OnnxPipeline(
+                    self.onnx_file, self.model_file, self.scaler_file, self.feature_schema
+                )
+            except Exception as e:
+                logger.warning(f"ONNX backend unavailable, using scikit-learn: {e}")
+        self._init_prediction_cache()
+    
+    def _init_prediction_cache(self):
+        """
+        Key cached predictions by the model artifacts and the active backend
+        
+        The feature cache machinery is reused with one-column vectors, so
+        predictions are content-addressed by sequence digest and invalidated
+        whenever the model, scaler, feature schema or backend changes.
+        """
+        digest = hashlib.sha256()
+        for path in (self.model_file, self.scaler_file):
+            digest.update(feature_cache.file_sha256(path).encode('ascii'))
+        digest.update(self.feature_schema.hash.encode('ascii'))
+        digest.update(self.active_backend.encode('ascii'))
+        self.model_version = digest.hexdigest()[:16]
+        self.prediction_cache = feature_cache.FeatureCache(
+            1, f"model-{self.model_version}", max_entries=PREDICTION_CACHE_SIZE, cache_dir=PREDICTION_CACHE_DIR,
+            max_mb=PREDICTION_CACHE_MAX_MB
+        )
+        self._explainer = None
+        self._shap_stores = {}
+    
+    @property
+    def active_backend(self):
+        """Name of the backend actually used for inference"""
+        if self.onnx_pipeline is not None:
+            return 'onnx'
+        if isinstance(self.backend_model, compiled_forest.CompiledForest):
+            return 'compiled'
+        return 'sklearn'
+    
     def extract_features(self, sequence):
         """
         Extract features from a protein sequence for prediction
@@ -74,129 +905,22 @@ class BacteriocinPredictor:
         Returns a feature vector with amino acid composition, dipeptide composition,
         and additional pseudofeatures important for bacteriocin prediction.
         """
-        seq = sequence.upper()
-        L = len(seq)
-        features = []
-        
-        # 1. Amino Acid Composition (fraction of each amino acid)
-        aa_list = list("ACDEFGHIKLMNPQRSTVWY")
-        aa_counts = {aa: 0 for aa in aa_list}
-        for aa in seq:
-            if aa in aa_counts:
-                aa_counts[aa] += 1
-        AAC = [aa_counts[aa] / L if L > 0 else 0.0 for aa in aa_list]
-        features.extend(AAC)
-        
-        # 2. Dipeptide Composition (fraction of each possible dipeptide)
-        dipeptide_counts = {}
-        for aa1 in aa_list:
-            for aa2 in aa_list:
-                dipeptide_counts[aa1 + aa2] = 0
-        for i in range(L - 1):
-            dipept = seq[i:i+2]
-            if dipept in dipeptide_counts:
-                dipeptide_counts[dipept] += 1
-        DC = [dipeptide_counts[dp] / (L - 1) if L > 1 else 0.0 for dp in sorted(dipeptide_counts.keys())]
-        features.extend(DC)
-        
-        # 3. Pseudofeatures - Features known to be important for bacteriocin prediction
-        
-        # 3.1 Cysteine content and cysteine pairs (common in bacteriocins)
-        cysteine_count = aa_counts.get('C', 0)
-        cysteine_fraction = cysteine_count / L if L > 0 else 0
-        cysteine_pair_count = dipeptide_counts.get('CC', 0)
-        
-        # 3.2 Hydrophobicity - important for membrane interactions
-        # Hydrophobicity scale (Kyte & Doolittle)
-        hydrophobicity = {
-            'A': 1.8, 'R': -4.5, 'N': -3.5, 'D': -3.5, 'C': 2.5, 
-            'Q': -3.5, 'E': -3.5, 'G': -0.4, 'H': -3, 'I': 4.5, 
-            'L': 3.8, 'K': -3.9, 'M': 1.9, 'F': 2.8, 'P': -1.6, 
-            'S': -0.8, 'T': -0.7, 'W': -0.9, 'Y': -1.3, 'V': 4.2
-        }
-        avg_hydrophobicity = sum(hydrophobicity.get(aa, 0) for aa in seq) / L if L > 0 else 0
-        
-        # 3.3 Charge properties
-        # Positive residues important for bacteriocin activity
-        positive_aas = ['K', 'R', 'H']
-        negative_aas = ['D', 'E']
-        positive_count = sum(aa_counts.get(aa, 0) for aa in positive_aas)
-        negative_count = sum(aa_counts.get(aa, 0) for aa in negative_aas)
-        net_charge = positive_count - negative_count
-        charge_density = net_charge / L if L > 0 else 0
-        
-        # 3.4 Amphipathicity - alternating hydrophobic/hydrophilic residues
-        # Simplified calculation - count transitions between hydrophobic and hydrophilic
-        hydrophobic_aas = ['A', 'C', 'F', 'I', 'L', 'M', 'V', 'W', 'Y']
-        amphipathic_transitions = 0
-        for i in range(L - 1):
-            curr_is_hydrophobic = seq[i] in hydrophobic_aas
-            next_is_hydrophobic = seq[i+1] in hydrophobic_aas
-            if curr_is_hydrophobic != next_is_hydrophobic:
-                amphipathic_transitions += 1
-        amphipathicity = amphipathic_transitions / (L - 1) if L > 1 else 0
-        
-        # 3.5 Size features
-        size_factor = 1.0 if 20 <= L <= 60 else 0.5  # Most bacteriocins are 20-60 amino acids
-        
-        # 3.6 Presence of common bacteriocin motifs
-        # Look for common motifs in sequence
-        motifs = ['CXC', 'CXXC', 'GG', 'PGP', 'LSXX']
-        motif_scores = []
-        for motif in motifs:
-            if motif == 'CXC':
-                # Find CXC pattern where X is any amino acid
-                score = 0
-                for i in range(L - 2):
-                    if seq[i] == 'C' and seq[i+2] == 'C':
-                        score += 1
-                motif_scores.append(score / (L - 2) if L > 2 else 0)
-            elif motif == 'CXXC':
-                # Find CXXC pattern
-                score = 0
-                for i in range(L - 3):
-                    if seq[i] == 'C' and seq[i+3] == 'C':
-                        score += 1
-                motif_scores.append(score / (L - 3) if L > 3 else 0)
-            elif len(motif) == 2:
-                # For 2-char motifs
-                count = 0
-                for i in range(L - 1):
-                    if seq[i:i+2] == motif:
-                        count += 1
-                motif_scores.append(count / (L - 1) if L > 1 else 0)
-            elif len(motif) == 3:
-                # For 3-char motifs
-                count = 0
-                for i in range(L - 2):
-                    if seq[i:i+3] == motif:
-                        count += 1
-                motif_scores.append(count / (L - 2) if L > 2 else 0)
-            elif motif == 'LSXX':
-                # Lanthionine synthetase motif (often present in lantibiotics)
-                count = 0
-                for i in range(L - 3):
-                    if seq[i:i+2] == 'LS':
-                        count += 1
-                motif_scores.append(count / (L - 3) if L > 3 else 0)
-        
-        # Add all pseudofeatures
-        pseudofeatures = [
-            cysteine_fraction,
-            cysteine_pair_count / (L - 1) if L > 1 else 0,
-            avg_hydrophobicity,
-            charge_density, 
-            positive_count / L if L > 0 else 0,
-            negative_count / L if L > 0 else 0,
-            amphipathicity,
-            size_factor
-        ]
-        pseudofeatures.extend(motif_scores)
-        
-        features.extend(pseudofeatures)
+        return extract_features_batch([sequence])[0]
+    
+    def extract_features_batch(self, sequences):
+        """
+        Extract features for a batch of protein sequences
         
-        # Return the feature vector
-        return np.array(features)
+        Returns an (N, 433) matrix whose rows are identical to extract_features
+        applied to each sequence.
+        """
+        return extract_features_cached(sequences, workers=self.feature_workers)
+    
+    def extract_model_features(self, sequences):
+        """
+        Extract only the features the model uses, in the model's column order
+        """
+        return extract_features_cached(sequences, workers=self.feature_workers, plan=self.feature_plan)
     
     def get_feature_names(self):
         """
@@ -204,40 +928,27 @@ class BacteriocinPredictor:
         
         Returns a list of feature names in the same order as extract_features
         """
-        # 1. Amino Acid Composition
-        aa_features = list("ACDEFGHIKLMNPQRSTVWY")
-        
-        # 2. Dipeptide Composition
-        dipeptide_features = []
-        for aa1 in aa_features:
-            for aa2 in aa_features:
-                dipeptide_features.append(aa1 + aa2)
-        
-        # 3. Pseudofeatures
-        pseudofeature_names = [
-            'Cysteine_Fraction',
-            'Cysteine_Pair_Density',
-            'Avg_Hydrophobicity',
-            'Charge_Density',
-            'Positive_AA_Fraction',
-            'Negative_AA_Fraction',
-            'Amphipathicity',
-            'Size_Factor',
-            'Motif_CXC',
-            'Motif_CXXC',
-            'Motif_GG',
-            'Motif_PGP',
-            'Motif_LSXX'
-        ]
-        
-        # Combine all feature names
-        all_features = aa_features + dipeptide_features + pseudofeature_names
-        
-        return all_features
+        return list(FEATURE_NAMES)
+    
+    def get_model_feature_names(self):
+        """
+        Get names of the model input columns, in the order of extract_model_features
+        """
+        if self.feature_schema is None:
+            return list(FEATURE_NAMES)
+        return list(self.feature_schema.feature_names)
     
-    def train(self, positive_fasta, negative_fasta):
+    def train(self, positive_fasta, negative_fasta, n_selected_features=None, report_file=None):
         """
         Train the model using positive and negative FASTA files
+        
+        Args:
+            positive_fasta: FASTA file of bacteriocins
+            negative_fasta: FASTA file of non-bacteriocins
+            n_selected_features: If set, train a reduced model on this many of
+                the most important features and save selected_features.joblib
+            report_file: Optional JSON file for the reduced-model report of
+                latency saved against AUC
         """
         logger.info("Training bacteriocin prediction model...")
         
@@ -252,68 +963,244 @@ class BacteriocinPredictor:
         
         logger.info(f"Loaded {len(positive_seqs)} positive and {len(negative_seqs)} negative sequences")
         
-        # Extract features
-        X = []
-        y = []
-        
-        # Process positive examples
-        for seq in positive_seqs:
-            try:
-                features = self.extract_features(seq)
-                X.append(features)
-                y.append(1)  # 1 for bacteriocin
-            except Exception as e:
-                logger.error(f"Error processing positive sequence: {e}")
-        
-        # Process negative examples
-        for seq in negative_seqs:
-            try:
-                features = self.extract_features(seq)
-                X.append(features)
-                y.append(0)  # 0 for non-bacteriocin
-            except Exception as e:
-                logger.error(f"Error processing negative sequence: {e}")
-        
-        # Convert to numpy arrays
-        X = np.array(X)
-        y = np.array(y)
+        # Extract features for both classes in one batch
+        X = self.extract_features_batch(positive_seqs + negative_seqs)
+        y = np.concatenate([
+            np.ones(len(positive_seqs), dtype=int),   # 1 for bacteriocin
+            np.zeros(len(negative_seqs), dtype=int)   # 0 for non-bacteriocin
+        ])
         
-        # Scale features
-        from sklearn.preprocessing import StandardScaler
-        self.scaler = StandardScaler()
-        X_scaled = self.scaler.fit_transform(X)
+        # Optionally reduce the model to its most important features
+        selected_idx = None
+        if n_selected_features:
+            report = feature_selection_report(positive_seqs + negative_seqs, X, y, n_selected_features)
+            logger.info(f"Reduced model with {n_selected_features} features: AUC {report['reduced']['auc']:.4f} "
+                        f"(full {report['full']['auc']:.4f}), latency {report['reduced']['latency_ms_per_1000']:.1f} ms "
+                        f"per 1000 sequences (full {report['full']['latency_ms_per_1000']:.1f} ms)")
+            if report_file:
+                with open(report_file, 'w') as f:
+                    json.dump(report, f, indent=2)
+            selected_idx = select_top_features(X, y, n_selected_features)
+            X = X[:, selected_idx]
         
-        # Train the model
-        from sklearn.ensemble import RandomForestClassifier
-        self.model = RandomForestClassifier(n_estimators=100, random_state=42)
-        self.model.fit(X_scaled, y)
+        # Scale features and train the model
+        self.scaler, self.model = _fit_model(X, y)
         
         # Save the model
         os.makedirs(self.model_dir, exist_ok=True)
         joblib.dump(self.model, self.model_file)
         joblib.dump(self.scaler, self.scaler_file)
+        if selected_idx is not None:
+            joblib.dump(selected_idx, self.features_file)
+        elif os.path.exists(self.features_file):
+            # A full-feature model must not be paired with a stale selection
+            os.remove(self.features_file)
+        schema = FeatureSchema.from_indices(selected_idx if selected_idx is not None else np.arange(NUM_FEATURES))
+        schema.save(self.schema_file)
+        self.selected_features_idx = selected_idx
+        self._set_feature_schema(schema)
         
         self.is_trained = True
         logger.info("Model training completed and saved to %s", self.model_file)
         return True
     
-    def predict(self, sequences):
+    def _ensure_trained(self):
+        """
+        Train with the default data if no model has been loaded yet
+        """
+        if not self.is_trained:
+            # Try to train with default data if available
+            if os.path.exists(POSITIVE_FASTA) and os.path.exists(NEGATIVE_FASTA):
+                self.train(POSITIVE_FASTA, NEGATIVE_FASTA)
+            else:
+                raise ValueError("Model is not trained and default training data not found")
+    
+    def _score_features(self, X):
+        """
+        Scale a feature matrix and return the bacteriocin probability for each row
+        
+        X must be laid out by the feature schema (see extract_model_features)
+        and is scaled in place.
+        """
+        if self.batcher is not None:
+            return self.batcher.score(X)
+        return self._predict_features(X)
+    
+    def _predict_features(self, X):
+        """
+        Scale X in place and run the model on it
+        """
+        if self.onnx_pipeline is not None:
+            # The ONNX graph includes the scaler
+            return self.onnx_pipeline.predict_proba(X)[:, 1]
+        X_scaled = self.scaler.transform(X, copy=False)
+        return self.backend_model.predict_proba(X_scaled)[:, 1]
+    
+    @staticmethod
+    def _format_result(seq_id, seq, bac_prob, include_sequence=True):
+        """
+        Build the result dictionary for one scored sequence
+        """
+        result = {
+            "header": seq_id,  # Use header instead of id for consistency with app.py
+            "sequence": seq,
+            "probability": float(bac_prob),
+            "prediction": "Bacteriocin" if bac_prob >= 0.5 else "Non-bacteriocin",
+            "confidence": "High" if abs(bac_prob - 0.5) > 0.3 else "Medium" if abs(bac_prob - 0.5) > 0.15 else "Low"
+        }
+        if not include_sequence:
+            del result["sequence"]
+        return result
+    
+    def _score_unique(self, sequences, scaled=None):
+        """
+        Featurize and score sequences that are not in the prediction cache
+        
+        If scaled is a dict, the scaled feature row of each sequence is stored
+        in it for _explain_unique. Those requests are scored by the backend
+        model directly, without the micro-batcher or the ONNX graph, which
+        would scale the features in a copy of their own.
+        """
+        X = self.extract_model_features(sequences)
+        if scaled is None:
+            return self._score_features(X)[:, np.newaxis]
+        X_scaled = self.scaler.transform(X, copy=False)
+        scaled.update(zip(sequences, X_scaled))
+        return self.backend_model.predict_proba(X_scaled)[:, 1][:, np.newaxis]
+    
+    def get_explainer(self):
+        """
+        Get a shap.TreeExplainer of the model, built on first use
+        
+        The explainer is dropped whenever the model version changes.
+        
+        Raises:
+            Exception: If SHAP cannot build a tree explainer for the model
+        """
+        with self._explainer_lock:
+            if self._explainer is None:
+                import shap
+                
+                start = time.perf_counter()
+                self._explainer = shap.TreeExplainer(self.model)
+                logger.info("Built SHAP TreeExplainer for model %s in %.3fs",
+                            self.model_version, time.perf_counter() - start)
+            return self._explainer
+    
+    def get_shap_store(self, approximate=False):
+        """
+        Get the store of per-sequence SHAP vectors of the model
+        
+        Vectors are keyed by sequence digest under the model version, so a new
+        model never serves SHAP values computed for an old one.
+        
+        Args:
+            approximate (bool): Store of the Saabas approximations instead of exact SHAP values
+        """
+        with self._explainer_lock:
+            store = self._shap_stores.get(approximate)
+            if store is None:
+                store = feature_cache.FeatureCache(
+                    self.feature_schema.n_features, f"{'saabas' if approximate else 'shap'}-{self.model_version}",
+                    max_entries=SHAP_CACHE_SIZE, cache_dir=SHAP_CACHE_DIR
+                )
+                self._shap_stores[approximate] = store
+            return store
+    
+    def _explain_unique(self, sequences, scaled=None):
+        """
+        Class 1 SHAP values of sequences that are not in the SHAP store
+        
+        Rows scaled by this request's scoring pass are taken from scaled; only
+        sequences whose prediction was cached are featurized and scaled here,
+        exactly as _predict_features scales them for scoring.
+        """
+        scaled = dict(scaled or {})
+        missing = [sequence for sequence in sequences if sequence not in scaled]
+        if missing:
+            scaled.update(zip(missing, self.scaler.transform(self.extract_model_features(missing), copy=False)))
+        X_scaled = np.stack([scaled[sequence] for sequence in sequences])
+        return positive_class_shap(self.get_explainer().shap_values(X_scaled))
+    
+    def _explain_results(self, results, top_k, stats=None, scaled=None):
+        """
+        Attach the top_k contributing features of each sequence to its result
+        
+        SHAP vectors come from the SHAP store, so a sequence is explained once
+        per model version however often it is predicted. scaled holds the
+        scaled feature rows of the scoring pass (see _score_unique).
+        """
+        start = time.perf_counter()
+        shap_values = self.get_shap_store().get_features([result['sequence'] for result in results],
+                                                        functools.partial(self._explain_unique, scaled=scaled))
+        top = top_contributions(shap_values, top_k)
+        feature_names = self.get_model_feature_names()
+        for result, row, columns in zip(results, shap_values, top):
+            result['explanation'] = [
+                {'feature': feature_names[column], 'shap_value': float(row[column])}
+                for column in columns
+            ]
+        if stats is not None:
+            stats['explained'] = stats.get('explained', 0) + len(results)
+            stats['explain_seconds'] = stats.get('explain_seconds', 0.0) + time.perf_counter() - start
+    
+    def _score_batch(self, seq_list, include_sequence=True, stats=None, scaled=None):
+        """
+        Featurize, scale and score a list of (id, sequence) tuples
+        
+        Identical sequences are scored once and cached predictions are reused,
+        then the probabilities are fanned back out to every header.
+        
+        Returns a list of result dictionaries for the valid sequences. If
+        stats is a dict, it receives the deduplication and cache counts. If
+        scaled is a dict, it receives the scaled feature rows of the sequences
+        scored here (see _score_unique).
+        """
+        # Extract features for all valid sequences in one batch
+        valid_list = []
+        for seq_id, seq in seq_list:
+            if isinstance(seq, str):
+                valid_list.append((seq_id, seq))
+            else:
+                logger.error(f"Error extracting features for {seq_id}: sequence is not a string")
+        
+        # Check if we have any valid sequences
+        if not valid_list:
+            logger.error("No valid features extracted from any sequence")
+            return []
+        
+        cache_stats = {}
+        probabilities = self.prediction_cache.get_features(
+            [seq for _, seq in valid_list], functools.partial(self._score_unique, scaled=scaled), stats=cache_stats
+        )[:, 0]
+        if stats is not None:
+            for key in ('hits', 'disk_hits', 'misses', 'duplicates'):
+                stats[key] = stats.get(key, 0) + cache_stats[key]
+            stats['sequences'] = stats.get('sequences', 0) + len(valid_list)
+        
+        # Format results
+        return [
+            self._format_result(seq_id, seq, probabilities[i], include_sequence)
+            for i, (seq_id, seq) in enumerate(valid_list)
+        ]
+    
+    def predict(self, sequences, return_stats=False, explain=False, top_k=EXPLAIN_TOP_K):
         """
         Predict whether sequences are bacteriocins
         
         Args:
             sequences: List of sequences or FASTA string
+            return_stats: Also return deduplication and prediction cache statistics
+            explain: Add the top_k features contributing most to each prediction,
+                as an 'explanation' list of {'feature', 'shap_value'} entries
+            top_k: Features per explanation (defaults to EXPLAIN_TOP_K)
             
         Returns:
-            List of dictionaries with prediction results
+            List of dictionaries with prediction results, or a (results, stats)
+            tuple if return_stats is set
         """
         # Check if model is trained
-        if not self.is_trained:
-            # Try to train with default data if available
-            if os.path.exists(POSITIVE_FASTA) and os.path.exists(NEGATIVE_FASTA):
-                self.train(POSITIVE_FASTA, NEGATIVE_FASTA)
-            else:
-                raise ValueError("Model is not trained and default training data not found")
+        self._ensure_trained()
         
         # Process input sequences
         if isinstance(sequences, str):
@@ -334,68 +1221,69 @@ class BacteriocinPredictor:
         else:
             raise ValueError("Input must be a FASTA string or list of sequences")
         
-        # Extract features
-        features_list = []
-        for seq_id, seq in seq_list:
-            try:
-                features = self.extract_features(seq)
-                # Log the feature shape for debugging
-                logger.debug(f"Features for {seq_id} have length: {len(features)}")
-                features_list.append((seq_id, seq, features))
-            except Exception as e:
-                logger.error(f"Error extracting features for {seq_id}: {e}")
-        
-        # Check if we have any valid features
-        if not features_list:
-            logger.error("No valid features extracted from any sequence")
-            return []
-        
-        # Scale features
         try:
-            X = np.array([features for _, _, features in features_list])
-            logger.info(f"Feature matrix shape before adjustment: {X.shape}")
-            
-            # Handle feature dimension mismatch - ensure we have exactly 420 features
-            expected_features = 420
-            
-            # If we have more features than expected, truncate
-            if X.shape[1] > expected_features:
-                logger.warning(f"Truncating feature set from {X.shape[1]} to {expected_features}")
-                X = X[:, :expected_features]
-            
-            # If we have fewer features than expected, pad with zeros
-            elif X.shape[1] < expected_features:
-                logger.warning(f"Padding feature set from {X.shape[1]} to {expected_features}")
-                padding = np.zeros((X.shape[0], expected_features - X.shape[1]))
-                X = np.hstack((X, padding))
-            
-            logger.info(f"Feature matrix shape after adjustment: {X.shape}")
-            
-            # Now transform with scaler
-            X_scaled = self.scaler.transform(X)
-            
-            # Make predictions
-            probabilities = self.model.predict_proba(X_scaled)
-            
-            # Format results
-            results = []
-            for i, (seq_id, seq, _) in enumerate(features_list):
-                bac_prob = probabilities[i][1]  # Probability of being a bacteriocin
-                results.append({
-                    "header": seq_id,  # Use header instead of id for consistency with app.py
-                    "sequence": seq,
-                    "probability": float(bac_prob),
-                    "prediction": "Bacteriocin" if bac_prob >= 0.5 else "Non-bacteriocin",
-                    "confidence": "High" if abs(bac_prob - 0.5) > 0.3 else "Medium" if abs(bac_prob - 0.5) > 0.15 else "Low"
-                })
-            
+            stats = {}
+            # Explanations reuse the scaled features of the scoring pass
+            scaled = {} if explain else None
+            results = self._score_batch(seq_list, stats=stats, scaled=scaled)
+            if explain and results:
+                self._explain_results(results, top_k, stats, scaled)
+            if return_stats:
+                return results, self._summarize_stats(stats)
             return results
-            
         except Exception as e:
             logger.error(f"Error in prediction processing: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
             raise
+    
+    def _summarize_stats(self, stats):
+        """
+        Summarize the counts collected by _score_batch
+        """
+        sequences = stats.get('sequences', 0)
+        duplicates = stats.get('duplicates', 0)
+        cache_hits = stats.get('hits', 0) + stats.get('disk_hits', 0)
+        unique = sequences - duplicates
+        summary = {
+            'model_version': self.model_version,
+            'sequences': sequences,
+            'unique_sequences': unique,
+            'duplicates': duplicates,
+            'cache_hits': cache_hits,
+            'scored': stats.get('misses', 0),
+            'cache_hit_rate': cache_hits / unique if unique else 0.0
+        }
+        if 'explained' in stats:
+            summary['explained'] = stats['explained']
+            summary['explain_seconds'] = stats['explain_seconds']
+        return summary
+    
+    def predict_stream(self, iterable_or_path, chunk_size=STREAM_CHUNK_SIZE, include_sequence=True):
+        """
+        Predict sequences in fixed-size chunks, yielding results as they are scored
+        
+        Memory use is bounded by chunk_size regardless of the input size, so
+        arbitrarily large FASTA files can be scored.
+        
+        Args:
+            iterable_or_path: Path to a FASTA file, an open text handle, a FASTA
+                string, or an iterable of sequences or (id, sequence) tuples
+            chunk_size: Number of sequences featurized and scored together
+            include_sequence: Whether to echo the sequence in each result
+            
+        Yields:
+            Dictionaries with prediction results, in input order
+        """
+        self._ensure_trained()
+        
+        records = iter_sequences(iterable_or_path)
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            for result in self._score_batch(chunk, include_sequence=include_sequence):
+                yield result
 
 def ensure_model_trained():
     """
@@ -434,3 +1322,67 @@ def ensure_model_trained():
             logger.error("Training data not found. Model cannot be trained.")
     
     return predictor.is_trained
+
+
+def main(argv=None):
+    """
+    Command line interface for training and batch prediction
+    """
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='BacPred bacteriocin prediction')
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='Directory containing the model artifacts')
+    parser.add_argument('--workers', type=int, default=FEATURE_WORKERS,
+                        help='Worker processes for featurizing large batches (default: FEATURE_WORKERS)')
+    parser.add_argument('--backend', choices=MODEL_BACKENDS, default=MODEL_BACKEND,
+                        help='Forest inference backend (default: MODEL_BACKEND)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    train_parser = subparsers.add_parser('train', help='Train the model from FASTA files')
+    train_parser.add_argument('--positive', default=POSITIVE_FASTA, help='FASTA file of bacteriocins')
+    train_parser.add_argument('--negative', default=NEGATIVE_FASTA, help='FASTA file of non-bacteriocins')
+    train_parser.add_argument('--select-features', type=int, default=None, metavar='N',
+                              help='Train a reduced model on the N most important features')
+    train_parser.add_argument('--report', help='JSON file for the reduced-model latency/AUC report')
+    
+    export_parser = subparsers.add_parser('export-onnx', help='Export the scaler and model to a single ONNX graph')
+    export_parser.add_argument('--output', help='Output file (default: bacteriocin_model.onnx in the model directory)')
+    
+    predict_parser = subparsers.add_parser('predict', help='Predict sequences in a FASTA file as NDJSON')
+    predict_parser.add_argument('input', help='FASTA file to score')
+    predict_parser.add_argument('--output', help='Output file (default: stdout)')
+    predict_parser.add_argument('--chunk-size', type=int, default=None,
+                                help='Sequences scored together (default: larger when --workers > 1)')
+    predict_parser.add_argument('--include-sequence', action='store_true', help='Echo sequences in the output')
+    
+    args = parser.parse_args(argv)
+    predictor = BacteriocinPredictor(model_dir=args.model_dir, feature_workers=args.workers, backend=args.backend)
+    
+    if args.command == 'train':
+        predictor.train(args.positive, args.negative, n_selected_features=args.select_features,
+                        report_file=args.report)
+        return 0
+    
+    if args.command == 'export-onnx':
+        predictor._ensure_trained()
+        onnx_backend.export_onnx(predictor, args.output)
+        return 0
+    
+    chunk_size = args.chunk_size
+    if chunk_size is None:
+        # Chunks must reach the parallel threshold for the worker pool to be used
+        chunk_size = max(STREAM_CHUNK_SIZE, PARALLEL_FEATURE_THRESHOLD * args.workers) if args.workers > 1 else STREAM_CHUNK_SIZE
+    
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for result in predictor.predict_stream(args.input, chunk_size=chunk_size,
+                                               include_sequence=args.include_sequence):
+            output.write(json.dumps(result) + "\n")
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
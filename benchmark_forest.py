@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Benchmark the compiled forest backend against scikit-learn
+
+Scores batches of real feature vectors (from the bundled training datasets,
+resampled to the largest batch size) with RandomForestClassifier.predict_proba
+and with compiled_forest.CompiledForest, checks that the probabilities are
+identical and prints the best time of each.
+
+Usage:
+    python benchmark_forest.py
+    python benchmark_forest.py --sizes 1 10 1000 100000 --repeats 5
+"""
+import sys
+import time
+import argparse
+import numpy as np
+from Bio import SeqIO
+
+import bacpred
+import compiled_forest
+
+
+def load_feature_matrix(predictor, n_rows, seed=42):
+    """Scaled model inputs for n_rows sequences resampled from the training data"""
+    sequences = []
+    for path in (bacpred.POSITIVE_FASTA, bacpred.NEGATIVE_FASTA):
+        sequences.extend(str(record.seq) for record in SeqIO.parse(path, "fasta"))
+    X = predictor.scaler.transform(bacpred.extract_features_batch(sequences, plan=predictor.feature_plan))
+    rows = np.random.default_rng(seed).integers(0, len(X), size=n_rows)
+    return X[rows]
+
+
+def best_time(fn, X, repeats):
+    """Best wall time of fn(X) over repeats runs"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(X)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark compiled forest inference against scikit-learn')
+    parser.add_argument('--model-dir', default=bacpred.MODEL_DIR, help='Directory containing the model artifacts')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 1000, 100000], help='Batch sizes')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per measurement (best is reported)')
+    args = parser.parse_args(argv)
+
+    predictor = bacpred.BacteriocinPredictor(model_dir=args.model_dir, backend='sklearn')
+    if not predictor.is_trained:
+        print("No trained model found in", args.model_dir)
+        return 1
+
+    model = predictor.model
+    hybrid = compiled_forest.CompiledForest(model)
+    pure = compiled_forest.CompiledForest(model, max_batch=sys.maxsize)
+    X_all = load_feature_matrix(predictor, max(args.sizes))
+
+    print(f"{'batch':>8} {'sklearn ms':>12} {'compiled ms':>12} {'hybrid ms':>12} {'speedup':>8} identical")
+    all_identical = True
+    for size in args.sizes:
+        X = X_all[:size]
+        repeats = args.repeats if size < 10000 else max(1, args.repeats // 5)
+        expected = model.predict_proba(X)
+        identical = (np.array_equal(pure.predict_proba(X), expected)
+                     and np.array_equal(hybrid.predict_proba(X), expected))
+        all_identical = all_identical and identical
+
+        sklearn_time = best_time(model.predict_proba, X, repeats)
+        pure_time = best_time(pure.predict_proba, X, repeats)
+        hybrid_time = best_time(hybrid.predict_proba, X, repeats)
+        print(f"{size:>8} {sklearn_time * 1000:>12.2f} {pure_time * 1000:>12.2f} {hybrid_time * 1000:>12.2f} "
+              f"{sklearn_time / hybrid_time:>7.1f}x {identical}")
+
+    print(f"\nhybrid = compiled up to {hybrid.max_batch} rows (COMPILED_FOREST_MAX_BATCH), scikit-learn above")
+    return 0 if all_identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Check the ONNX backend against scikit-learn on the bundled datasets
+
+Scores every sequence in the positive and negative training FASTA files with
+the sklearn backend and with the ONNX export, then reports the largest
+probability difference and any disagreement in the predicted class.
+
+Usage:
+    python check_onnx_parity.py
+    python check_onnx_parity.py --export --tolerance 1e-5
+"""
+import sys
+import argparse
+import numpy as np
+from Bio import SeqIO
+
+import bacpred
+import onnx_backend
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare ONNX and scikit-learn predictions')
+    parser.add_argument('--model-dir', default=bacpred.MODEL_DIR, help='Directory containing the model artifacts')
+    parser.add_argument('--export', action='store_true', help='Export the ONNX model before checking')
+    parser.add_argument('--tolerance', type=float, default=1e-5, help='Largest allowed probability difference')
+    args = parser.parse_args(argv)
+
+    reference = bacpred.BacteriocinPredictor(model_dir=args.model_dir, backend='sklearn', batch_window_ms=0)
+    if not reference.is_trained:
+        print("No trained model found in", args.model_dir)
+        return 1
+    if args.export:
+        onnx_backend.export_onnx(reference)
+
+    candidate = bacpred.BacteriocinPredictor(model_dir=args.model_dir, backend='onnx', batch_window_ms=0)
+    if candidate.active_backend != 'onnx':
+        print("ONNX backend unavailable (see log); run with --export or install onnxruntime")
+        return 1
+
+    passed = True
+    for path in (bacpred.POSITIVE_FASTA, bacpred.NEGATIVE_FASTA):
+        sequences = [(record.id, str(record.seq)) for record in SeqIO.parse(path, "fasta")]
+        expected = np.array([r['probability'] for r in reference.predict(sequences)])
+        actual = np.array([r['probability'] for r in candidate.predict(sequences)])
+
+        max_difference = float(np.abs(actual - expected).max()) if len(expected) else 0.0
+        class_mismatches = int(((actual >= 0.5) != (expected >= 0.5)).sum())
+        ok = max_difference <= args.tolerance and class_mismatches == 0
+        passed = passed and ok
+        print(f"{path}: {len(sequences)} sequences, max |difference| {max_difference:.3g}, "
+              f"class mismatches {class_mismatches} -> {'OK' if ok else 'FAIL'}")
+
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
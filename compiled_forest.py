@@ -0,0 +1,129 @@
+"""
+Compiled random forest inference for BioFASTA
+
+Flattens a fitted scikit-learn RandomForestClassifier into contiguous NumPy
+arrays and evaluates every tree for a batch with vectorized traversal,
+avoiding the per-estimator Python overhead of predict_proba on small and
+medium batches. Probabilities are identical to scikit-learn's.
+
+scikit-learn's Cython traversal is faster once the batch is large enough
+to amortize its overhead, so batches above COMPILED_FOREST_MAX_BATCH are
+delegated to the original forest; both paths give the same probabilities.
+"""
+import os
+import logging
+import numpy as np
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Larger batches are scored by scikit-learn (measured crossover for 100 trees)
+COMPILED_FOREST_MAX_BATCH = int(os.getenv('COMPILED_FOREST_MAX_BATCH', '256'))
+
+# Upper bound on (trees x samples) node indices traversed at once
+TRAVERSAL_BLOCK_SIZE = 1 << 20
+
+
+class CompiledForest:
+    """
+    Random forest flattened into node arrays shared by all trees
+
+    Node i of tree t is stored at offsets[t] + i. Leaves point to themselves,
+    and traversal stops advancing a (tree, sample) pair once it reaches one.
+    """
+
+    def __init__(self, forest, max_batch=COMPILED_FOREST_MAX_BATCH):
+        if getattr(forest, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests can be compiled")
+        estimators = forest.estimators_
+        self.forest = forest
+        self.max_batch = max_batch
+        self.n_classes = int(forest.n_classes_)
+        self.classes_ = forest.classes_
+        self.n_features = int(forest.n_features_in_)
+        self.n_trees = len(estimators)
+
+        node_counts = [estimator.tree_.node_count for estimator in estimators]
+        self.offsets = np.concatenate([[0], np.cumsum(node_counts)[:-1]]).astype(np.intp)
+        self.max_depth = max(estimator.tree_.max_depth for estimator in estimators)
+
+        feature, threshold, left, right, value = [], [], [], [], []
+        for offset, estimator in zip(self.offsets, estimators):
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            node_ids = np.arange(tree.node_count, dtype=np.intp) + offset
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+            right.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+
+            # Per-tree class probabilities, normalized as DecisionTreeClassifier does
+            proba = np.array(tree.value[:, 0, :self.n_classes], dtype=np.float64)
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            proba /= normalizer
+            value.append(proba)
+
+        self.feature = np.concatenate(feature).astype(np.intp)
+        self.threshold = np.concatenate(threshold).astype(np.float64)
+        self.left = np.concatenate(left).astype(np.intp)
+        self.right = np.concatenate(right).astype(np.intp)
+        self.value = np.concatenate(value)
+        self.is_leaf = self.left == np.arange(len(self.left))
+        logger.info(f"Compiled forest of {self.n_trees} trees ({len(self.feature)} nodes, "
+                    f"max depth {self.max_depth})")
+
+    def apply(self, X):
+        """
+        Leaf node index (into the flattened arrays) of every sample in every tree
+
+        Args:
+            X: (n, n_features) float32 matrix
+
+        Returns:
+            numpy.ndarray: (n_trees, n) node indices
+        """
+        n = X.shape[0]
+        flat = np.ascontiguousarray(X).ravel()
+        node = np.repeat(self.offsets, n)
+        row_base = np.tile(np.arange(n, dtype=np.intp) * self.n_features, self.n_trees)
+
+        # Only (tree, sample) pairs that have not reached a leaf are advanced
+        active = np.arange(self.n_trees * n, dtype=np.intp)
+        while active.size:
+            current = node[active]
+            go_left = flat[row_base[active] + self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.left[current], self.right[current])
+            node[active] = current
+            active = active[~self.is_leaf[current]]
+        return node.reshape(self.n_trees, n)
+
+    def predict_proba(self, X):
+        """
+        Predict class probabilities, identical to RandomForestClassifier.predict_proba
+
+        Args:
+            X: (n, n_features) feature matrix
+
+        Returns:
+            numpy.ndarray: (n, n_classes) class probabilities
+        """
+        if len(X) > self.max_batch:
+            return self.forest.predict_proba(X)
+
+        # scikit-learn evaluates trees on float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X has shape {X.shape}, but the forest expects {self.n_features} features")
+
+        n = X.shape[0]
+        proba = np.zeros((n, self.n_classes), dtype=np.float64)
+        block = max(1, TRAVERSAL_BLOCK_SIZE // max(self.n_trees, 1))
+        for start in range(0, n, block):
+            leaves = self.apply(X[start:start + block])
+            out = proba[start:start + block]
+            # Accumulate tree by tree, in estimator order, as scikit-learn does
+            for t in range(self.n_trees):
+                out += self.value[leaves[t]]
+        proba /= self.n_trees
+        return proba
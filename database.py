@@ -1,11 +1,14 @@
 import os
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_batch, Json
 from dotenv import load_dotenv
+import json
 import logging
+import numpy as np
 from decimal import Decimal
 from datetime import datetime
+import bacpred
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -20,9 +23,13 @@ DB_NAME = os.getenv('DB_NAME')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 
-# Create a connection pool
+# Create a connection pool (threaded: gthread web workers and the analysis
+# dispatcher's heartbeat, claim and completion threads share it)
 connection_pool = None
 
+# Feature vectors are stored as little-endian float64 blobs
+FEATURE_DTYPE = np.dtype('<f8')
+
 def init_connection_pool():
     """Initialize the database connection pool"""
     global connection_pool
@@ -32,7 +39,7 @@ def init_connection_pool():
         
         if database_url:
             # Use the direct DATABASE_URL from Render with SSL
-            connection_pool = psycopg2.pool.SimpleConnectionPool(
+            connection_pool = psycopg2.pool.ThreadedConnectionPool(
                 1,  # minconn
                 10,  # maxconn
                 database_url,
@@ -40,7 +47,7 @@ def init_connection_pool():
             )
         else:
             # Use individual connection parameters for local development
-            connection_pool = psycopg2.pool.SimpleConnectionPool(
+            connection_pool = psycopg2.pool.ThreadedConnectionPool(
                 1,  # minconn
                 10,  # maxconn
                 host=DB_HOST,
@@ -94,10 +101,19 @@ def create_tables():
             sequence TEXT NOT NULL,
             probability NUMERIC(5, 4) NOT NULL,
             added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            features BYTEA,
+            feature_version INTEGER,
             UNIQUE(sequence_id)
         );
         """)
         
+        # Add the precomputed feature columns to tables created before they existed
+        cursor.execute("""
+        ALTER TABLE bacteriocin_collection
+            ADD COLUMN IF NOT EXISTS features BYTEA,
+            ADD COLUMN IF NOT EXISTS feature_version INTEGER;
+        """)
+        
         # Create vaults table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS vaults (
@@ -140,6 +156,58 @@ def create_tables():
         );
         """)
         
+        # Create analysis_jobs table (background analysis state and results)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id TEXT PRIMARY KEY,
+            tool TEXT NOT NULL,
+            params JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            result JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS analysis_jobs_created_at_idx ON analysis_jobs (created_at);
+        """)
+        
+        cursor.execute("""
+        ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS cache_key TEXT;
+        """)
+        
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS analysis_jobs_status_idx ON analysis_jobs (status, created_at);
+        """)
+        
+        # Create membership_versions table (bumped whenever a vault or bag changes)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS membership_versions (
+            container_type TEXT NOT NULL,
+            container_id INTEGER NOT NULL,
+            version BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (container_type, container_id)
+        );
+        """)
+        
+        # Create analysis_cache table (results of finished analyses)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            cache_key TEXT PRIMARY KEY,
+            tool TEXT NOT NULL,
+            result JSONB NOT NULL,
+            size_bytes BIGINT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        
         # Create a default vault and bag if they don't exist
         cursor.execute("""
         INSERT INTO vaults (name, description)
@@ -163,8 +231,49 @@ def create_tables():
         if conn:
             release_connection(conn)
 
-def add_bacteriocin(sequence_id, name, sequence, probability):
-    """Add a bacteriocin to the collection"""
+def encode_features(vector):
+    """Encode a feature vector for the features column"""
+    return psycopg2.Binary(np.asarray(vector, dtype=FEATURE_DTYPE).tobytes())
+
+def decode_features(blob, feature_version):
+    """Decode a features column value, or None if it is missing or stale"""
+    if blob is None or feature_version != bacpred.FEATURE_SCHEMA_VERSION:
+        return None
+    vector = np.frombuffer(bytes(blob), dtype=FEATURE_DTYPE)
+    if vector.shape[0] != bacpred.NUM_FEATURES:
+        return None
+    return vector
+
+def compute_features(sequences):
+    """Compute encoded feature vectors for a list of sequences"""
+    return [encode_features(vector) for vector in bacpred.extract_features_cached(sequences)]
+
+def _bump_membership_version(cursor, container_type, container_id):
+    """Bump the membership version of a vault or bag, invalidating cached analyses"""
+    cursor.execute("""
+    INSERT INTO membership_versions (container_type, container_id, version)
+    VALUES (%s, %s, 1)
+    ON CONFLICT (container_type, container_id)
+    DO UPDATE SET version = membership_versions.version + 1;
+    """, (container_type, int(container_id)))
+
+def _bump_membership_versions_of(cursor, bacteriocin_id):
+    """Bump the membership version of every vault and bag containing a bacteriocin"""
+    cursor.execute("""
+    INSERT INTO membership_versions (container_type, container_id, version)
+    SELECT 'vault', vault_id, 1 FROM vault_items WHERE bacteriocin_id = %s
+    UNION ALL
+    SELECT 'bag', bag_id, 1 FROM bag_items WHERE bacteriocin_id = %s
+    ON CONFLICT (container_type, container_id)
+    DO UPDATE SET version = membership_versions.version + 1;
+    """, (bacteriocin_id, bacteriocin_id))
+
+def add_bacteriocin(sequence_id, name, sequence, probability, features=None):
+    """Add a bacteriocin to the collection
+    
+    The feature vector is computed and stored with the row unless an encoded
+    vector is passed in features.
+    """
     conn = None
     result = {
         'success': False,
@@ -173,24 +282,38 @@ def add_bacteriocin(sequence_id, name, sequence, probability):
     }
     
     try:
+        # Precompute the feature vector so analysis can read it from the table
+        feature_version = bacpred.FEATURE_SCHEMA_VERSION
+        if features is None:
+            try:
+                features = compute_features([sequence])[0]
+            except Exception as e:
+                logger.warning(f"Could not compute features for {sequence_id}: {e}")
+                feature_version = None
+        
         conn = get_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         # Insert bacteriocin record
         cursor.execute("""
-        INSERT INTO bacteriocin_collection (sequence_id, name, sequence, probability)
-        VALUES (%s, %s, %s, %s)
+        INSERT INTO bacteriocin_collection (sequence_id, name, sequence, probability, features, feature_version)
+        VALUES (%s, %s, %s, %s, %s, %s)
         ON CONFLICT (sequence_id) 
         DO UPDATE SET 
             name = EXCLUDED.name,
             sequence = EXCLUDED.sequence,
             probability = EXCLUDED.probability,
+            features = EXCLUDED.features,
+            feature_version = EXCLUDED.feature_version,
             added_date = CURRENT_TIMESTAMP
         RETURNING id, sequence_id, name, probability, added_date;
-        """, (sequence_id, name, sequence, probability))
+        """, (sequence_id, name, sequence, probability, features, feature_version))
         
         # Get the inserted/updated record
         record = cursor.fetchone()
+        
+        # The sequence may have changed, so cached analyses containing it are stale
+        _bump_membership_versions_of(cursor, record['id'])
         conn.commit()
         
         result['success'] = True
@@ -382,6 +505,8 @@ def remove_bacteriocin(bacteriocin_id):
         conn = get_connection()
         cursor = conn.cursor()
         
+        # Deleting the bacteriocin removes it from every vault and bag
+        _bump_membership_versions_of(cursor, bacteriocin_id)
         cursor.execute("""
         DELETE FROM bacteriocin_collection
         WHERE id = %s
@@ -584,6 +709,8 @@ def add_to_vault(vault_id, bacteriocin_id):
         """, (vault_id, bacteriocin_id))
         
         result = cursor.fetchone()
+        if result:
+            _bump_membership_version(cursor, 'vault', vault_id)
         conn.commit()
         
         if result:
@@ -631,6 +758,8 @@ def add_to_bag(bag_id, bacteriocin_id):
         """, (bag_id, bacteriocin_id))
         
         result = cursor.fetchone()
+        if result:
+            _bump_membership_version(cursor, 'bag', bag_id)
         conn.commit()
         
         if result:
@@ -677,6 +806,8 @@ def remove_from_vault(vault_id, bacteriocin_id):
         """, (vault_id, bacteriocin_id))
         
         result = cursor.fetchone()
+        if result:
+            _bump_membership_version(cursor, 'vault', vault_id)
         conn.commit()
         
         if result:
@@ -723,6 +854,8 @@ def remove_from_bag(bag_id, bacteriocin_id):
         """, (bag_id, bacteriocin_id))
         
         result = cursor.fetchone()
+        if result:
+            _bump_membership_version(cursor, 'bag', bag_id)
         conn.commit()
         
         if result:
@@ -747,11 +880,13 @@ def remove_from_bag(bag_id, bacteriocin_id):
         if conn:
             release_connection(conn)
 
-def get_vault_items(vault_id):
+def get_vault_items(vault_id, include_features=False):
     """Get all items in a vault
     
     Args:
         vault_id (int): The ID of the vault
+        include_features (bool): Also return the decoded feature vector of each
+            item in 'features' (None when missing or computed by an older schema)
         
     Returns:
         dict: Result with success status and data
@@ -761,8 +896,9 @@ def get_vault_items(vault_id):
         conn = get_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        cursor.execute("""
-        SELECT b.id, b.sequence_id, b.name, b.sequence, b.probability, b.added_date, vi.added_at
+        feature_columns = ", b.features, b.feature_version" if include_features else ""
+        cursor.execute(f"""
+        SELECT b.id, b.sequence_id, b.name, b.sequence, b.probability, b.added_date, vi.added_at{feature_columns}
         FROM bacteriocin_collection b
         JOIN vault_items vi ON b.id = vi.bacteriocin_id
         WHERE vi.vault_id = %s
@@ -781,6 +917,9 @@ def get_vault_items(vault_id):
                 
             if isinstance(item['added_at'], datetime):
                 item['added_at'] = item['added_at'].strftime('%Y-%m-%d %H:%M:%S')
+            
+            if include_features:
+                item['features'] = decode_features(item['features'], item.pop('feature_version'))
         
         return {
             'success': True,
@@ -796,11 +935,13 @@ def get_vault_items(vault_id):
         if conn:
             release_connection(conn)
 
-def get_bag_items(bag_id):
+def get_bag_items(bag_id, include_features=False):
     """Get all items in a bag
     
     Args:
         bag_id (int): The ID of the bag
+        include_features (bool): Also return the decoded feature vector of each
+            item in 'features' (None when missing or computed by an older schema)
         
     Returns:
         dict: Result with success status and data
@@ -810,8 +951,9 @@ def get_bag_items(bag_id):
         conn = get_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        cursor.execute("""
-        SELECT b.id, b.sequence_id, b.name, b.sequence, b.probability, b.added_date, bi.added_at
+        feature_columns = ", b.features, b.feature_version" if include_features else ""
+        cursor.execute(f"""
+        SELECT b.id, b.sequence_id, b.name, b.sequence, b.probability, b.added_date, bi.added_at{feature_columns}
         FROM bacteriocin_collection b
         JOIN bag_items bi ON b.id = bi.bacteriocin_id
         WHERE bi.bag_id = %s
@@ -830,6 +972,9 @@ def get_bag_items(bag_id):
                 
             if isinstance(item['added_at'], datetime):
                 item['added_at'] = item['added_at'].strftime('%Y-%m-%d %H:%M:%S')
+            
+            if include_features:
+                item['features'] = decode_features(item['features'], item.pop('feature_version'))
         
         return {
             'success': True,
@@ -892,6 +1037,11 @@ def load_reference_bacteriocins(fasta_path):
         for row in cursor.fetchall():
             existing_ids.add(row['sequence_id'])
         
+        # Compute feature vectors for all new sequences in one batch
+        new_ids = [seq_id for seq_id, data in sequences.items()
+                   if seq_id and data["sequence"] and seq_id not in existing_ids]
+        new_features = dict(zip(new_ids, compute_features([sequences[seq_id]["sequence"] for seq_id in new_ids])))
+        
         # Add each sequence to the collection
         added_count = 0
         for seq_id, data in sequences.items():
@@ -910,14 +1060,18 @@ def load_reference_bacteriocins(fasta_path):
                     WHERE sequence_id = %s
                     RETURNING id
                 """, (data["name"], seq_id))
+                row = cursor.fetchone()
+                # The name changed, so cached analyses containing it are stale
+                if row:
+                    _bump_membership_versions_of(cursor, row['id'])
                 conn.commit()
                 
-                if cursor.rowcount > 0:
+                if row:
                     added_count += 1
                 continue
                 
             # Add the bacteriocin to the collection with 1.0 probability (100% confidence)
-            result = add_bacteriocin(seq_id, data["name"], data["sequence"], 1.0)
+            result = add_bacteriocin(seq_id, data["name"], data["sequence"], 1.0, new_features[seq_id])
             if result['success']:
                 added_count += 1
             else:
@@ -993,6 +1147,7 @@ def update_bacteriocin_names():
                     "UPDATE bacteriocin_collection SET name = %s WHERE id = %s",
                     (new_name, record_id)
                 )
+                _bump_membership_versions_of(cursor, record_id)
                 updated_count += 1
             except Exception as update_error:
                 logger.error(f"Error updating name for record {record_id}: {update_error}")
@@ -1043,6 +1198,8 @@ def delete_vault(vault_id):
         )
         
         result = cursor.fetchone()
+        if result:
+            _bump_membership_version(cursor, 'vault', vault_id)
         conn.commit()
         
         if result:
@@ -1080,6 +1237,8 @@ def delete_bag(bag_id):
         )
         
         result = cursor.fetchone()
+        if result:
+            _bump_membership_version(cursor, 'bag', bag_id)
         conn.commit()
         
         if result:
@@ -1094,6 +1253,61 @@ def delete_bag(bag_id):
     finally:
         release_connection(conn)
 
+def backfill_feature_vectors(batch_size=500):
+    """Compute and store feature vectors for rows that are missing or stale
+    
+    Args:
+        batch_size (int): Number of rows featurized and updated per transaction
+        
+    Returns:
+        dict: Result with success status and the number of updated rows
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        updated_count = 0
+        last_id = 0
+        while True:
+            cursor.execute("""
+            SELECT id, sequence FROM bacteriocin_collection
+            WHERE id > %s AND (features IS NULL OR feature_version IS DISTINCT FROM %s)
+            ORDER BY id
+            LIMIT %s;
+            """, (last_id, bacpred.FEATURE_SCHEMA_VERSION, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            features = compute_features([sequence for _, sequence in rows])
+            execute_batch(cursor, """
+            UPDATE bacteriocin_collection SET features = %s, feature_version = %s WHERE id = %s
+            """, [(vector, bacpred.FEATURE_SCHEMA_VERSION, row_id) for vector, (row_id, _) in zip(features, rows)])
+            conn.commit()
+            
+            updated_count += len(rows)
+            last_id = rows[-1][0]
+            logger.info(f"Backfilled feature vectors for {updated_count} bacteriocins")
+        
+        return {
+            'success': True,
+            'count': updated_count,
+            'message': f'Backfilled feature vectors for {updated_count} bacteriocins'
+        }
+    except Exception as e:
+        logger.error(f"Error backfilling feature vectors: {e}")
+        if conn:
+            conn.rollback()
+        return {
+            'success': False,
+            'count': 0,
+            'message': f'Error backfilling feature vectors: {str(e)}'
+        }
+    finally:
+        if conn:
+            release_connection(conn)
+
 def remove_item_from_bag(bag_id, item_id):
     """Remove an item from a bag (alias for remove_from_bag)
     
@@ -1107,5 +1321,432 @@ def remove_item_from_bag(bag_id, item_id):
     # This is just an alias for remove_from_bag to maintain API compatibility
     return remove_from_bag(bag_id, item_id)
 
+def _job_json(value):
+    """Adapt a job's params or result for a JSONB column"""
+    return Json(value, dumps=lambda obj: json.dumps(obj, default=str))
+
+def create_analysis_job(job_id, tool, params, cache_key=None):
+    """Record a queued analysis job
+    
+    Args:
+        job_id (str): Job ID
+        tool (str): Analysis tool
+        params (dict): Request parameters
+        cache_key (str): Analysis cache key of the request
+        
+    Returns:
+        dict: Result with success status and message
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+        INSERT INTO analysis_jobs (id, tool, params, status, message, cache_key)
+        VALUES (%s, %s, %s, 'queued', 'Waiting for an analysis worker', %s);
+        """, (job_id, tool, _job_json(params), cache_key))
+        
+        conn.commit()
+        return {'success': True, 'message': 'Analysis job created'}
+    except Exception as e:
+        logger.error(f"Error creating analysis job: {str(e)}")
+        if conn:
+            conn.rollback()
+        return {'success': False, 'message': str(e), 'data': None}
+    finally:
+        if conn:
+            release_connection(conn)
+
+def update_analysis_job(job_id, status=None, progress=None, message=None, result=None, only_unfinished=False):
+    """Update the state of an analysis job
+    
+    Args:
+        job_id (str): Job ID
+        status (str): New status ('running', 'succeeded' or 'failed')
+        progress (float): Fraction of the analysis completed
+        message (str): Progress or result message
+        result (dict): Result payload of a finished job
+        only_unfinished (bool): Leave jobs that have already finished unchanged
+        
+    Returns:
+        dict: Result with success status and message
+    """
+    assignments = ["updated_at = CURRENT_TIMESTAMP"]
+    values = []
+    if status is not None:
+        assignments.append("status = %s")
+        values.append(status)
+        if status == 'running':
+            assignments.append("started_at = CURRENT_TIMESTAMP")
+        elif status in ('succeeded', 'failed'):
+            assignments.append("finished_at = CURRENT_TIMESTAMP")
+    if progress is not None:
+        assignments.append("progress = %s")
+        values.append(progress)
+    if message is not None:
+        assignments.append("message = %s")
+        values.append(message)
+    if result is not None:
+        assignments.append("result = %s")
+        values.append(_job_json(result))
+    
+    query = f"UPDATE analysis_jobs SET {', '.join(assignments)} WHERE id = %s"
+    values.append(job_id)
+    if only_unfinished:
+        query += " AND status NOT IN ('succeeded', 'failed')"
+    
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, values)
+        conn.commit()
+        return {'success': True, 'message': 'Analysis job updated'}
+    except Exception as e:
+        logger.error(f"Error updating analysis job {job_id}: {str(e)}")
+        if conn:
+            conn.rollback()
+        return {'success': False, 'message': str(e)}
+    finally:
+        if conn:
+            release_connection(conn)
+
+def claim_analysis_job():
+    """Claim the oldest queued analysis job and mark it as running
+    
+    Concurrent callers never claim the same job.
+    
+    Returns:
+        dict: The claimed job's id, tool, params and cache_key, or None if no job is queued
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+        UPDATE analysis_jobs
+        SET status = 'running',
+            progress = 0,
+            message = 'Analysis started',
+            started_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = (
+            SELECT id FROM analysis_jobs
+            WHERE status = 'queued'
+            ORDER BY created_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, tool, params, cache_key;
+        """)
+        job = cursor.fetchone()
+        conn.commit()
+        return dict(job) if job else None
+    except Exception as e:
+        logger.error(f"Error claiming analysis job: {str(e)}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+def touch_analysis_jobs(job_ids, include_queued=False):
+    """Refresh the heartbeat of unfinished analysis jobs
+    
+    Args:
+        job_ids (list): IDs of the jobs to refresh
+        include_queued (bool): Also refresh every job still waiting to be claimed
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        UPDATE analysis_jobs SET updated_at = CURRENT_TIMESTAMP
+        WHERE (id = ANY(%s) OR (%s AND status = 'queued'))
+            AND status NOT IN ('succeeded', 'failed');
+        """, (list(job_ids), include_queued))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error refreshing analysis jobs: {str(e)}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            release_connection(conn)
+
+def fail_stale_analysis_jobs(max_age_seconds, job_id=None):
+    """Mark unfinished jobs without a recent heartbeat as failed
+    
+    Args:
+        max_age_seconds (int): Heartbeat age after which a job is considered lost
+        job_id (str): Only check this job
+        
+    Returns:
+        int: Number of jobs marked as failed
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        query = """
+        UPDATE analysis_jobs
+        SET status = 'failed',
+            message = 'The analysis worker stopped before the job finished; please run it again',
+            finished_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE status NOT IN ('succeeded', 'failed')
+            AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        """
+        values = [max_age_seconds]
+        if job_id is not None:
+            query += " AND id = %s"
+            values.append(job_id)
+        cursor.execute(query, values)
+        count = cursor.rowcount
+        conn.commit()
+        return count
+    except Exception as e:
+        logger.error(f"Error failing stale analysis jobs: {str(e)}")
+        if conn:
+            conn.rollback()
+        return 0
+    finally:
+        if conn:
+            release_connection(conn)
+
+def delete_expired_analysis_jobs(retention_hours):
+    """Delete finished analysis jobs older than retention_hours"""
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        DELETE FROM analysis_jobs
+        WHERE status IN ('succeeded', 'failed')
+            AND created_at < CURRENT_TIMESTAMP - make_interval(hours => %s);
+        """, (retention_hours,))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error deleting expired analysis jobs: {str(e)}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            release_connection(conn)
+
+def get_analysis_job(job_id, include_result=False):
+    """Get the state of an analysis job
+    
+    Args:
+        job_id (str): Job ID
+        include_result (bool): Include the result payload of a finished job
+        
+    Returns:
+        dict: Result with success status and the job
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+        columns = "id AS job_id, tool, status, progress, message, created_at, started_at, finished_at"
+        if include_result:
+            columns += ", result"
+        cursor.execute(f"SELECT {columns} FROM analysis_jobs WHERE id = %s", (job_id,))
+        job = cursor.fetchone()
+        
+        if not job:
+            return {'success': False, 'message': 'Analysis job not found', 'data': None}
+        
+        job = dict(job)
+        for key in ('created_at', 'started_at', 'finished_at'):
+            if job[key] is not None:
+                job[key] = job[key].strftime('%Y-%m-%d %H:%M:%S')
+        return {'success': True, 'message': job['message'] or '', 'data': job}
+    except Exception as e:
+        logger.error(f"Error getting analysis job {job_id}: {str(e)}")
+        return {'success': False, 'message': str(e), 'data': None}
+    finally:
+        if conn:
+            release_connection(conn)
+
+def find_unfinished_analysis_job(cache_key):
+    """Get the ID of a queued or running job for the same analysis, if any"""
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT id FROM analysis_jobs
+        WHERE cache_key = %s AND status NOT IN ('succeeded', 'failed')
+        ORDER BY created_at DESC
+        LIMIT 1;
+        """, (cache_key,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Error finding analysis job: {str(e)}")
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+def get_membership_versions(vault_ids, bag_ids):
+    """Get the membership versions of vaults and bags
+    
+    Args:
+        vault_ids (list): Vault IDs
+        bag_ids (list): Bag IDs
+        
+    Returns:
+        dict: Result with success status and {'vaults': {id: version}, 'bags': {id: version}}
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT container_type, container_id, version FROM membership_versions
+        WHERE (container_type = 'vault' AND container_id = ANY(%s))
+            OR (container_type = 'bag' AND container_id = ANY(%s));
+        """, ([int(i) for i in vault_ids], [int(i) for i in bag_ids]))
+        
+        # Containers that have never changed are at version 0
+        versions = {
+            'vaults': {int(i): 0 for i in vault_ids},
+            'bags': {int(i): 0 for i in bag_ids}
+        }
+        for container_type, container_id, version in cursor.fetchall():
+            versions['vaults' if container_type == 'vault' else 'bags'][container_id] = version
+        return {'success': True, 'data': versions}
+    except Exception as e:
+        logger.error(f"Error getting membership versions: {str(e)}")
+        return {'success': False, 'message': str(e), 'data': None}
+    finally:
+        if conn:
+            release_connection(conn)
+
+def get_cached_analysis(cache_key):
+    """Get a cached analysis result and mark it as recently used
+    
+    Args:
+        cache_key (str): Analysis cache key
+        
+    Returns:
+        dict: Cached /api/analyze response payload, or None
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        UPDATE analysis_cache
+        SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+        WHERE cache_key = %s
+        RETURNING result;
+        """, (cache_key,))
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Error reading analysis cache: {str(e)}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+def store_cached_analysis(cache_key, tool, result, max_bytes):
+    """Store an analysis result, evicting least recently used results above max_bytes
+    
+    Args:
+        cache_key (str): Analysis cache key
+        tool (str): Analysis tool
+        result (dict): /api/analyze response payload
+        max_bytes (int): Total size of cached results to keep
+        
+    Returns:
+        int: Number of results evicted, or None on error
+    """
+    conn = None
+    try:
+        document = json.dumps(result, default=str)
+        size_bytes = len(document.encode('utf-8'))
+        if size_bytes > max_bytes:
+            return 0
+        
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        INSERT INTO analysis_cache (cache_key, tool, result, size_bytes)
+        VALUES (%s, %s, %s::jsonb, %s)
+        ON CONFLICT (cache_key)
+        DO UPDATE SET
+            result = EXCLUDED.result,
+            size_bytes = EXCLUDED.size_bytes,
+            last_used_at = CURRENT_TIMESTAMP;
+        """, (cache_key, tool, document, size_bytes))
+        
+        # Keep the most recently used results that fit in max_bytes
+        cursor.execute("""
+        DELETE FROM analysis_cache WHERE cache_key IN (
+            SELECT cache_key FROM (
+                SELECT cache_key,
+                    SUM(size_bytes) OVER (ORDER BY last_used_at DESC, cache_key) AS cumulative_bytes
+                FROM analysis_cache
+            ) ranked
+            WHERE cumulative_bytes > %s
+        );
+        """, (max_bytes,))
+        evicted = cursor.rowcount
+        conn.commit()
+        return evicted
+    except Exception as e:
+        logger.error(f"Error storing analysis cache entry: {str(e)}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+def get_analysis_cache_summary():
+    """Get the number, total size and hit count of cached analysis results"""
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+        SELECT COUNT(*) AS entries,
+            COALESCE(SUM(size_bytes), 0) AS size_bytes,
+            COALESCE(SUM(hits), 0) AS hits
+        FROM analysis_cache;
+        """)
+        return {key: int(value) for key, value in cursor.fetchone().items()}
+    except Exception as e:
+        logger.error(f"Error summarizing analysis cache: {str(e)}")
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
 # Initialize the connection pool when the module is imported
 init_connection_pool()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='BioFASTA database maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill-features',
+                                            help='Compute feature vectors for rows that are missing or stale')
+    backfill_parser.add_argument('--batch-size', type=int, default=500, help='Rows updated per transaction')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'backfill-features':
+        result = backfill_feature_vectors(args.batch_size)
+        print(result['message'])
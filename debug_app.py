@@ -1,11 +1,16 @@
 from flask import Flask, jsonify, request
-from bacpred import BacteriocinPredictor, ensure_model_trained
+from bacpred import ensure_model_trained
+import model_registry
 
 app = Flask(__name__)
 
 # Ensure the BacPred model is trained at startup
 BACPRED_MODEL_READY = ensure_model_trained()
 
+# Load the shared model now so forked workers inherit it
+if BACPRED_MODEL_READY and model_registry.PRELOAD_MODEL:
+    model_registry.preload()
+
 @app.route('/')
 def index():
     return """
@@ -107,8 +112,8 @@ def predict_bacteriocin():
         return jsonify({'error': 'No sequences provided for prediction'}), 400
     
     try:
-        # Create a new predictor instance
-        predictor = BacteriocinPredictor()
+        # Use the process-wide predictor so the model is only loaded once
+        predictor = model_registry.get_predictor()
         
         # Format the sequences for prediction
         seq_tuples = []
@@ -0,0 +1,375 @@
+"""
+Feature cache for BioFASTA
+
+Content-addressed cache of BacPred feature vectors shared by prediction and
+analysis. Vectors are keyed by the SHA-256 of the normalized sequence and a
+feature-schema version, so a change to the feature extractor never serves
+stale vectors.
+
+Two tiers are used:
+    - an in-process LRU with a size cap and eviction statistics
+    - an optional on-disk tier of memory-mapped .npy shards that every
+      gunicorn worker on the host can read, capped at FEATURE_CACHE_MAX_MB
+      per cache by deleting the least recently used shards
+"""
+import os
+import time
+import atexit
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Maximum number of feature vectors kept in memory per process
+FEATURE_CACHE_SIZE = int(os.getenv('FEATURE_CACHE_SIZE', '5000'))
+
+# Directory for the shared on-disk tier; unset disables it
+FEATURE_CACHE_DIR = os.getenv('FEATURE_CACHE_DIR') or None
+
+# Pending vectors are written to a new disk shard once this many accumulate
+FEATURE_CACHE_FLUSH_ROWS = int(os.getenv('FEATURE_CACHE_FLUSH_ROWS', '1024'))
+
+# Disk space each cache's shards may use (least recently used shards are deleted first)
+FEATURE_CACHE_MAX_MB = float(os.getenv('FEATURE_CACHE_MAX_MB', '1024'))
+
+# A shard's modification time is refreshed on use at most this often
+_TOUCH_SECONDS = 3600
+
+
+def normalize_sequence(sequence):
+    """Normalize a sequence the same way the feature extractor does"""
+    return str(sequence.upper())
+
+
+def sequence_digest(sequence):
+    """SHA-256 digest of the normalized sequence"""
+    return hashlib.sha256(normalize_sequence(sequence).encode('utf-8', 'surrogatepass')).digest()
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    Two-tier feature vector cache keyed by sequence digest and schema version
+    """
+
+    def __init__(self, n_features, version, max_entries=FEATURE_CACHE_SIZE,
+                 cache_dir=FEATURE_CACHE_DIR, flush_rows=FEATURE_CACHE_FLUSH_ROWS, max_mb=FEATURE_CACHE_MAX_MB):
+        self.n_features = n_features
+        self.version = str(version)
+        self.max_entries = max_entries
+        self.flush_rows = flush_rows
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.cache_dir = os.path.join(cache_dir, f"v{self.version}") if cache_dir else None
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._pending = OrderedDict()
+        self._shards = {}
+        self._shard_used = {}
+        self._disk_index = {}
+        self._disk_mtime = None
+        self._shard_counter = 0
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'shards_written': 0,
+                       'shards_deleted': 0}
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            atexit.register(self.flush)
+
+    # --- in-process tier ---
+
+    def _remember(self, digest, vector):
+        """Insert a vector into the LRU tier (caller holds the lock)"""
+        if self.max_entries <= 0:
+            return
+        self._memory[digest] = vector
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    # --- on-disk tier ---
+
+    def _refresh_disk_index(self):
+        """Index shards written since the last scan and forget deleted ones (caller holds the lock)"""
+        try:
+            mtime = os.stat(self.cache_dir).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._disk_mtime:
+            return
+        self._disk_mtime = mtime
+
+        present = set()
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.keys.npy'):
+                continue
+            shard = entry.name[:-len('.keys.npy')]
+            present.add(shard)
+            if shard in self._shards:
+                continue
+            try:
+                keys = np.load(entry.path)
+                vectors = np.load(os.path.join(self.cache_dir, shard + '.npy'), mmap_mode='r')
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable feature cache shard {shard}: {e}")
+                continue
+            if vectors.shape != (len(keys), self.n_features):
+                logger.warning(f"Skipping feature cache shard {shard} with shape {vectors.shape}")
+                continue
+            self._shards[shard] = vectors
+            for row, key in enumerate(keys):
+                self._disk_index[key.tobytes()] = (shard, row)
+
+        # Shards deleted by any process release their memory maps here
+        removed = set(self._shards) - present
+        if removed:
+            for shard in removed:
+                del self._shards[shard]
+                self._shard_used.pop(shard, None)
+            self._disk_index = {key: location for key, location in self._disk_index.items()
+                                if location[0] not in removed}
+
+    def _disk_lookup(self, digest):
+        """Look up a vector in the disk tier (caller holds the lock)"""
+        location = self._disk_index.get(digest)
+        if location is None:
+            return None
+        shard, row = location
+        now = time.time()
+        if now - self._shard_used.get(shard, 0) > _TOUCH_SECONDS:
+            # The modification time of the key file records the shard's last use
+            self._shard_used[shard] = now
+            try:
+                os.utime(os.path.join(self.cache_dir, shard + '.keys.npy'))
+            except OSError:
+                pass
+        return np.array(self._shards[shard][row])
+
+    def _prune_shards(self, keep):
+        """Delete the least recently used shards beyond max_bytes (caller holds the lock)"""
+        shards = {}
+        for entry in os.scandir(self.cache_dir):
+            name = entry.name
+            if name.endswith('.tmp'):
+                continue
+            shard = name[:-len('.keys.npy')] if name.endswith('.keys.npy') else name[:-len('.npy')]
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            size, last_used = shards.get(shard, (0, 0))
+            shards[shard] = (size + stat.st_size, max(last_used, stat.st_mtime))
+
+        total = sum(size for size, _ in shards.values())
+        for shard, (size, _) in sorted(shards.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if shard == keep:
+                continue
+            # The key file goes first so readers never index a shard without vectors
+            for suffix in ('.keys.npy', '.npy'):
+                try:
+                    os.unlink(os.path.join(self.cache_dir, shard + suffix))
+                except OSError:
+                    pass
+            total -= size
+            self._stats['shards_deleted'] += 1
+
+    def _write_shard(self, items):
+        """Write (digest, vector) pairs to a new shard (caller holds the lock)"""
+        self._shard_counter += 1
+        shard = f"{int(time.time() * 1000)}-{os.getpid()}-{self._shard_counter}"
+        keys = np.frombuffer(b''.join(digest for digest, _ in items), dtype=np.uint8).reshape(-1, 32)
+        vectors = np.stack([vector for _, vector in items])
+
+        # Write the vectors before the key file so readers never index a partial shard
+        for suffix, array in (('.npy', vectors), ('.keys.npy', keys)):
+            final_path = os.path.join(self.cache_dir, shard + suffix)
+            temp_path = final_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(temp_path, final_path)
+        self._stats['shards_written'] += 1
+        self._prune_shards(keep=shard)
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        try:
+            self._write_shard(list(self._pending.items()))
+        except OSError as e:
+            logger.error(f"Failed to write feature cache shard: {e}")
+        self._pending.clear()
+
+    def flush(self):
+        """Write pending vectors to the disk tier"""
+        if not self.cache_dir:
+            return
+        with self._lock:
+            self._flush_locked()
+
+    # --- public API ---
+
+    def get_features(self, sequences, extractor, stats=None):
+        """
+        Get the feature matrix for sequences, computing only the uncached ones
+
+        Args:
+            sequences: List of protein sequences
+            extractor: Callable mapping a list of sequences to an (n, n_features) matrix
+            stats: Optional dict that receives this call's 'hits', 'disk_hits',
+                'misses' and in-batch 'duplicates' counts
+
+        Returns:
+            numpy.ndarray: (N, n_features) feature matrix in input order
+        """
+        sequences = list(sequences)
+        X = np.empty((len(sequences), self.n_features), dtype=np.float64)
+        digests = [sequence_digest(seq) for seq in sequences]
+
+        call_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'duplicates': 0}
+        missing = OrderedDict()
+        with self._lock:
+            disk_refreshed = False
+            for i, digest in enumerate(digests):
+                vector = self._memory.get(digest)
+                if vector is not None:
+                    self._memory.move_to_end(digest)
+                    self._stats['hits'] += 1
+                    call_stats['hits'] += 1
+                    X[i] = vector
+                    continue
+                if digest in missing:
+                    # Duplicate within the batch: featurized once, served to every row
+                    missing[digest].append(i)
+                    self._stats['hits'] += 1
+                    call_stats['duplicates'] += 1
+                    continue
+                if self.cache_dir:
+                    if not disk_refreshed:
+                        self._refresh_disk_index()
+                        disk_refreshed = True
+                    vector = self._pending.get(digest)
+                    if vector is None:
+                        vector = self._disk_lookup(digest)
+                    if vector is not None:
+                        self._stats['disk_hits'] += 1
+                        call_stats['disk_hits'] += 1
+                        self._remember(digest, vector)
+                        X[i] = vector
+                        continue
+                missing[digest] = [i]
+
+        call_stats['misses'] = len(missing)
+        if stats is not None:
+            stats.update(call_stats)
+        if not missing:
+            return X
+
+        first_rows = [rows[0] for rows in missing.values()]
+        computed = extractor([sequences[i] for i in first_rows])
+
+        with self._lock:
+            self._stats['misses'] += len(missing)
+            for (digest, rows), vector in zip(missing.items(), computed):
+                vector = np.array(vector, dtype=np.float64)
+                X[rows] = vector
+                self._remember(digest, vector)
+                if self.cache_dir:
+                    self._pending[digest] = vector
+            if self.cache_dir and len(self._pending) >= self.flush_rows:
+                self._flush_locked()
+        return X
+
+    def lookup(self, sequences):
+        """
+        Get the cached vectors of sequences without computing missing ones
+
+        Args:
+            sequences: List of protein sequences
+
+        Returns:
+            tuple: ((N, n_features) matrix, (N,) boolean mask of the rows found);
+            rows not found are left uninitialized
+        """
+        X = np.empty((len(sequences), self.n_features), dtype=np.float64)
+        found = np.zeros(len(sequences), dtype=bool)
+        with self._lock:
+            if self.cache_dir:
+                self._refresh_disk_index()
+            for i, sequence in enumerate(sequences):
+                digest = sequence_digest(sequence)
+                vector = self._memory.get(digest)
+                if vector is not None:
+                    self._memory.move_to_end(digest)
+                    self._stats['hits'] += 1
+                elif self.cache_dir:
+                    vector = self._pending.get(digest)
+                    if vector is None:
+                        vector = self._disk_lookup(digest)
+                    if vector is not None:
+                        self._stats['disk_hits'] += 1
+                        self._remember(digest, vector)
+                if vector is None:
+                    self._stats['misses'] += 1
+                    continue
+                X[i] = vector
+                found[i] = True
+        return X, found
+
+    def put(self, sequences, vectors):
+        """
+        Store vectors computed outside get_features
+
+        Args:
+            sequences: List of protein sequences
+            vectors: (N, n_features) matrix in the same order
+        """
+        with self._lock:
+            for sequence, vector in zip(sequences, vectors):
+                digest = sequence_digest(sequence)
+                vector = np.array(vector, dtype=np.float64)
+                self._remember(digest, vector)
+                if self.cache_dir:
+                    self._pending[digest] = vector
+            if self.cache_dir and len(self._pending) >= self.flush_rows:
+                self._flush_locked()
+
+    def clear(self):
+        """Drop the in-process tier and reset statistics"""
+        with self._lock:
+            self._memory.clear()
+            self._pending.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def get_stats(self):
+        """Get hit, miss and eviction statistics"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'version': self.version,
+                'entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'disk_enabled': bool(self.cache_dir),
+                'disk_shards': len(self._shards),
+                'disk_max_mb': self.max_bytes / (1024 * 1024),
+                'disk_entries': len(self._disk_index),
+                'pending_entries': len(self._pending)
+            })
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
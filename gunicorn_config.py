@@ -10,10 +10,16 @@ bind = f"0.0.0.0:{os.environ.get('PORT', '5002')}"
 # Number of worker processes (use fewer on dev machines)
 workers = min(multiprocessing.cpu_count() * 2 + 1, 8)  # Cap at 8 workers
 
-# Worker class
-worker_class = "sync"
+# Worker class. gthread workers report to the master from their main loop,
+# so a /predict/stream response that runs for hours is not killed by timeout
+worker_class = "gthread"
 
-# Timeout for worker processes (increased for analysis tasks)
+# Threads per worker; more than one lets concurrent /predict calls share
+# micro-batches (see MICRO_BATCH_WINDOW_MS)
+threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+
+# Seconds a worker may go without reporting before it is restarted (a hung
+# worker, not a long request)
 timeout = 300
 
 # Access log settings
@@ -28,7 +34,8 @@ loglevel = "info"
 # Process name
 proc_name = "bacpred_app"
 
-# Preload application code for faster startup
+# Preload application code for faster startup. The app loads the model in
+# the master, so workers share its memory copy-on-write (see MODEL_PRELOAD)
 preload_app = True
 
 # Set environment variables
@@ -37,4 +44,16 @@ raw_env = [
 ]
 
 # Reload when code changes (useful for development)
-reload = False 
\ No newline at end of file
+reload = False
+
+
+def when_ready(server):
+    """Start the host's single analysis dispatcher from the master process"""
+    import analysis_jobs
+    analysis_jobs.start_dispatcher()
+
+
+def on_exit(server):
+    """Stop the analysis dispatcher with the master process"""
+    import analysis_jobs
+    analysis_jobs.stop_dispatcher()
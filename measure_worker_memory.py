@@ -0,0 +1,133 @@
+"""
+Measure per-worker memory of a running gunicorn deployment
+
+Reports RSS, PSS and shared/private memory for the gunicorn master and each
+worker from /proc/<pid>/smaps_rollup (Linux only). PSS divides shared pages
+between the processes that map them, so the PSS total is the real footprint
+of the deployment.
+
+To measure the savings from loading the model in the master, run the server
+twice and compare the totals:
+
+    MODEL_PRELOAD=false gunicorn -c gunicorn_config.py wsgi:app
+    python measure_worker_memory.py --pidfile /tmp/bacpred.pid --warmup http://127.0.0.1:5002
+
+    MODEL_PRELOAD=true gunicorn -c gunicorn_config.py wsgi:app
+    python measure_worker_memory.py --pidfile /tmp/bacpred.pid --warmup http://127.0.0.1:5002
+
+Start gunicorn with --pid /tmp/bacpred.pid (or pass --master-pid). The
+--warmup option sends a few /predict requests first so that every worker has
+served a prediction; without preloading each worker loads its own model copy
+on its first request.
+"""
+import os
+import sys
+import json
+import argparse
+import urllib.request
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+WARMUP_SEQUENCE = "ITSISLCTPGCKTGALMGCNMKTATCHCSIHVSK"
+
+
+def read_memory(pid):
+    """Read memory counters in kB for a process"""
+    values = {field: 0 for field in SMAPS_FIELDS}
+    path = f"/proc/{pid}/smaps_rollup"
+    if not os.path.exists(path):
+        path = f"/proc/{pid}/smaps"
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            key = parts[0].rstrip(':')
+            if key in values:
+                values[key] += int(parts[1])
+    return values
+
+
+def find_children(pid):
+    """Find the direct children of a process"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split after the closing paren
+        fields = stat[stat.rindex(')') + 2:].split()
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def warmup(url, requests_count):
+    """Send prediction requests so every worker has loaded the model"""
+    body = json.dumps({'sequences': [{'header': 'warmup', 'sequence': WARMUP_SEQUENCE}]}).encode()
+    for _ in range(requests_count):
+        request = urllib.request.Request(url.rstrip('/') + '/predict', data=body,
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure gunicorn master and worker memory')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--master-pid', type=int, help='PID of the gunicorn master')
+    group.add_argument('--pidfile', help='gunicorn pidfile (gunicorn --pid)')
+    parser.add_argument('--warmup', metavar='URL', help='Base URL to send /predict requests to first')
+    parser.add_argument('--warmup-requests', type=int, default=32, help='Number of warmup requests')
+    parser.add_argument('--json', action='store_true', help='Print the measurements as JSON')
+    args = parser.parse_args()
+
+    if args.pidfile:
+        with open(args.pidfile) as f:
+            master_pid = int(f.read().strip())
+    else:
+        master_pid = args.master_pid
+
+    if args.warmup:
+        warmup(args.warmup, args.warmup_requests)
+
+    processes = [('master', master_pid)] + [('worker', pid) for pid in find_children(master_pid)]
+    rows = []
+    for role, pid in processes:
+        memory = read_memory(pid)
+        rows.append({
+            'role': role,
+            'pid': pid,
+            'rss_kb': memory['Rss'],
+            'pss_kb': memory['Pss'],
+            'shared_kb': memory['Shared_Clean'] + memory['Shared_Dirty'],
+            'private_kb': memory['Private_Clean'] + memory['Private_Dirty']
+        })
+
+    workers = [row for row in rows if row['role'] == 'worker']
+    summary = {
+        'workers': len(workers),
+        'total_pss_kb': sum(row['pss_kb'] for row in rows),
+        'mean_worker_rss_kb': sum(row['rss_kb'] for row in workers) / len(workers) if workers else 0,
+        'mean_worker_private_kb': sum(row['private_kb'] for row in workers) / len(workers) if workers else 0
+    }
+
+    if args.json:
+        print(json.dumps({'processes': rows, 'summary': summary}, indent=2))
+        return 0
+
+    print(f"{'role':<8}{'pid':>8}{'rss_kb':>12}{'pss_kb':>12}{'shared_kb':>12}{'private_kb':>12}")
+    for row in rows:
+        print(f"{row['role']:<8}{row['pid']:>8}{row['rss_kb']:>12}{row['pss_kb']:>12}"
+              f"{row['shared_kb']:>12}{row['private_kb']:>12}")
+    print()
+    print(f"Workers: {summary['workers']}")
+    print(f"Mean worker RSS: {summary['mean_worker_rss_kb']:.0f} kB")
+    print(f"Mean worker private memory: {summary['mean_worker_private_kb']:.0f} kB")
+    print(f"Total PSS (master + workers): {summary['total_pss_kb']} kB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+Micro-batching for BioFASTA inference
+
+Concurrent prediction requests each pay the fixed cost of scaling and of
+walking every tree in the forest. The micro-batcher collects the feature
+matrices of requests arriving within a short window, scores them with one
+vectorized call and hands each caller its own slice of the probabilities.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+import numpy as np
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Time to wait for more requests after the first one arrives; 0 disables batching
+MICRO_BATCH_WINDOW_MS = float(os.getenv('MICRO_BATCH_WINDOW_MS', '0'))
+
+# Maximum rows scored together; larger requests are scored directly
+MICRO_BATCH_MAX_SIZE = int(os.getenv('MICRO_BATCH_MAX_SIZE', '256'))
+
+# Upper bounds of the histogram buckets
+_HISTOGRAM_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _bucket(value):
+    """Histogram bucket label for a value"""
+    for bound in _HISTOGRAM_BOUNDS:
+        if value <= bound:
+            return f"<={bound}"
+    return f">{_HISTOGRAM_BOUNDS[-1]}"
+
+
+class _PendingRequest:
+    """A feature matrix waiting to be scored"""
+
+    def __init__(self, X):
+        self.X = X
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Scores feature matrices from concurrent callers in shared batches
+
+    A background thread takes the first queued request, waits up to
+    window_ms for more to arrive (or until max_batch_size rows are queued),
+    then calls score_fn once on the concatenated matrix.
+    """
+
+    def __init__(self, score_fn, window_ms=MICRO_BATCH_WINDOW_MS, max_batch_size=MICRO_BATCH_MAX_SIZE):
+        self.score_fn = score_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._queued_rows = 0
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            'requests': 0,
+            'direct_requests': 0,
+            'batches': 0,
+            'rows': 0,
+            'errors': 0,
+            'max_queue_depth': 0,
+            'queue_depth_histogram': {},
+            'batch_size_histogram': {},
+            'batch_requests_histogram': {}
+        }
+
+    def _ensure_thread(self):
+        """Start the batching thread (caller holds the lock)"""
+        # Threads do not survive a fork, so a preloaded batcher restarts in each worker
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def _count(histogram, value):
+        label = _bucket(value)
+        histogram[label] = histogram.get(label, 0) + 1
+
+    def score(self, X):
+        """
+        Score a feature matrix, sharing the call with concurrent requests
+
+        Args:
+            X: (n, n_features) feature matrix
+
+        Returns:
+            numpy.ndarray: Probabilities for the rows of X
+        """
+        if len(X) >= self.max_batch_size:
+            with self._cond:
+                self._stats['direct_requests'] += 1
+            return self.score_fn(X)
+
+        request = _PendingRequest(X)
+        with self._cond:
+            self._ensure_thread()
+            self._queue.append(request)
+            self._queued_rows += len(X)
+            depth = len(self._queue)
+            self._stats['requests'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], depth)
+            self._count(self._stats['queue_depth_histogram'], depth)
+            self._cond.notify()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _take_batch(self):
+        """Wait for requests and remove one batch from the queue"""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            deadline = time.monotonic() + self.window
+            while self._queued_rows < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [self._queue.popleft()]
+            rows = len(batch[0].X)
+            while self._queue and rows + len(self._queue[0].X) <= self.max_batch_size:
+                request = self._queue.popleft()
+                batch.append(request)
+                rows += len(request.X)
+            self._queued_rows -= rows
+            return batch, rows
+
+    def _run(self):
+        while True:
+            batch, rows = self._take_batch()
+            try:
+                X = batch[0].X if len(batch) == 1 else np.concatenate([request.X for request in batch])
+                probabilities = self.score_fn(X)
+                offset = 0
+                for request in batch:
+                    request.result = probabilities[offset:offset + len(request.X)]
+                    offset += len(request.X)
+            except Exception as e:
+                logger.error(f"Error scoring micro-batch of {rows} rows: {e}")
+                for request in batch:
+                    request.error = e
+                with self._cond:
+                    self._stats['errors'] += 1
+            finally:
+                with self._cond:
+                    self._stats['batches'] += 1
+                    self._stats['rows'] += rows
+                    self._count(self._stats['batch_size_histogram'], rows)
+                    self._count(self._stats['batch_requests_histogram'], len(batch))
+                for request in batch:
+                    request.done.set()
+
+    def get_stats(self):
+        """Get queue depth and batch size statistics"""
+        with self._cond:
+            stats = dict(self._stats)
+            for key in ('queue_depth_histogram', 'batch_size_histogram', 'batch_requests_histogram'):
+                stats[key] = dict(self._stats[key])
+            stats['queue_depth'] = len(self._queue)
+        stats['window_ms'] = self.window * 1000.0
+        stats['max_batch_size'] = self.max_batch_size
+        stats['mean_batch_size'] = stats['rows'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
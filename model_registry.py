@@ -0,0 +1,238 @@
+"""
+Model registry for BioFASTA
+
+Loads the BacPred model artifacts once per process and shares them between
+the web app, the analysis module and the debug app.
+"""
+import os
+import gc
+import time
+import logging
+import threading
+import numpy as np
+from bacpred import BacteriocinPredictor, MODEL_DIR, positive_class_shap
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Optional joblib mmap_mode for the artifacts ('r' or 'c'); unset loads into the heap
+MODEL_MMAP_MODE = os.getenv('MODEL_MMAP_MODE') or None
+
+# Whether the web app loads the artifacts at import time (in the gunicorn master)
+PRELOAD_MODEL = os.getenv('MODEL_PRELOAD', 'true').lower() not in ('0', 'false', 'no')
+
+
+class ModelRegistry:
+    """
+    Lazily loads and caches a BacteriocinPredictor for the current process
+
+    The first caller pays the joblib deserialization cost; every later caller
+    gets the same predictor instance. Loading is guarded by a lock so
+    concurrent requests never load the artifacts twice.
+    """
+
+    def __init__(self, model_dir=None, mmap_mode=MODEL_MMAP_MODE):
+        self.model_dir = model_dir if model_dir else MODEL_DIR
+        self.mmap_mode = mmap_mode
+        self._lock = threading.Lock()
+        self._predictor = None
+        self._stats = {
+            'loaded': False,
+            'load_count': 0,
+            'load_time_seconds': None,
+            'loaded_at': None,
+            'pid': None,
+            'mmap_mode': mmap_mode,
+            'artifact_sizes': {},
+            'total_artifact_bytes': 0,
+            'feature_schema': None
+        }
+
+    def _load(self):
+        """Load the predictor and record load statistics (caller holds the lock)"""
+        start = time.perf_counter()
+        predictor = BacteriocinPredictor(model_dir=self.model_dir, mmap_mode=self.mmap_mode)
+        elapsed = time.perf_counter() - start
+
+        artifact_sizes = {}
+        for path in (predictor.model_file, predictor.scaler_file, predictor.features_file,
+                     predictor.schema_file, predictor.onnx_file):
+            if os.path.exists(path):
+                artifact_sizes[os.path.basename(path)] = os.path.getsize(path)
+
+        schema = predictor.feature_schema
+        self._stats.update({
+            'loaded': predictor.is_trained,
+            'backend': predictor.active_backend,
+            'feature_schema': {
+                'version': schema.version,
+                'hash': schema.hash,
+                'n_features': schema.n_features
+            } if schema is not None else None,
+            'load_count': self._stats['load_count'] + 1,
+            'load_time_seconds': elapsed,
+            'loaded_at': time.time(),
+            'pid': os.getpid(),
+            'artifact_sizes': artifact_sizes,
+            'total_artifact_bytes': sum(artifact_sizes.values())
+        })
+        logger.info("Model registry loaded artifacts from %s in %.3fs (%d bytes)",
+                    self.model_dir, elapsed, self._stats['total_artifact_bytes'])
+        self._predictor = predictor
+        return predictor
+
+    def get_predictor(self):
+        """Get the shared predictor, loading it on first use"""
+        predictor = self._predictor
+        if predictor is None:
+            with self._lock:
+                predictor = self._predictor
+                if predictor is None:
+                    predictor = self._load()
+        return predictor
+
+    def get_model(self):
+        """Get the shared classifier, or None if no trained model is available"""
+        return getattr(self.get_predictor(), 'model', None)
+
+    def get_scaler(self):
+        """Get the shared feature scaler, or None if no trained model is available"""
+        return getattr(self.get_predictor(), 'scaler', None)
+
+    def get_feature_schema(self):
+        """Get the feature schema of the model inputs, or None if no trained model is available"""
+        return getattr(self.get_predictor(), 'feature_schema', None)
+
+    def get_selected_features(self):
+        """Get the selected feature indices, or None if no selection artifact exists"""
+        return getattr(self.get_predictor(), 'selected_features_idx', None)
+
+    def get_explainer(self):
+        """
+        Get the shap.TreeExplainer of the shared classifier
+
+        The predictor builds it on first use and keeps it for its model version.
+
+        Returns:
+            shap.TreeExplainer: Explainer, or None if no trained model is available
+        """
+        predictor = self.get_predictor()
+        if getattr(predictor, 'model', None) is None:
+            return None
+        return predictor.get_explainer()
+
+    def get_shap_store(self, approximate=False):
+        """
+        Get the store of per-sequence SHAP vectors of the shared classifier
+
+        Args:
+            approximate (bool): Store of the Saabas approximations instead of exact SHAP values
+
+        Returns:
+            feature_cache.FeatureCache: Store, or None if no trained model is available
+        """
+        predictor = self.get_predictor()
+        if predictor.model_version is None or predictor.feature_schema is None:
+            return None
+        return predictor.get_shap_store(approximate)
+
+    def reload(self):
+        """Force the artifacts to be reloaded from disk"""
+        with self._lock:
+            return self._load()
+
+    def get_stats(self):
+        """Get load time and artifact size statistics"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['artifact_sizes'] = dict(self._stats['artifact_sizes'])
+        # A pid different from the current one means the artifacts were
+        # inherited from the preloading (gunicorn master) process
+        stats['inherited'] = stats['pid'] is not None and stats['pid'] != os.getpid()
+        batcher = getattr(self._predictor, 'batcher', None)
+        stats['micro_batcher'] = batcher.get_stats() if batcher is not None else None
+        shap_stores = getattr(self._predictor, '_shap_stores', None) or {}
+        stats['shap_store'] = {
+            ('approximate' if approximate else 'exact'): store.get_stats()
+            for approximate, store in list(shap_stores.items())
+        } or None
+        return stats
+
+
+# Process-wide default registry
+registry = ModelRegistry()
+
+
+def get_predictor():
+    """Get the process-wide shared predictor"""
+    return registry.get_predictor()
+
+
+def get_model():
+    """Get the process-wide shared classifier"""
+    return registry.get_model()
+
+
+def get_scaler():
+    """Get the process-wide shared feature scaler"""
+    return registry.get_scaler()
+
+
+def get_feature_schema():
+    """Get the process-wide feature schema of the model inputs"""
+    return registry.get_feature_schema()
+
+
+def get_selected_features():
+    """Get the process-wide selected feature indices"""
+    return registry.get_selected_features()
+
+
+def get_explainer():
+    """Get the process-wide SHAP TreeExplainer of the shared classifier"""
+    return registry.get_explainer()
+
+
+def get_shap_store(approximate=False):
+    """Get the process-wide store of per-sequence SHAP vectors"""
+    return registry.get_shap_store(approximate)
+
+
+def explain_chunk(feature_matrix, **shap_kwargs):
+    """
+    Class 1 SHAP values of model input rows with the process-wide explainer
+
+    Runs in the SHAP worker processes of the analysis module, each of which
+    loads the model artifacts and builds its own explainer on first use.
+
+    Args:
+        feature_matrix (numpy.ndarray): Model input rows
+        **shap_kwargs: Passed to explainer.shap_values
+
+    Returns:
+        tuple: (float32 SHAP values, seconds taken, process ID)
+    """
+    start = time.perf_counter()
+    values = positive_class_shap(get_explainer().shap_values(feature_matrix, **shap_kwargs))
+    return values.astype(np.float32), time.perf_counter() - start, os.getpid()
+
+
+def get_stats():
+    """Get load statistics for the process-wide registry"""
+    return registry.get_stats()
+
+
+def preload():
+    """
+    Load the shared artifacts now instead of on the first request
+
+    Called at import time of the web app, which gunicorn runs in the master
+    process when preload_app is enabled. Forked workers then share the
+    model pages copy-on-write instead of each loading a private copy.
+    Freezing the garbage collector keeps collections in the workers from
+    touching (and therefore copying) the preloaded objects.
+    """
+    predictor = registry.get_predictor()
+    gc.collect()
+    gc.freeze()
+    return predictor
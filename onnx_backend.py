@@ -0,0 +1,168 @@
+"""
+ONNX Runtime inference backend for BioFASTA
+
+Exports the StandardScaler + RandomForestClassifier pair from the model
+directory into a single ONNX graph and runs it with onnxruntime on CPU.
+
+The graph scales the float64 features with Sub/Div exactly as the scaler
+does, casts them to float32 as scikit-learn's trees do, and stores every
+split threshold rounded down to float32 so each tree takes the same branch
+as in scikit-learn. Probabilities are accumulated in float32 by the tree
+ensemble operator and therefore agree with scikit-learn to about 1e-6.
+
+skl2onnx (export only) and onnxruntime are optional dependencies:
+
+    pip install skl2onnx onnxruntime
+"""
+import os
+import copy
+import logging
+import numpy as np
+from feature_cache import file_sha256
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILENAME = 'bacteriocin_model.onnx'
+
+# Threads used by onnxruntime within one inference call
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', '1'))
+
+_TARGET_OPSET = {'': 17, 'ai.onnx.ml': 3}
+
+
+class OnnxUnavailable(Exception):
+    """Raised when the ONNX export cannot be used"""
+
+
+def _artifact_metadata(model_file, scaler_file, schema):
+    """Metadata tying an export to the joblib artifacts it was built from"""
+    return {
+        'model_sha256': file_sha256(model_file),
+        'scaler_sha256': file_sha256(scaler_file),
+        'feature_schema_hash': schema.hash if schema is not None else ''
+    }
+
+
+def _round_thresholds_down(forest):
+    """
+    Copy of a forest whose split thresholds are exactly representable in float32
+
+    scikit-learn compares float32 inputs with float64 thresholds. Rounding each
+    threshold down to the nearest float32 keeps every comparison's outcome
+    when the threshold is stored as float32 in the ONNX graph.
+    """
+    forest = copy.deepcopy(forest)
+    for estimator in forest.estimators_:
+        threshold = estimator.tree_.threshold
+        rounded = threshold.astype(np.float32)
+        above = rounded.astype(np.float64) > threshold
+        rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+        threshold[:] = rounded.astype(np.float64)
+    return forest
+
+
+def export_onnx(predictor, output_file=None):
+    """
+    Export a predictor's scaler and forest to a single ONNX graph
+
+    Args:
+        predictor: Trained BacteriocinPredictor
+        output_file: Destination (defaults to bacteriocin_model.onnx in the model directory)
+
+    Returns:
+        str: Path of the written file
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+
+    if not predictor.is_trained:
+        raise ValueError("Model is not trained")
+    output_file = output_file or os.path.join(predictor.model_dir, ONNX_MODEL_FILENAME)
+    scaler = predictor.scaler
+    n_features = int(scaler.n_features_in_)
+
+    forest = _round_thresholds_down(predictor.model)
+    onnx_model = convert_sklearn(
+        forest,
+        initial_types=[('scaled', FloatTensorType([None, n_features]))],
+        options={id(forest): {'zipmap': False}},
+        target_opset=_TARGET_OPSET
+    )
+
+    # Prepend the scaler: (x - mean) / scale in float64, then cast for the trees
+    graph = onnx_model.graph
+    del graph.input[:]
+    graph.input.append(helper.make_tensor_value_info('features', TensorProto.DOUBLE, [None, n_features]))
+    graph.initializer.extend([
+        numpy_helper.from_array(np.asarray(scaler.mean_, dtype=np.float64), 'scaler_mean'),
+        numpy_helper.from_array(np.asarray(scaler.scale_, dtype=np.float64), 'scaler_scale')
+    ])
+    forest_nodes = list(graph.node)
+    del graph.node[:]
+    graph.node.extend([
+        helper.make_node('Sub', ['features', 'scaler_mean'], ['centered']),
+        helper.make_node('Div', ['centered', 'scaler_scale'], ['scaled_double']),
+        helper.make_node('Cast', ['scaled_double'], ['scaled'], to=TensorProto.FLOAT)
+    ] + forest_nodes)
+
+    metadata = _artifact_metadata(predictor.model_file, predictor.scaler_file, predictor.feature_schema)
+    for key, value in metadata.items():
+        entry = onnx_model.metadata_props.add()
+        entry.key, entry.value = key, value
+    onnx.checker.check_model(onnx_model)
+
+    temp_file = output_file + '.tmp'
+    with open(temp_file, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+    os.replace(temp_file, output_file)
+    logger.info(f"Exported ONNX model to {output_file}")
+    return output_file
+
+
+class OnnxPipeline:
+    """
+    Scaler + forest ONNX graph run with onnxruntime
+
+    Takes unscaled float64 features laid out by the feature schema.
+    """
+
+    def __init__(self, onnx_file, model_file, scaler_file, schema=None, intra_op_threads=ONNX_INTRA_OP_THREADS):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise OnnxUnavailable("onnxruntime is not installed")
+        if not os.path.exists(onnx_file):
+            raise OnnxUnavailable(f"{onnx_file} does not exist; run 'python bacpred.py export-onnx'")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(onnx_file, options, providers=['CPUExecutionProvider'])
+
+        # Refuse an export built from different joblib artifacts
+        exported = self.session.get_modelmeta().custom_metadata_map
+        current = _artifact_metadata(model_file, scaler_file, schema)
+        stale = [key for key, value in current.items() if exported.get(key) != value]
+        if stale:
+            raise OnnxUnavailable(f"{onnx_file} is stale ({', '.join(stale)} changed); re-run the export")
+
+        self.onnx_file = onnx_file
+        self.intra_op_threads = intra_op_threads
+        logger.info(f"Loaded ONNX model {onnx_file} ({intra_op_threads} intra-op threads)")
+
+    def predict_proba(self, X):
+        """
+        Class probabilities for unscaled features
+
+        Args:
+            X: (n, n_features) feature matrix
+
+        Returns:
+            numpy.ndarray: (n, n_classes) float64 class probabilities
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        probabilities = self.session.run(['probabilities'], {'features': X})[0]
+        return probabilities.astype(np.float64)
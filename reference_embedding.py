@@ -0,0 +1,437 @@
+"""
+Fit-once, transform-many UMAP embedding of reference collections
+
+The reference vaults rarely change, yet every analysis used to refit UMAP
+on references plus candidates. Instead, UMAP is fit once on the reference
+sequences of the selected vaults and saved next to the model artifacts.
+Candidates, and references added since the fit, are placed with
+reducer.transform. Reference coordinates stay fixed across requests and
+sessions, so plots of the same vaults are comparable.
+
+Reference points are matched to the fit by the SHA-256 of their sequence.
+When the reference set has drifted from the fitted one by more than
+UMAP_REFIT_THRESHOLD, the saved embedding keeps serving requests while a
+background thread refits and replaces it. A selection without a fit of its
+own reuses the fit of a larger selection that already holds its references.
+Only the most recently used fits are kept in memory and on disk.
+"""
+import os
+import glob
+import time
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import joblib
+import umap
+from umap.umap_ import nearest_neighbors
+from sklearn.utils import check_random_state
+import bacpred
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Embed against a saved reference fit instead of refitting every request
+REFERENCE_EMBEDDING_ENABLED = os.getenv('UMAP_REFERENCE_EMBEDDING', 'true').lower() in ('1', 'true', 'yes')
+
+# Directory of the saved reference fits (defaults to the model directory)
+REFERENCE_EMBEDDING_DIR = os.getenv('REFERENCE_EMBEDDING_DIR') or bacpred.MODEL_DIR
+
+# Fraction of the fitted reference set that may be added or removed before a refit
+UMAP_REFIT_THRESHOLD = float(os.getenv('UMAP_REFIT_THRESHOLD', '0.1'))
+
+# Smallest reference set worth a separate fit
+MIN_REFERENCE_SEQUENCES = 10
+
+# Rows per transform call when placing sequences on a fitted embedding
+UMAP_TRANSFORM_CHUNK_SIZE = int(os.getenv('UMAP_TRANSFORM_CHUNK_SIZE', '4096'))
+
+# Processes transforming chunks in parallel (1 transforms in the calling process)
+UMAP_TRANSFORM_WORKERS = int(os.getenv('UMAP_TRANSFORM_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Saved fits kept in memory per process (least recently used are dropped first)
+REFERENCE_EMBEDDING_CACHE_SIZE = int(os.getenv('REFERENCE_EMBEDDING_CACHE_SIZE', '4'))
+
+# Saved fits kept on disk (least recently used are deleted first)
+REFERENCE_EMBEDDING_MAX_ARTIFACTS = int(os.getenv('REFERENCE_EMBEDDING_MAX_ARTIFACTS', '16'))
+
+# A refit lock older than this is assumed to belong to a dead process
+_REFIT_LOCK_SECONDS = 3600
+
+# A saved fit's modification time is refreshed on use at most this often
+_TOUCH_SECONDS = 3600
+
+_lock = threading.Lock()
+_loaded = OrderedDict()
+_refits = set()
+_fit_locks = {}
+
+
+def sequence_key(sequence):
+    """Key matching a reference point to its fitted coordinates"""
+    return hashlib.sha256(sequence.encode('utf-8')).hexdigest()
+
+
+def transform_in_chunks(reducer, feature_matrix):
+    """
+    Place rows on a fitted embedding, UMAP_TRANSFORM_CHUNK_SIZE rows per call
+
+    Chunks are transformed in UMAP_TRANSFORM_WORKERS processes, which bounds
+    the size of the neighbor search and optimization arrays of each call.
+
+    Args:
+        reducer (umap.UMAP): Fitted reducer
+        feature_matrix (numpy.ndarray): Rows to place
+
+    Returns:
+        numpy.ndarray: (N, n_components) coordinates
+    """
+    chunks = [
+        feature_matrix[start:start + UMAP_TRANSFORM_CHUNK_SIZE]
+        for start in range(0, len(feature_matrix), UMAP_TRANSFORM_CHUNK_SIZE)
+    ]
+    if len(chunks) == 1 or UMAP_TRANSFORM_WORKERS <= 1:
+        return np.vstack([reducer.transform(chunk) for chunk in chunks])
+    workers = min(UMAP_TRANSFORM_WORKERS, len(chunks))
+    return np.vstack(joblib.Parallel(n_jobs=workers)(joblib.delayed(reducer.transform)(chunk) for chunk in chunks))
+
+
+def _digest(document):
+    return hashlib.sha256(json.dumps(document, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def _settings_prefix(n_components, model_version, umap_params):
+    """Path prefix shared by the saved fits of one set of UMAP settings"""
+    digest = _digest({'n_components': n_components, 'model_version': model_version, 'umap': umap_params})
+    return os.path.join(REFERENCE_EMBEDDING_DIR, f"reference_umap_{digest}_")
+
+
+def artifact_path(vault_ids, n_components, model_version, umap_params):
+    """Path of the saved fit for a set of reference vaults"""
+    vaults = sorted(int(vault_id) for vault_id in vault_ids)
+    return f"{_settings_prefix(n_components, model_version, umap_params)}{_digest(vaults)}.joblib"
+
+
+def _vaults_path(path):
+    """Path of the file listing the vaults of a saved fit"""
+    return f"{path[:-len('.joblib')]}.json"
+
+
+def _fit_lock(path):
+    """Lock serializing the fits of one saved embedding within this process"""
+    with _lock:
+        return _fit_locks.setdefault(path, threading.Lock())
+
+
+def _write_atomically(path, write):
+    """Write a file through a private temporary file, so readers never see a partial one"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _remember(path, identity, artifact):
+    with _lock:
+        _loaded[path] = (identity, artifact)
+        _loaded.move_to_end(path)
+        while len(_loaded) > REFERENCE_EMBEDDING_CACHE_SIZE:
+            _loaded.popitem(last=False)
+
+
+def prune(keep=None):
+    """
+    Delete the least recently used saved fits beyond REFERENCE_EMBEDDING_MAX_ARTIFACTS
+
+    Args:
+        keep (str): Path of a fit that is never deleted
+    """
+    paths = glob.glob(os.path.join(REFERENCE_EMBEDDING_DIR, 'reference_umap_*.joblib'))
+    if len(paths) <= REFERENCE_EMBEDDING_MAX_ARTIFACTS:
+        return
+
+    def last_used(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
+    paths.sort(key=last_used, reverse=True)
+    for path in paths[REFERENCE_EMBEDDING_MAX_ARTIFACTS:]:
+        if path == keep:
+            continue
+        for stale_path in (path, _vaults_path(path)):
+            try:
+                os.unlink(stale_path)
+            except OSError:
+                pass
+        with _lock:
+            _loaded.pop(path, None)
+        logger.info(f"Deleted unused reference UMAP {path}")
+
+
+def _fit_rows(num_rows, max_fit_rows, random_state):
+    """Rows of the reference matrix UMAP is fit on, or None for all of them"""
+    if max_fit_rows and num_rows > max_fit_rows:
+        # Large reference sets are fit on a sample; the rest get fixed transformed coordinates
+        return np.sort(np.random.RandomState(random_state).choice(num_rows, max_fit_rows, replace=False))
+    return None
+
+
+def neighbors(feature_matrix, umap_params, max_fit_rows=None):
+    """
+    Approximate kNN graph of the rows a reference fit is computed on
+
+    The graph does not depend on n_components or min_dist, so one search
+    serves the 2D and the 3D fit of the same references.
+
+    Args:
+        feature_matrix (numpy.ndarray): Reference feature matrix
+        umap_params (dict): n_neighbors, min_dist, metric and random_state
+        max_fit_rows (int): Largest reference sample UMAP is fit on
+
+    Returns:
+        tuple: (knn_indices, knn_dists, knn_search_index), as fit() takes it
+    """
+    rows = _fit_rows(len(feature_matrix), max_fit_rows, umap_params.get('random_state'))
+    fit_matrix = feature_matrix if rows is None else feature_matrix[rows]
+    return nearest_neighbors(
+        fit_matrix, min(umap_params['n_neighbors'], len(fit_matrix) - 1), umap_params['metric'], {}, False,
+        check_random_state(umap_params.get('random_state')), low_memory=True, n_jobs=1
+    )
+
+
+def fit(path, vault_ids, keys, feature_matrix, n_components, umap_params, max_fit_rows=None,
+        precomputed_knn=None):
+    """
+    Fit UMAP on reference feature vectors and save it
+
+    Args:
+        path (str): Destination of the fit
+        vault_ids (list): Reference vaults the rows come from
+        keys (list): sequence_key of each row
+        feature_matrix (numpy.ndarray): Reference feature matrix
+        n_components (int): Embedding dimensions
+        umap_params (dict): n_neighbors, min_dist, metric and random_state
+        max_fit_rows (int): Fit on a random sample of this many rows and
+            transform the others (default: fit on all rows)
+        precomputed_knn (tuple): Graph from neighbors() for the same rows and
+            settings (default: UMAP searches neighbors itself)
+
+    Returns:
+        dict: The saved fit (reducer, reference keys and their coordinates)
+    """
+    start = time.perf_counter()
+    params = dict(umap_params)
+    params['precomputed_knn'] = precomputed_knn if precomputed_knn is not None else (None, None, None)
+    fit_rows = _fit_rows(len(feature_matrix), max_fit_rows, params.get('random_state'))
+    if fit_rows is not None:
+        params['n_neighbors'] = min(params['n_neighbors'], len(fit_rows) - 1)
+        other_rows = np.setdiff1d(np.arange(len(feature_matrix)), fit_rows)
+        reducer = umap.UMAP(n_components=n_components, low_memory=True, **params)
+        embedding = np.empty((len(feature_matrix), n_components), dtype=np.float32)
+        embedding[fit_rows] = reducer.fit_transform(feature_matrix[fit_rows])
+        embedding[other_rows] = transform_in_chunks(reducer, feature_matrix[other_rows])
+    else:
+        params['n_neighbors'] = min(params['n_neighbors'], len(feature_matrix) - 1)
+        reducer = umap.UMAP(n_components=n_components, **params)
+        embedding = reducer.fit_transform(feature_matrix)
+
+    artifact = {
+        'reducer': reducer,
+        'keys': list(keys),
+        'embedding': embedding,
+        'fitted_at': time.time()
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    vaults = sorted(int(vault_id) for vault_id in vault_ids)
+
+    def write_vaults(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump({'vaults': vaults}, f)
+
+    # The vault list goes first, so a saved fit is never listed under other vaults
+    _write_atomically(_vaults_path(path), write_vaults)
+    _write_atomically(path, lambda temp_path: joblib.dump(artifact, temp_path))
+    stat = os.stat(path)
+    _remember(path, (stat.st_ino, stat.st_size), artifact)
+    logger.info(f"Fitted {n_components}D reference UMAP on {len(keys)} sequences in "
+                f"{time.perf_counter() - start:.2f}s ({path})")
+    prune(keep=path)
+    return artifact
+
+
+def load(path):
+    """
+    Load a saved fit, reusing the copy in memory until the file is replaced
+
+    Using a fit refreshes its modification time, which prune() goes by.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    # Fits are replaced with a new file, so the inode identifies the version
+    identity = (stat.st_ino, stat.st_size)
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is not None and cached[0] == identity:
+            _loaded.move_to_end(path)
+    if cached is not None and cached[0] == identity:
+        artifact = cached[1]
+    else:
+        try:
+            artifact = joblib.load(path)
+        except Exception as e:
+            logger.warning(f"Could not load reference UMAP {path}: {e}")
+            return None
+        _remember(path, identity, artifact)
+    if time.time() - stat.st_mtime > _TOUCH_SECONDS:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+    return artifact
+
+
+def _covering_fit(vault_ids, n_components, model_version, umap_params, reference_keys):
+    """
+    Saved fit of a larger set of vaults that already places these references
+
+    Used when the selected vaults have no fit of their own, as long as at most
+    UMAP_REFIT_THRESHOLD of their references are missing from it. The smallest
+    such selection wins.
+    """
+    selected = {int(vault_id) for vault_id in vault_ids}
+    candidates = []
+    for vaults_path in glob.glob(f"{_settings_prefix(n_components, model_version, umap_params)}*.json"):
+        try:
+            with open(vaults_path) as f:
+                vaults = set(json.load(f)['vaults'])
+        except (OSError, ValueError, KeyError):
+            continue
+        if vaults > selected:
+            candidates.append((len(vaults), vaults_path))
+
+    for _, vaults_path in sorted(candidates):
+        path = f"{vaults_path[:-len('.json')]}.joblib"
+        artifact = load(path)
+        if artifact is None:
+            continue
+        fitted = set(artifact['keys'])
+        missing = sum(1 for key in reference_keys if key not in fitted)
+        if missing / len(reference_keys) <= UMAP_REFIT_THRESHOLD:
+            logger.info(f"Reusing reference UMAP {path} for vaults {sorted(selected)}")
+            return artifact
+    return None
+
+
+def _refit_in_background(path, vault_ids, keys, feature_matrix, n_components, umap_params, max_fit_rows=None):
+    """Refit a drifted reference embedding once, in one thread across all processes"""
+    lock_path = f"{path}.lock"
+    with _lock:
+        if path in _refits:
+            return
+        _refits.add(path)
+    try:
+        if os.path.exists(lock_path) and time.time() - os.path.getmtime(lock_path) > _REFIT_LOCK_SECONDS:
+            os.unlink(lock_path)
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except OSError:
+        # Another process is already refitting
+        with _lock:
+            _refits.discard(path)
+        return
+
+    def run():
+        try:
+            with _fit_lock(path):
+                fit(path, vault_ids, keys, feature_matrix, n_components, umap_params, max_fit_rows)
+        except Exception as e:
+            logger.error(f"Error refitting reference UMAP {path}: {e}")
+        finally:
+            try:
+                os.unlink(lock_path)
+            except OSError:
+                pass
+            with _lock:
+                _refits.discard(path)
+
+    logger.info(f"Reference set changed by more than {UMAP_REFIT_THRESHOLD:.0%}; refitting {path} in the background")
+    threading.Thread(target=run, name='reference-umap-refit', daemon=True).start()
+
+
+def embed(sequences, sources, feature_matrix, vault_ids, n_components, model_version, umap_params,
+          max_fit_rows=None, reference_neighbors=None):
+    """
+    Embed sequences against the saved fit of their reference vaults
+
+    The first request for a set of vaults fits and saves the embedding,
+    unless the saved fit of a larger set of vaults already covers them.
+
+    Args:
+        sequences (list): Protein sequences
+        sources (list): 'reference' or 'candidate' for each sequence
+        feature_matrix (numpy.ndarray): Model input matrix of the sequences
+        vault_ids (list): Reference vault IDs
+        n_components (int): Embedding dimensions
+        model_version (str): Version of the model behind the feature matrix
+        umap_params (dict): n_neighbors, min_dist, metric and random_state
+        max_fit_rows (int): Largest reference sample UMAP is fit on
+        reference_neighbors (callable): Returns the neighbors() graph of the
+            reference rows; called only when a fit is needed, so callers can
+            share one graph between the 2D and 3D embeddings
+
+    Returns:
+        numpy.ndarray: (N, n_components) coordinates, or None when there are
+        too few references for a separate fit
+    """
+    reference_rows = [i for i, source in enumerate(sources) if source == 'reference']
+    if not vault_ids or len(reference_rows) < MIN_REFERENCE_SEQUENCES:
+        return None
+
+    keys = [sequence_key(sequence) for sequence in sequences]
+    reference_keys = [keys[i] for i in reference_rows]
+    path = artifact_path(vault_ids, n_components, model_version, umap_params)
+    artifact = load(path)
+    if artifact is not None:
+        fitted = set(artifact['keys'])
+        drift = len(fitted.symmetric_difference(reference_keys)) / max(len(fitted), 1)
+        if drift > UMAP_REFIT_THRESHOLD:
+            _refit_in_background(path, vault_ids, reference_keys, feature_matrix[reference_rows], n_components,
+                                 umap_params, max_fit_rows)
+    else:
+        artifact = _covering_fit(vault_ids, n_components, model_version, umap_params, reference_keys)
+    if artifact is None:
+        # Concurrent requests for the same missing fit wait for the first one
+        with _fit_lock(path):
+            artifact = load(path)
+            if artifact is None:
+                precomputed_knn = reference_neighbors() if reference_neighbors is not None else None
+                artifact = fit(path, vault_ids, reference_keys, feature_matrix[reference_rows], n_components,
+                               umap_params, max_fit_rows, precomputed_knn)
+
+    # Fitted references keep their coordinates; everything else is transformed
+    position = {key: row for row, key in enumerate(artifact['keys'])}
+    coords = np.empty((len(sequences), n_components), dtype=np.float64)
+    known = [i for i in reference_rows if keys[i] in position]
+    if known:
+        coords[known] = artifact['embedding'][[position[keys[i]] for i in known]]
+    known_set = set(known)
+    rest = [i for i in range(len(sequences)) if i not in known_set]
+    if rest:
+        start = time.perf_counter()
+        coords[rest] = transform_in_chunks(artifact['reducer'], feature_matrix[rest])
+        logger.info(f"Placed {len(rest)} sequences on the {n_components}D reference UMAP in "
+                    f"{time.perf_counter() - start:.2f}s")
+    return coords
@@ -138,6 +138,37 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    /**
+     * Poll an analysis job until it finishes and resolve with its result
+     */
+    function waitForAnalysisJob(jobId) {
+        const pollInterval = 1000;
+        
+        return new Promise((resolve, reject) => {
+            const poll = () => {
+                fetch(`/api/analyze/jobs/${jobId}`)
+                    .then(response => response.json())
+                    .then(job => {
+                        if (!job.success) {
+                            throw new Error(job.message || 'Analysis job not found');
+                        }
+                        
+                        const status = job.data.status;
+                        if (status === 'succeeded' || status === 'failed') {
+                            return fetch(`/api/analyze/jobs/${jobId}/result`)
+                                .then(response => response.json())
+                                .then(resolve);
+                        }
+                        
+                        updateLoadingProgress(job.data.progress, job.data.message);
+                        setTimeout(poll, pollInterval);
+                    })
+                    .catch(reject);
+            };
+            poll();
+        });
+    }
+    
     /**
      * Perform analysis with the selected vaults and bags
      */
@@ -174,11 +205,17 @@ document.addEventListener('DOMContentLoaded', function() {
             },
             body: JSON.stringify(requestData)
         })
-        .then(response => {
-            if (!response.ok) {
-                throw new Error(`Server responded with status: ${response.status}`);
+        .then(response => response.json())
+        .then(job => {
+            if (!job.success) {
+                throw new Error(job.message || 'Analysis could not be started');
             }
-            return response.json();
+            // Cached analyses are returned directly
+            if (!job.data || !job.data.job_id) {
+                return job;
+            }
+            // The analysis runs in the background; wait for the job to finish
+            return waitForAnalysisJob(job.data.job_id);
         })
         .then(data => {
             hideLoading();
@@ -526,6 +563,7 @@ document.addEventListener('DOMContentLoaded', function() {
         
         if (loadingIndicator) {
             loadingIndicator.style.display = 'flex';
+            loadingIndicator.querySelector('p').textContent = 'Processing analysis...';
         }
         
         if (placeholderMessage) {
@@ -533,6 +571,17 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    // Show the progress of a running analysis under the loading spinner
+    function updateLoadingProgress(progress, message) {
+        const loadingText = resultsContainer && resultsContainer.querySelector('.loading-indicator p');
+        if (!loadingText) {
+            return;
+        }
+        
+        const percent = Math.round((progress || 0) * 100);
+        loadingText.textContent = `${message || 'Processing analysis...'} (${percent}%)`;
+    }
+    
     // Hide loading indicator
     function hideLoading() {
         if (!resultsContainer) {
@@ -0,0 +1,10 @@
+"""
+Shared pytest setup for the BioFASTA tests
+
+The application modules live at the repository root and are imported as
+top-level modules, so the root is put on sys.path.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,74 @@
+"""
+Analysis cache keys and vault/bag membership versions
+
+Membership versions are read through database.get_membership_versions,
+which is replaced here by an in-memory table so no Postgres is needed.
+"""
+import pytest
+
+import analysis_cache
+import database
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    table = {'vaults': {}, 'bags': {}}
+
+    def get_membership_versions(vault_ids, bag_ids):
+        return {'success': True, 'data': {
+            'vaults': {int(i): table['vaults'].get(int(i), 0) for i in vault_ids},
+            'bags': {int(i): table['bags'].get(int(i), 0) for i in bag_ids}
+        }}
+
+    monkeypatch.setattr(database, 'get_membership_versions', get_membership_versions)
+    monkeypatch.setattr(analysis_cache, '_model_version', lambda: 'model')
+    monkeypatch.setattr(analysis_cache, 'ANALYSIS_CACHE_MAX_MB', 256)
+    return table
+
+
+PARAMS = {'vaults': [1, 2], 'bags': [7], 'n_neighbors': 15}
+
+
+def test_key_is_stable(versions):
+    key = analysis_cache.make_cache_key('umap', PARAMS)
+    assert key is not None
+    assert analysis_cache.make_cache_key('umap', PARAMS) == key
+    assert analysis_cache.make_cache_key('umap', dict(PARAMS, vaults=['2', 1, 2])) == key
+
+
+def test_key_changes_with_vault_membership(versions):
+    key = analysis_cache.make_cache_key('umap', PARAMS)
+    versions['vaults'][2] = 1
+    assert analysis_cache.make_cache_key('umap', PARAMS) != key
+
+
+def test_key_changes_with_bag_membership(versions):
+    key = analysis_cache.make_cache_key('umap', PARAMS)
+    versions['bags'][7] = 1
+    assert analysis_cache.make_cache_key('umap', PARAMS) != key
+
+
+def test_key_ignores_unselected_containers(versions):
+    key = analysis_cache.make_cache_key('umap', PARAMS)
+    versions['vaults'][3] = 5
+    versions['bags'][8] = 5
+    assert analysis_cache.make_cache_key('umap', PARAMS) == key
+
+
+def test_key_changes_with_selection_tool_and_options(versions):
+    key = analysis_cache.make_cache_key('umap', PARAMS)
+    assert analysis_cache.make_cache_key('umap', dict(PARAMS, vaults=[1])) != key
+    assert analysis_cache.make_cache_key('umap', dict(PARAMS, bags=[])) != key
+    assert analysis_cache.make_cache_key('msa', PARAMS) != key
+    assert analysis_cache.make_cache_key('umap', dict(PARAMS, n_neighbors=30)) != key
+
+
+def test_no_key_without_versions(versions, monkeypatch):
+    monkeypatch.setattr(database, 'get_membership_versions',
+                        lambda vault_ids, bag_ids: {'success': False, 'message': 'down', 'data': None})
+    assert analysis_cache.make_cache_key('umap', PARAMS) is None
+
+
+def test_no_key_when_disabled(versions, monkeypatch):
+    monkeypatch.setattr(analysis_cache, 'ANALYSIS_CACHE_MAX_MB', 0)
+    assert analysis_cache.make_cache_key('umap', PARAMS) is None
@@ -0,0 +1,51 @@
+"""
+Compiled random forest against scikit-learn's predict_proba
+"""
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import compiled_forest
+
+
+@pytest.fixture(scope='module')
+def forest():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 30))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(scale=0.5, size=400) > 0).astype(int)
+    return RandomForestClassifier(n_estimators=25, random_state=42).fit(X, y)
+
+
+@pytest.fixture(scope='module')
+def samples():
+    return np.random.default_rng(1).normal(size=(300, 30))
+
+
+@pytest.mark.parametrize('n', [1, 2, 17, 256])
+def test_matches_sklearn(forest, samples, n):
+    compiled = compiled_forest.CompiledForest(forest)
+    np.testing.assert_array_equal(compiled.predict_proba(samples[:n]), forest.predict_proba(samples[:n]))
+
+
+def test_matches_sklearn_on_training_thresholds(forest):
+    # Samples placed exactly on split thresholds must follow the same branch
+    thresholds = forest.estimators_[0].tree_.threshold
+    X = np.tile(thresholds[thresholds != -2][:, np.newaxis], (1, 30))[:200]
+    compiled = compiled_forest.CompiledForest(forest, max_batch=len(X))
+    np.testing.assert_array_equal(compiled.predict_proba(X), forest.predict_proba(X))
+
+
+def test_small_traversal_blocks_match_sklearn(forest, samples, monkeypatch):
+    monkeypatch.setattr(compiled_forest, 'TRAVERSAL_BLOCK_SIZE', 64)
+    compiled = compiled_forest.CompiledForest(forest, max_batch=len(samples))
+    np.testing.assert_array_equal(compiled.predict_proba(samples), forest.predict_proba(samples))
+
+
+def test_large_batches_are_delegated(forest, samples):
+    compiled = compiled_forest.CompiledForest(forest, max_batch=10)
+    np.testing.assert_array_equal(compiled.predict_proba(samples), forest.predict_proba(samples))
+
+
+def test_rejects_wrong_feature_count(forest, samples):
+    with pytest.raises(ValueError):
+        compiled_forest.CompiledForest(forest).predict_proba(samples[:5, :10])
@@ -0,0 +1,91 @@
+"""
+Feature schema checks against the extractor and the model artifacts
+"""
+import json
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+import bacpred
+from bacpred import FeatureSchema, FeatureSchemaError
+
+FEATURE_IDX = np.array([0, 20, 420, 432])
+
+
+def _fit_artifacts(n_features):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(40, n_features))
+    y = np.arange(40) % 2
+    scaler = StandardScaler().fit(X)
+    return scaler, RandomForestClassifier(n_estimators=3, random_state=0).fit(scaler.transform(X), y)
+
+
+def test_matching_artifacts_pass():
+    scaler, model = _fit_artifacts(len(FEATURE_IDX))
+    FeatureSchema.from_indices(FEATURE_IDX).validate(scaler, model, FEATURE_IDX)
+
+
+def test_feature_count_mismatch():
+    scaler, model = _fit_artifacts(len(FEATURE_IDX) + 1)
+    with pytest.raises(FeatureSchemaError, match='expects 5 features'):
+        FeatureSchema.from_indices(FEATURE_IDX).validate(scaler, model)
+
+
+def test_model_feature_count_mismatch():
+    scaler, _ = _fit_artifacts(len(FEATURE_IDX))
+    _, model = _fit_artifacts(len(FEATURE_IDX) - 1)
+    with pytest.raises(FeatureSchemaError, match='model expects 3 features'):
+        FeatureSchema.from_indices(FEATURE_IDX).validate(scaler, model)
+
+
+def test_selected_features_mismatch():
+    scaler, model = _fit_artifacts(len(FEATURE_IDX))
+    with pytest.raises(FeatureSchemaError, match='selected_features'):
+        FeatureSchema.from_indices(FEATURE_IDX).validate(scaler, model, FEATURE_IDX[::-1])
+
+
+def test_version_mismatch():
+    scaler, model = _fit_artifacts(len(FEATURE_IDX))
+    schema = FeatureSchema([bacpred.FEATURE_NAMES[i] for i in FEATURE_IDX], version=bacpred.FEATURE_SCHEMA_VERSION + 1)
+    with pytest.raises(FeatureSchemaError, match='retrain'):
+        schema.validate(scaler, model)
+
+
+def test_dtype_mismatch():
+    scaler, model = _fit_artifacts(len(FEATURE_IDX))
+    schema = FeatureSchema([bacpred.FEATURE_NAMES[i] for i in FEATURE_IDX], dtype='float32')
+    with pytest.raises(FeatureSchemaError, match='dtype'):
+        schema.validate(scaler, model)
+
+
+def test_unknown_feature():
+    scaler, model = _fit_artifacts(2)
+    with pytest.raises(FeatureSchemaError, match='does not produce'):
+        FeatureSchema(['A', 'Not_A_Feature']).validate(scaler, model)
+
+
+def test_duplicate_feature():
+    scaler, model = _fit_artifacts(2)
+    with pytest.raises(FeatureSchemaError, match='duplicate'):
+        FeatureSchema(['A', 'A']).validate(scaler, model)
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'feature_schema.json'
+    schema = FeatureSchema.from_indices(FEATURE_IDX)
+    schema.save(path)
+    loaded = FeatureSchema.load(path)
+    assert loaded.hash == schema.hash
+    np.testing.assert_array_equal(loaded.feature_idx, FEATURE_IDX)
+
+
+def test_corrupt_file(tmp_path):
+    path = tmp_path / 'feature_schema.json'
+    FeatureSchema.from_indices(FEATURE_IDX).save(path)
+    data = json.loads(path.read_text())
+    data['feature_names'][0] = 'C'
+    path.write_text(json.dumps(data))
+    with pytest.raises(FeatureSchemaError, match='corrupt'):
+        FeatureSchema.load(path)
@@ -0,0 +1,119 @@
+"""
+Vectorized feature extraction against the original per-sequence extractor
+"""
+import random
+
+import numpy as np
+import pytest
+
+import bacpred
+import feature_cache
+
+
+def _reference_features(sequence):
+    """Per-sequence extractor that predates the vectorized one, kept as the oracle"""
+    seq = sequence.upper()
+    L = len(seq)
+    aa_list = list(bacpred.AMINO_ACIDS)
+
+    aa_counts = {aa: 0 for aa in aa_list}
+    for aa in seq:
+        if aa in aa_counts:
+            aa_counts[aa] += 1
+    features = [aa_counts[aa] / L if L > 0 else 0.0 for aa in aa_list]
+
+    dipeptide_counts = {aa1 + aa2: 0 for aa1 in aa_list for aa2 in aa_list}
+    for i in range(L - 1):
+        if seq[i:i + 2] in dipeptide_counts:
+            dipeptide_counts[seq[i:i + 2]] += 1
+    features.extend(dipeptide_counts[dp] / (L - 1) if L > 1 else 0.0 for dp in sorted(dipeptide_counts))
+
+    positive_count = sum(aa_counts[aa] for aa in 'KRH')
+    negative_count = sum(aa_counts[aa] for aa in 'DE')
+    transitions = sum(
+        (seq[i] in bacpred.HYDROPHOBIC_AAS) != (seq[i + 1] in bacpred.HYDROPHOBIC_AAS) for i in range(L - 1)
+    )
+    cxc = sum(seq[i] == 'C' and seq[i + 2] == 'C' for i in range(L - 2))
+    cxxc = sum(seq[i] == 'C' and seq[i + 3] == 'C' for i in range(L - 3))
+    gg = sum(seq[i:i + 2] == 'GG' for i in range(L - 1))
+    pgp = sum(seq[i:i + 3] == 'PGP' for i in range(L - 2))
+    ls = sum(seq[i:i + 2] == 'LS' for i in range(L - 3))
+    features.extend([
+        aa_counts['C'] / L if L > 0 else 0,
+        dipeptide_counts['CC'] / (L - 1) if L > 1 else 0,
+        sum(bacpred.HYDROPHOBICITY.get(aa, 0) for aa in seq) / L if L > 0 else 0,
+        (positive_count - negative_count) / L if L > 0 else 0,
+        positive_count / L if L > 0 else 0,
+        negative_count / L if L > 0 else 0,
+        transitions / (L - 1) if L > 1 else 0,
+        1.0 if 20 <= L <= 60 else 0.5,
+        cxc / (L - 2) if L > 2 else 0,
+        cxxc / (L - 3) if L > 3 else 0,
+        gg / (L - 1) if L > 1 else 0,
+        pgp / (L - 2) if L > 2 else 0,
+        ls / (L - 3) if L > 3 else 0
+    ])
+    return np.array(features)
+
+
+def _random_sequences(n, seed=0):
+    rng = random.Random(seed)
+    alphabet = bacpred.AMINO_ACIDS * 4 + 'XBZU*-' + bacpred.AMINO_ACIDS.lower()
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 120))) for _ in range(n)]
+
+
+# Short and degenerate sequences exercise every length guard in the extractor
+EDGE_SEQUENCES = [
+    '', 'A', 'C', 'CC', 'CAC', 'CAAC', 'GG', 'PGP', 'LS', 'LSA', 'LSAA', 'ls', 'xyz', 'CXC',
+    'MKKIEKLTEKEMANIIGGKYYGNGVTCGKHSCSVDWGKATTCIINNGAMAWATGGHQGNHKC'
+]
+
+
+@pytest.fixture
+def sequences():
+    return EDGE_SEQUENCES + _random_sequences(300)
+
+
+def test_batch_matches_per_sequence_extractor(sequences):
+    expected = np.array([_reference_features(s) for s in sequences])
+    X = bacpred.extract_features_batch(sequences, workers=1)
+
+    assert X.shape == (len(sequences), bacpred.NUM_FEATURES)
+    assert X.dtype == np.float64
+    np.testing.assert_allclose(X, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_small_chunks_match_per_sequence_extractor(sequences):
+    expected = np.array([_reference_features(s) for s in sequences])
+    np.testing.assert_allclose(
+        bacpred.extract_features_batch(sequences, chunk_size=7, workers=1), expected, rtol=1e-12, atol=1e-12
+    )
+
+
+def test_parallel_matches_serial(sequences, monkeypatch):
+    monkeypatch.setattr(bacpred, 'PARALLEL_FEATURE_THRESHOLD', 1)
+    serial = bacpred.extract_features_batch(sequences, chunk_size=32, workers=1)
+    parallel = bacpred.extract_features_batch(sequences, chunk_size=32, workers=2)
+    np.testing.assert_array_equal(parallel, serial)
+
+
+def test_predictor_extract_features_matches_per_sequence_extractor():
+    for sequence in EDGE_SEQUENCES:
+        np.testing.assert_allclose(
+            bacpred.BacteriocinPredictor.extract_features(None, sequence), _reference_features(sequence),
+            rtol=1e-12, atol=1e-12
+        )
+
+
+def test_feature_plan_selects_full_extractor_columns(sequences):
+    feature_idx = np.array([432, 3, 420, 21, 419, 5, 425, 100, 427])
+    plan = bacpred.FeaturePlan(feature_idx)
+    full = bacpred.extract_features_batch(sequences, workers=1)
+    np.testing.assert_array_equal(bacpred.extract_features_batch(sequences, workers=1, plan=plan), full[:, feature_idx])
+
+
+def test_cached_features_match_uncached(sequences, monkeypatch):
+    monkeypatch.setattr(bacpred, 'FEATURE_CACHE', feature_cache.FeatureCache(bacpred.NUM_FEATURES, 'test', cache_dir=None))
+    expected = bacpred.extract_features_batch(sequences, workers=1)
+    np.testing.assert_array_equal(bacpred.extract_features_cached(sequences, workers=1), expected)
+    np.testing.assert_array_equal(bacpred.extract_features_cached(sequences[::-1], workers=1), expected[::-1])